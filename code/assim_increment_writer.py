@@ -0,0 +1,153 @@
+"""
+netCDF4 writers for the NEMO assimilation input files (asminc).
+
+- assim_background_increments : bck* increments as float32, one chunk per
+  record/level so NEMO's iom reads each field with a single chunk lookup,
+  light zlib compression (nc_profiles "increment"), no dummy vertical axis
+  unless a 3-D field is written.
+- assim_background_state_DI  : zero SSH + rdastp for Direct Initialisation.
+"""
+import os
+
+import numpy as np
+import netCDF4
+
+from nc_profiles import var_options, file_format
+
+INCREMENT_ATTRS = {
+    "bckineta": dict(long_name="bckinetaIncrement", units="m"),
+    "bckint": dict(long_name="bckintIncrement", units="degC"),
+    "bckins": dict(long_name="bckinsIncrement", units="g/kg"),
+    "bckinu": dict(long_name="bckinuIncrement", units="m/s"),
+    "bckinv": dict(long_name="bckinvIncrement", units="m/s"),
+}
+
+
+def increment_dates(date_str):
+    """Date stamps NEMO expects in the increment file."""
+    return dict(
+        z_inc_datef=20191203.5,
+        z_inc_dateb=float(date_str),
+        z_inc_daten=float(f"{date_str}.000002"),
+        time=float(f"{date_str}.000001"),
+    )
+
+
+def nav_coords(ds):
+    """nav_lat/nav_lon (y, x) from the latitude/longitude of a dataset, (None, None) without them."""
+    if "latitude" not in ds or "longitude" not in ds:
+        return None, None
+    lat = ds["latitude"].squeeze().values
+    lon = ds["longitude"].squeeze().values
+    if lat.ndim == 1:
+        lon, lat = np.meshgrid(lon, lat)
+    return lat, lon
+
+
+def _write_nav(nc, nav_lat, nav_lon):
+    if nav_lat is None or nav_lon is None:
+        return False
+    for name, arr in (("nav_lat", nav_lat), ("nav_lon", nav_lon)):
+        v = nc.createVariable(name, "f4", ("y", "x"), **var_options("increment", ("y", "x"), np.shape(arr)))
+        v[:] = np.asarray(arr, dtype=np.float32)
+    return True
+
+
+def create_increment_file(path, ny, nx, date_str, names, nz=None, nav_lat=None, nav_lon=None,
+                          description="NEMO assimilation increment"):
+    """
+    Create the increment file with empty variables for `names` and return the
+    open netCDF4.Dataset, so large 3-D fields can be filled level block by
+    level block. 3-D variables (bckint/s/u/v) need nz.
+    """
+    nc = netCDF4.Dataset(path, "w", format=file_format("increment"))
+    nc.description = description
+    nc.createDimension("t", 1)
+    nc.createDimension("y", ny)
+    nc.createDimension("x", nx)
+    if nz is not None:
+        nc.createDimension("z", nz)
+
+    for name, value in increment_dates(date_str).items():
+        nc.createVariable(name, "f8", ())[...] = value
+    has_nav = _write_nav(nc, nav_lat, nav_lon)
+
+    for name in names:
+        dims = ("t", "y", "x") if name == "bckineta" else ("t", "z", "y", "x")
+        shape = (1, ny, nx) if name == "bckineta" else (1, nz, ny, nx)
+        v = nc.createVariable(name, "f4", dims, fill_value=np.float32(0.0), **var_options("increment", dims, shape))
+        v.setncatts(INCREMENT_ATTRS.get(name, dict(long_name=f"{name}Increment")))
+        v.missing_value = np.float32(0.0)
+        if has_nav:
+            v.coordinates = "nav_lat nav_lon"
+    return nc
+
+
+def write_increment_file(path, fields, date_str, nav_lat=None, nav_lon=None,
+                         description="NEMO assimilation increment"):
+    """
+    Write in-memory increments, e.g. {"bckineta": ssh_delta (y, x)}.
+    3-D fields are given as (z, y, x).
+    """
+    shapes = {name: np.shape(arr) for name, arr in fields.items()}
+    ny, nx = next(iter(shapes.values()))[-2:]
+    nz = next((s[0] for s in shapes.values() if len(s) == 3), None)
+
+    nc = create_increment_file(path, ny, nx, date_str, list(fields), nz=nz,
+                               nav_lat=nav_lat, nav_lon=nav_lon, description=description)
+    try:
+        for name, arr in fields.items():
+            nc.variables[name][0] = np.asarray(arr, dtype=np.float32)
+    finally:
+        nc.close()
+
+
+def write_di_state_file(path, ny, nx, date_str, nav_lat=None, nav_lon=None):
+    """Direct Initialisation background state: sshn = 0 and the assimilation date."""
+    nc = netCDF4.Dataset(path, "w", format=file_format("increment"))
+    try:
+        nc.description = "Direct Initialization background state file for NEMO"
+        nc.createDimension("y", ny)
+        nc.createDimension("x", nx)
+        _write_nav(nc, nav_lat, nav_lon)
+
+        v = nc.createVariable("sshn", "f4", ("y", "x"), fill_value=np.float32(0.0),
+                              **var_options("increment", ("y", "x"), (ny, nx)))
+        v.setncatts(dict(long_name="sea surface height", units="m"))
+        v.missing_value = np.float32(0.0)
+        v[:] = np.zeros((ny, nx), dtype=np.float32)
+
+        r = nc.createVariable("rdastp", "f8", ())
+        r.setncatts(dict(long_name="assimilation date", units="YYYYMMDD.XXXX"))
+        r[...] = float(date_str)
+    finally:
+        nc.close()
+
+
+def write_debug_fields(path, description="debug fields", **fields):
+    """Uncompressed 2-D debug dump (only written on request)."""
+    first = np.shape(next(iter(fields.values())))
+    nc = netCDF4.Dataset(path, "w", format=file_format("scratch"))
+    try:
+        nc.description = description
+        nc.createDimension("y", first[0])
+        nc.createDimension("x", first[1])
+        for name, arr in fields.items():
+            v = nc.createVariable(name, "f4", ("y", "x"), **var_options("scratch", ("y", "x"), first))
+            v[:] = np.asarray(arr, dtype=np.float32)
+    finally:
+        nc.close()
+
+
+def increment_flags(inc_file):
+    """(ln_trainc, ln_dyninc) namelist values for the variables present in inc_file."""
+    if not os.path.exists(inc_file):
+        return ".false.", ".false."
+    nc = netCDF4.Dataset(inc_file)
+    try:
+        names = set(nc.variables)
+    finally:
+        nc.close()
+    tra = ".true." if {"bckint", "bckins"} & names else ".false."
+    dyn = ".true." if {"bckinu", "bckinv"} & names else ".false."
+    return tra, dyn
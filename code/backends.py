@@ -0,0 +1,276 @@
+"""
+Backends for the external services of the workflow, with local stand-ins.
+
+The real services are only reachable on the ECMWF HPC. The local
+implementations let a full cycle run (and be profiled) on any machine:
+
+  service   operational (default)        local
+  cmems     copernicusmarine.open_dataset  NetCDF files in NEMO_LOCAL_CMEMS_DIR/{dataset_id}/
+  mars      ecmwfapi ECMWFService("mars")  GRIB files in NEMO_LOCAL_MARS_DIR/ (fields picked with grib_copy)
+  ecp       ecp                            copy from NEMO_LOCAL_ECFS_DIR (ec:/ -> that dir)
+  scheduler sbatch -W                      stub job: NEMO_FAKE_JOB_DELAY seconds, logs written,
+                                           restart of the next step (see _fake_restart)
+  upload    rsync over ssh -p2222          copy into NEMO_LOCAL_ARCHIVE_DIR
+
+NEMO_BACKEND=local selects every local stand-in. One service is chosen with
+NEMO_<SERVICE>_BACKEND=local|operational (e.g. NEMO_MARS_BACKEND=local).
+"""
+import os
+import re
+import glob
+import time
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from nemo_exec import run, run_many, CommandError
+from scratch import tmp_path
+
+SERVICES = ("cmems", "mars", "ecp", "scheduler", "upload")
+MODES = ("operational", "local")
+
+
+def backend(service):
+    """'operational' or 'local' for one of SERVICES."""
+    mode = os.environ.get(f"NEMO_{service.upper()}_BACKEND") or os.environ.get("NEMO_BACKEND", "operational")
+    if mode not in MODES:
+        raise ValueError(f"Unknown backend {mode!r} for {service} (expected one of {', '.join(MODES)})")
+    return mode
+
+
+def _local_dir(var):
+    path = os.environ.get(var)
+    if not path:
+        raise EnvironmentError(f"{var} must be set for the local backend")
+    return path
+
+
+def cmems_credentials_needed():
+    return backend("cmems") == "operational"
+
+
+# ---------------------------------------------------------------- CMEMS
+
+def open_cmems_dataset(dataset_id, start_datetime, end_datetime, variables=None,
+                       minimum_longitude=None, maximum_longitude=None,
+                       minimum_latitude=None, maximum_latitude=None,
+                       minimum_depth=None, maximum_depth=None):
+    """Lazily opened CMEMS subset, same arguments as copernicusmarine.open_dataset."""
+    request = dict(dataset_id=dataset_id, start_datetime=start_datetime, end_datetime=end_datetime,
+                   variables=variables,
+                   minimum_longitude=minimum_longitude, maximum_longitude=maximum_longitude,
+                   minimum_latitude=minimum_latitude, maximum_latitude=maximum_latitude,
+                   minimum_depth=minimum_depth, maximum_depth=maximum_depth)
+    if backend("cmems") == "operational":
+        import copernicusmarine
+        return copernicusmarine.open_dataset(**{k: v for k, v in request.items() if v is not None})
+    return _open_local_cmems(**request)
+
+
+def _bounds(lo, hi, values):
+    """Slice for lo..hi on a coordinate that may be stored in either order."""
+    if len(values) > 1 and values[0] > values[-1]:
+        lo, hi = hi, lo
+    return slice(lo, hi)
+
+
+def _open_local_cmems(dataset_id, start_datetime, end_datetime, variables,
+                      minimum_longitude, maximum_longitude, minimum_latitude, maximum_latitude,
+                      minimum_depth, maximum_depth):
+    import xarray as xr
+    ddir = os.path.join(_local_dir("NEMO_LOCAL_CMEMS_DIR"), dataset_id)
+    files = sorted(glob.glob(os.path.join(ddir, "*.nc")))
+    if not files:
+        raise FileNotFoundError(f"No local CMEMS files for {dataset_id} in {ddir}")
+    print(f"[LOCAL] CMEMS {dataset_id} from {len(files)} file(s) in {ddir}")
+
+    if len(files) == 1:
+        ds = xr.open_dataset(files[0])
+    else:
+        try:
+            ds = xr.open_mfdataset(files, combine="by_coords")
+        except (ImportError, ValueError):
+            ds = xr.concat([xr.open_dataset(f) for f in files], dim="time")
+
+    subset = {"time": slice(start_datetime, end_datetime)}
+    for dim, lo, hi in (("longitude", minimum_longitude, maximum_longitude),
+                        ("latitude", minimum_latitude, maximum_latitude),
+                        ("depth", minimum_depth, maximum_depth)):
+        if dim in ds.dims and (lo is not None or hi is not None):
+            subset[dim] = _bounds(lo, hi, ds[dim].values)
+    ds = ds.sel(subset)
+    if variables:
+        ds = ds[list(variables)]
+    if ds.sizes.get("time", 1) == 0:
+        raise ValueError(f"Local CMEMS {dataset_id} has no records between {start_datetime} and {end_datetime}")
+    return ds
+
+
+# ---------------------------------------------------------------- MARS
+
+def mars_retrieve(request, target):
+    """Execute a MARS request into the GRIB file `target`."""
+    if backend("mars") == "operational":
+        try:
+            from ecmwfapi import ECMWFService
+        except ImportError:
+            raise RuntimeError("ecmwfapi not available. Load ECMWF env or install it locally.")
+        ECMWFService("mars").execute(request, target)
+        return target
+
+    # Local archive: {date}{time}.grib (e.g. 2025010500.grib), falling back to any GRIB of that date
+    mdir = _local_dir("NEMO_LOCAL_MARS_DIR")
+    date = datetime.strptime(str(request["date"]), "%Y-%m-%d").strftime("%Y%m%d")
+    candidates = [os.path.join(mdir, f"{date}{request.get('time', '00')}.grib")]
+    candidates += sorted(glob.glob(os.path.join(mdir, f"*{date}*")))
+    source = next((c for c in candidates if os.path.isfile(c)), None)
+    if source is None:
+        raise FileNotFoundError(f"No local MARS GRIB for {date} in {mdir}")
+    print(f"[LOCAL] MARS {request.get('type', 'fc')} {date} {request.get('time', '00')} served from {source}")
+    tmp = tmp_path(target)
+    if shutil.which("grib_copy"):
+        # Only the requested fields, as MARS would (ecCodes shortName / endStep)
+        where = [f"{key}={request[field]}" for key, field in (("shortName", "param"), ("endStep", "step"))
+                 if request.get(field)]
+        run(["grib_copy", "-w", ",".join(where), source, tmp])
+    else:
+        print("WARNING: grib_copy (ecCodes) not found, serving the whole file; use NEMO_MARS_SPLIT=0")
+        shutil.copyfile(source, tmp)
+    os.replace(tmp, target)
+    return target
+
+
+# ---------------------------------------------------------------- ecp
+
+def ecp_copy(source_pattern, dest_dir):
+    """Copy ec:/... files matching source_pattern into dest_dir."""
+    os.makedirs(dest_dir, exist_ok=True)
+    if backend("ecp") == "operational":
+        # ecp expands the pattern on the ECFS side
+        run(["ecp", source_pattern, f"{dest_dir.rstrip('/')}/"])
+        return
+    root = _local_dir("NEMO_LOCAL_ECFS_DIR")
+    pattern = os.path.join(root, re.sub(r"^ec:/*", "", source_pattern))
+    files = sorted(glob.glob(pattern))
+    if not files:
+        raise FileNotFoundError(f"No local ECFS files match {pattern}")
+    for f in files:
+        shutil.copy2(f, dest_dir)
+    print(f"[LOCAL] ecp: {len(files)} file(s) from {os.path.dirname(pattern)} -> {dest_dir}")
+
+
+# ---------------------------------------------------------------- scheduler
+
+def _array_path(path, task):
+    """Slurm %a / %3a in --output/--error paths."""
+    return re.sub(r"%(\d*)a", lambda m: f"{task:0{int(m.group(1) or 0)}d}", path)
+
+
+def _fake_restart(job_dir):
+    """
+    Restart tiles a model run in job_dir would leave: the restart it read from
+    initialstate/, stamped with the stock1_num.dat step, in restarts/. A cold
+    start (nothing in initialstate/) writes none.
+    """
+    from nemo_config import get_config
+    from nemo_restart_tool import advance_restart
+    stock1_file = os.path.join(job_dir, "stock1_num.dat")
+    if not os.path.isdir(os.path.join(job_dir, "initialstate")) or not os.path.exists(stock1_file):
+        return []
+    with open(stock1_file) as f:
+        step = int(f.read().strip())
+    config = get_config()
+    return advance_restart(job_dir, config.runid, step, config.nproc)
+
+
+def _fake_job(script, cwd, env, output, error, task, delay):
+    # model_run_dir of an array job may carry %a like the log paths (one run directory per task)
+    job_dir = _array_path(env["model_run_dir"], task) if env.get("model_run_dir") else cwd
+    for path in (output, error):
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    started = datetime.now()
+    time.sleep(delay)
+    restarts = _fake_restart(job_dir)
+    with open(output or os.devnull, "w") as out:
+        out.write(f"[LOCAL] stub job for {script} (task {task}) in {job_dir}\n"
+                  f"started {started:%Y-%m-%d %H:%M:%S}, slept {delay} s, "
+                  f"{len(restarts)} restart tiles written\n")
+    if error:
+        open(error, "w").close()
+    with open(os.path.join(job_dir, "model_last_end"), "w") as f:
+        f.write(f"{int(time.time())}\n")
+
+
+def submit_job(script, cwd, export=None, output=None, error=None, array=None):
+    """
+    Submit `script` and wait for it to finish (sbatch -W). `export` is a dict
+    added to --export=ALL, `array` the number of array tasks (0..array-1).
+    The local fake scheduler writes model_last_end into export["model_run_dir"]
+    (with %a replaced by the task number) or cwd.
+    Raises CommandError when the job fails.
+    """
+    if backend("scheduler") == "operational":
+        argv = ["sbatch", "-W"]
+        if array:
+            argv.append(f"--array=0-{array - 1}")
+        argv.append(",".join(["--export=ALL"] + [f"{k}={v}" for k, v in (export or {}).items()]))
+        if output:
+            argv.append(f"--output={output}")
+        if error:
+            argv.append(f"--error={error}")
+        argv.append(script)
+        print(f"Submitting NEMO job with command: {' '.join(argv)}")
+        # Not captured: sbatch -W prints the job id, then blocks until the job ends
+        run(argv, cwd=cwd, capture=False)
+        return
+
+    delay = float(os.environ.get("NEMO_FAKE_JOB_DELAY", 5))
+    tasks = range(array) if array else [0]
+    print(f"[LOCAL] Fake scheduler: {script} in {cwd}, {len(tasks)} task(s), {delay} s each")
+    env = dict(export or {})
+    with ThreadPoolExecutor(max_workers=len(tasks)) as pool:
+        futures = [pool.submit(_fake_job, script, cwd, env,
+                               output and _array_path(output, t), error and _array_path(error, t), t, delay)
+                   for t in tasks]
+        for future in futures:
+            try:
+                future.result()
+            except OSError as e:
+                raise CommandError([script], 1, str(e))
+
+
+# ---------------------------------------------------------------- upload
+
+REMOTE_USER = "ilja.maljutenko"
+REMOTE_HOST = "atlas.msi.ttu.ee"
+REMOTE_ROOT = "/mnt/archive/ECMWF_op/"
+RSYNC_OPTIONS = ["-avz", "--inplace", "--checksum", "--ignore-times"]
+
+
+def upload_files(uploads, retries=2, retry_delay=30):
+    """
+    Upload (local_path, remote_subdir) pairs to the archive, concurrently.
+    Returns the local paths that failed; one failure does not stop the others.
+    """
+    if backend("upload") == "operational":
+        commands = [["rsync"] + RSYNC_OPTIONS + [
+            "--rsh=ssh -p2222",
+            f"--rsync-path=mkdir -p {REMOTE_ROOT}{remote} && rsync",
+            path, f"{REMOTE_USER}@{REMOTE_HOST}:{REMOTE_ROOT}{remote}",
+        ] for path, remote in uploads]
+        results = run_many(commands, retries=retries, retry_delay=retry_delay, check=False)
+        return [path for (path, _), result in zip(uploads, results) if result.returncode != 0]
+
+    root = _local_dir("NEMO_LOCAL_ARCHIVE_DIR")
+    failed = []
+    for path, remote in uploads:
+        target = os.path.join(root, remote)
+        try:
+            os.makedirs(target, exist_ok=True)
+            shutil.copy2(path, target)
+        except OSError as e:
+            print(f"ERROR: Local upload of {path} failed: {e}")
+            failed.append(path)
+    print(f"[LOCAL] Uploaded {len(uploads) - len(failed)} file(s) to {root}")
+    return failed
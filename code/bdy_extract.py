@@ -0,0 +1,125 @@
+"""
+CMEMS -> NEMO open boundary extraction at the BDY points only.
+
+The T-points of the open boundary are read once from the NEMO
+coordinates.bdy.nc (glamt/gphit, shape (yb=1, xbT=npts)). Bilinear stencils
+from the regular CMEMS grid to exactly those points are cached like the
+other remap weights, so producing the daily 2D/3D BDY files is a gather over
+npts points per timestep and level followed by the vector vertical
+interpolation onto the model levels. This replaces the cdo remapbil onto
+gridfile_bdy_est05, the full intermediate 2D/3D files, the xarray transposes
+and the cdo seldate split.
+
+Output per day, in (time, [depth,] yb, xbT) with nav_lon/nav_lat:
+  bdy_hourly_2d_y{Y}m{M}d{D}.nc : sla, uos, vos
+  bdy_hourly_3d_y{Y}m{M}d{D}.nc : thetao, so, vo, uo
+"""
+import os
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+import numpy as np
+import netCDF4
+import xarray as xr
+
+from regrid import cached_bilinear_weights, remap_bilinear, fill_nearest
+from vertical_interp import model_levels, interp_weights, to_model_levels
+from nemo_config import get_config
+from scratch import tmp_path
+from nc_profiles import encoding as nc_encoding, file_format
+
+# Source grid margin (deg) around the boundary points, > one CMEMS grid step
+MARGIN = 0.1
+
+
+def coordinates_bdy_path(config=None):
+    return os.environ.get("BDY_COORDINATES") or (config or get_config()).path("coordinates_bdy")
+
+
+@lru_cache(maxsize=None)
+def boundary_points(path=None):
+    """(lon, lat) of the BDY T-points as (1, npts) arrays."""
+    path = path or coordinates_bdy_path()
+    nc = netCDF4.Dataset(path)
+    try:
+        lon = np.asarray(nc.variables["glamt"][:], dtype=np.float64)
+        lat = np.asarray(nc.variables["gphit"][:], dtype=np.float64)
+    finally:
+        nc.close()
+    return lon.reshape(1, -1), lat.reshape(1, -1)
+
+
+def fetch_region(path=None, margin=MARGIN):
+    """copernicusmarine lon/lat box just covering the boundary points."""
+    lon, lat = boundary_points(path)
+    return dict(
+        minimum_longitude=round(float(lon.min()) - margin, 4),
+        maximum_longitude=round(float(lon.max()) + margin, 4),
+        minimum_latitude=round(float(lat.min()) - margin, 4),
+        maximum_latitude=round(float(lat.max()) + margin, 4),
+    )
+
+
+def _at_points(da, time_index, weights):
+    """(time, [depth,] lat, lon) -> (time, [depth,] 1, npts), NaNs filled along the boundary."""
+    values = da.isel(time=time_index).transpose("time", ..., "latitude", "longitude").values
+    return fill_nearest(remap_bilinear(values, weights))
+
+
+def _write_day(path, data_vars, coords, time):
+    ds = xr.Dataset(data_vars, coords=dict(coords, time=("time", time.values, time.attrs)))
+    encoding = nc_encoding("bdy", ds, list(data_vars))
+    encoding["time"] = {k: v for k, v in time.encoding.items() if k in ("units", "calendar", "dtype")}
+    tmp = tmp_path(path)
+    ds.to_netcdf(tmp, format=file_format("bdy"), encoding=encoding)
+    os.replace(tmp, path)
+
+
+def extract_boundary(rawfile, odir, date_str, ndays, model_depth=None):
+    """Write the daily 2D/3D BDY files of `ndays` days starting at date_str from the raw CMEMS box."""
+    lon, lat = boundary_points()
+    if model_depth is None:
+        model_depth = model_levels()
+    os.makedirs(odir, exist_ok=True)
+
+    src = xr.open_dataset(rawfile)
+    try:
+        weights = cached_bilinear_weights(src["longitude"].values, src["latitude"].values, lon, lat)
+        src_depth = src["depth"].values
+        zweights = interp_weights(src_depth, model_depth)
+        days = src["time"].values.astype("datetime64[D]")
+        print(f"[INFO] BDY extraction: {lon.size} boundary points, {len(model_depth)} model levels")
+
+        coords = dict(nav_lon=(("yb", "xbT"), lon.astype(np.float32)),
+                      nav_lat=(("yb", "xbT"), lat.astype(np.float32)),
+                      depth=("depth", np.asarray(model_depth, dtype=np.float64), {"units": "m", "positive": "down"}))
+        start = datetime.strptime(date_str, "%Y%m%d")
+        for i in range(ndays):
+            day = start + timedelta(days=i)
+            index = np.flatnonzero(days == np.datetime64(day.strftime("%Y-%m-%d")))
+            if index.size == 0:
+                print(f"WARNING: No CMEMS records for {day:%Y-%m-%d} in {rawfile}")
+                continue
+            label = f"y{day:%Y}m{day:%m}d{day:%d}"
+            time = src["time"].isel(time=index)
+
+            sla = _at_points(src["sla"], index, weights)
+            dims2 = ("time", "yb", "xbT")
+            _write_day(os.path.join(odir, f"bdy_hourly_2d_{label}.nc"),
+                       dict(sla=(dims2, sla, src["sla"].attrs),
+                            uos=(dims2, np.zeros_like(sla)), vos=(dims2, np.zeros_like(sla))),
+                       {k: v for k, v in coords.items() if k != "depth"}, time)
+
+            dims3 = ("time", "depth", "yb", "xbT")
+            fields = {}
+            for var in ("thetao", "so"):
+                values = to_model_levels(_at_points(src[var], index, weights), src_depth, model_depth,
+                                         axis=1, weights=zweights)
+                fields[var] = (dims3, values, src[var].attrs)
+            zeros = np.zeros_like(fields["so"][1])
+            fields["vo"] = (dims3, zeros)
+            fields["uo"] = (dims3, zeros)
+            _write_day(os.path.join(odir, f"bdy_hourly_3d_{label}.nc"), fields, coords, time)
+            print(f"[OK] BDY files for {label}: {index.size} records")
+    finally:
+        src.close()
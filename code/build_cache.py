@@ -0,0 +1,82 @@
+import os
+import json
+import inspect
+import hashlib
+import functools
+
+from workdir_staging import file_checksum
+from cycle_state import expand_paths, output_record, outputs_valid
+from scratch import tmp_path
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def code_version(func, modules=()):
+    """Checksum of the source file that defines func and of the helper modules it uses."""
+    sources = [inspect.getsourcefile(func)] + [os.path.join(HERE, f"{m}.py") for m in modules]
+    missing = [p for p in sources if not os.path.exists(p)]
+    if missing:
+        raise FileNotFoundError(f"build_cache code dependencies not found: {', '.join(missing)}")
+    return {os.path.basename(p): file_checksum(p) for p in sources}
+
+
+def build_cache(outputs, inputs=None, code=()):
+    """
+    Skip a forcing generator when its inputs, parameters and code are unchanged.
+
+    outputs(**params) -> (output_dir, [glob patterns relative to output_dir])
+    inputs(**params)  -> [paths or glob patterns of input files]
+    code              -> names of the modules next to this one that do the
+                         work (e.g. ("meteo_deaccum", "nc_profiles"))
+
+    The cache key hashes the content of every input file, the bound call
+    parameters and the source of the generator and of its code modules. A manifest with the key and
+    the output checksums is kept in {output_dir}/.build_cache/. Set
+    NEMO_BUILD_CACHE=0 to always recompute.
+    """
+    def decorator(func):
+        sig = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if os.environ.get("NEMO_BUILD_CACHE", "1") == "0":
+                return func(*args, **kwargs)
+
+            bound = sig.bind(*args, **kwargs)
+            bound.apply_defaults()
+            params = dict(bound.arguments)
+
+            out_dir, out_patterns = outputs(**params)
+            out_globs = [os.path.join(out_dir, p) for p in out_patterns]
+            in_files = expand_paths(inputs(**params)) if inputs else []
+
+            params_json = json.dumps(params, sort_keys=True, default=str)
+            key = hashlib.sha1(json.dumps({
+                "func": func.__qualname__,
+                "params": params_json,
+                "inputs": {p: file_checksum(p) for p in in_files},
+                "code": code_version(func, code),
+            }, sort_keys=True).encode()).hexdigest()
+
+            digest = hashlib.sha1(params_json.encode()).hexdigest()[:16]
+            manifest = os.path.join(out_dir, ".build_cache", f"{func.__name__}-{digest}.json")
+            if os.path.exists(manifest):
+                with open(manifest) as f:
+                    cached = json.load(f)
+                if cached.get("key") == key and outputs_valid(out_globs, cached.get("outputs", {})):
+                    print(f"[CACHE] {func.__name__}: outputs up to date ({manifest})")
+                    return None
+
+            result = func(*args, **kwargs)
+
+            os.makedirs(os.path.dirname(manifest), exist_ok=True)
+            tmp = tmp_path(manifest)
+            with open(tmp, "w") as f:
+                json.dump({"key": key, "params": params_json, "inputs": in_files,
+                           "outputs": output_record(out_globs)}, f, indent=1)
+            os.replace(tmp, manifest)
+            return result
+
+        return wrapper
+    return decorator
@@ -0,0 +1,140 @@
+import os
+import glob
+import json
+import time
+from datetime import datetime
+
+from workdir_staging import file_checksum
+from instrumentation import step
+from scratch import tmp_path
+
+
+def expand_paths(patterns):
+    """Expand a list of paths / glob patterns into a sorted list of existing files."""
+    paths = set()
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            paths.update(glob.glob(pattern))
+        elif os.path.exists(pattern):
+            paths.add(pattern)
+    return sorted(paths)
+
+
+def input_fingerprint(patterns):
+    """Cheap fingerprint (size, mtime) of every input file."""
+    fp = {}
+    for path in expand_paths(patterns):
+        st = os.stat(path)
+        fp[path] = [st.st_size, st.st_mtime_ns]
+    return fp
+
+
+def output_record(patterns):
+    """Size, mtime and checksum of every output file."""
+    rec = {}
+    for path in expand_paths(patterns):
+        st = os.stat(path)
+        rec[path] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha1": file_checksum(path)}
+    return rec
+
+
+def outputs_valid(patterns, recorded):
+    """
+    True if the outputs still match what was recorded. The checksum is only
+    recomputed for files whose size or mtime changed since the step finished.
+    """
+    current = expand_paths(patterns)
+    if not current or sorted(recorded) != current:
+        return False
+    for path in current:
+        st = os.stat(path)
+        rec = recorded[path]
+        if st.st_size != rec["size"]:
+            return False
+        if st.st_mtime_ns != rec["mtime_ns"] and file_checksum(path) != rec["sha1"]:
+            return False
+    return True
+
+
+class CycleState:
+    """
+    Persistent per-cycle record of the workflow steps.
+
+    Stored as JSON in {state_dir}/cycle_{date}.json (config.path("state_dir")). A step is skipped
+    when it finished before with the same parameters and input fingerprints
+    and its outputs are unchanged. Once any step has to run, every later step
+    runs as well, so a rerun resumes from the first incomplete step.
+    """
+
+    def __init__(self, date_str, state_dir, force=False):
+        self.date_str = date_str
+        self.path = os.path.join(state_dir, f"cycle_{date_str}.json")
+        self.force = force
+        self.resumed = False
+        self.steps = {}
+        self.touched = set()
+        if os.path.exists(self.path) and not force:
+            with open(self.path) as f:
+                self.steps = json.load(f).get("steps", {})
+
+    def save(self):
+        """
+        Merge the steps touched by this process into the state file. The lock
+        lets several processes (e.g. backfill workers) update one cycle.
+        """
+        import fcntl
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(f"{self.path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            steps = {}
+            if os.path.exists(self.path):
+                with open(self.path) as f:
+                    steps = json.load(f).get("steps", {})
+            steps.update({name: self.steps[name] for name in self.touched})
+            tmp = tmp_path(self.path)
+            with open(tmp, "w") as f:
+                json.dump({"date": self.date_str, "steps": steps}, f, indent=1)
+            os.replace(tmp, self.path)
+
+    def is_complete(self, name, inputs=(), outputs=(), params=None):
+        rec = self.steps.get(name)
+        if self.force or self.resumed or not rec or rec.get("status") != "done":
+            return False
+        if rec.get("params") != (params or {}):
+            return False
+        if rec.get("inputs") != input_fingerprint(inputs):
+            return False
+        return outputs_valid(outputs, rec.get("outputs", {}))
+
+    def run_step(self, name, func, *args, inputs=(), outputs=(), params=None, **kwargs):
+        """Run func(*args, **kwargs) unless the step is already complete for this cycle."""
+        if self.is_complete(name, inputs, outputs, params):
+            print(f"[SKIP] Step '{name}' already complete for {self.date_str} (state: {self.path})")
+            return None
+
+        rec = {
+            "status": "running",
+            "params": params or {},
+            "inputs": input_fingerprint(inputs),
+            "started": datetime.now().isoformat(timespec="seconds"),
+        }
+        self.steps[name] = rec
+        self.touched.add(name)
+        self.save()
+
+        t0 = time.perf_counter()
+        try:
+            with step(name, date=self.date_str):
+                result = func(*args, **kwargs)
+        except BaseException as e:
+            rec["status"] = "failed"
+            rec["error"] = f"{type(e).__name__}: {e}"
+            self.save()
+            raise
+
+        self.resumed = True
+        rec["status"] = "done"
+        rec["outputs"] = output_record(outputs)
+        rec["seconds"] = round(time.perf_counter() - t0, 3)
+        self.save()
+        return result
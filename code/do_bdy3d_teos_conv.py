@@ -18,6 +18,8 @@ import numpy as np
 import xarray as xr
 import gsw
 
+from nc_profiles import encoding as nc_encoding, file_format
+
 
 def find_first(container, names):
     """Return the first present name from 'names' in 'container' (mapping or sequence)."""
@@ -161,10 +163,8 @@ def main():
         "comment": "Computed from potential temperature via TEOS-10 (GSW)."
     })
 
-    # Compressed NetCDF4 output
-    comp = dict(zlib=True, complevel=1, shuffle=True)
-    encoding = {v: comp for v in dso.data_vars}
-    dso.to_netcdf(args.output, encoding=encoding)
+    # Same layout as the bdy_extract files (nc_profiles "bdy")
+    dso.to_netcdf(args.output, format=file_format("bdy"), encoding=nc_encoding("bdy", dso))
 
     # Sanity ping
     print("Sample SP->SA:", float(spv[(0, 0, 0, 0)]), "->", float(SA[(0, 0, 0, 0)]))
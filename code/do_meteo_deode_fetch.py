@@ -18,14 +18,16 @@ Usage:
 
 Notes:
 - This script only performs the COPY step. Conversion to NEMO forcing is separate.
-- Requires `ecp` in PATH and permissions to read from the source path.
+- Requires `ecp` in PATH and permissions to read from the source path
+  (or NEMO_ECP_BACKEND=local, see backends.py).
 """
 import os
 import argparse
-import subprocess
 from pathlib import Path
 from datetime import datetime
 
+from backends import ecp_copy
+
 BASE_ROOT = (
     "ec:/fie/deode/"
     "CY49t2_HARMONIE_AROME_FIN_S_16Nov2024_1500x1500_500m_2024_11_v3/archive"
@@ -53,9 +55,7 @@ def cli():
     out_dir = os.path.join(dest_root, case_str)
     os.makedirs(out_dir, exist_ok=True)
 
-    cmd = f"ecp {src_dir}/GRIBPFDEOD+* {out_dir}/"
-    print(f"Running: {cmd}")
-    subprocess.run(cmd, shell=True, check=True)
+    ecp_copy(f"{src_dir}/GRIBPFDEOD+*", out_dir)
     print(f"Done. Files copied to: {out_dir}")
 
 if __name__ == "__main__":
@@ -0,0 +1,175 @@
+"""
+Multi-variable EOF increment engine (T/S/U/V/SSH) for NEMO asminc.
+
+EOF inputs, on the model grid, in {FORCINGDIR}/assim/eof/:
+  eof_modes.nc              mode_<v>(mode, [depth,] y, x), optional mean_<v>([depth,] y, x)
+  eof_amplitudes.d{date}.nc amp(mode) shared by all variables (multivariate EOF)
+                            or amp_<v>(mode) per variable; a leading time axis
+                            is allowed, the last record is used.
+
+The reconstruction (mean + amplitudes x modes) is computed in depth blocks
+with one matmul per block: for a shared amplitude vector the mode blocks of
+all variables are stacked, so T/S/U/V of a block come out of a single
+(1 x mode) @ (mode x points) product. The previous day's NEMO fields are
+read level block by level block as well, and the deltas (reconstruction minus
+model, the sign of the increment NEMO adds) are written straight into the
+increment file, so memory stays bounded by the block size on the 529x455x110 grid.
+"""
+import os
+import numpy as np
+import netCDF4
+
+from nemo_output_reader import read_record, open_nemo_dataset
+from assim_increment_writer import create_increment_file
+from nemo_config import get_config
+
+# EOF name -> (increment variable, candidate variable names in the NEMO output)
+VARIABLES = {
+    "t": ("bckint", ["toce", "votemper", "thetao"]),
+    "s": ("bckins", ["soce", "vosaline", "so"]),
+    "u": ("bckinu", ["uoce", "vozocrtx", "uo"]),
+    "v": ("bckinv", ["voce", "vomecrty", "vo"]),
+    "ssh": ("bckineta", ["SSH", "sossheig", "zos"]),
+}
+
+BLOCK_MB = float(os.environ.get("NEMO_EOF_BLOCK_MB", 256))
+
+
+def eof_paths(date_str, config=None):
+    config = config or get_config()
+    return dict(
+        modes=config.path("eof_modes"),
+        amplitudes=config.path("eof_amplitudes", date_str),
+        model_ssh=config.path("prev_ssh_output", date_str),
+        model_3d=config.path("prev_3d_output", date_str),
+        inc_file=config.path("assim_increment", date_str),
+    )
+
+
+def eof_increment_available(date_str, config=None):
+    paths = eof_paths(date_str, config)
+    return os.path.exists(paths["modes"]) and os.path.exists(paths["amplitudes"])
+
+
+def _amplitudes(nc, var):
+    name = f"amp_{var}" if f"amp_{var}" in nc.variables else "amp"
+    amp = np.asarray(nc.variables[name][:], dtype=np.float32)
+    return name, amp[-1] if amp.ndim == 2 else amp
+
+
+def _model_var(path, candidates):
+    nc = open_nemo_dataset(path)   # kept open for the reads that follow
+    return next((n for n in candidates if n in nc.variables), None)
+
+
+def generate_operational_eof_increment(date_str, variables=("t", "s", "u", "v", "ssh"), config=None):
+    paths = eof_paths(date_str, config)
+    for key in ("modes", "amplitudes"):
+        if not os.path.exists(paths[key]):
+            raise FileNotFoundError(f"Missing EOF {key}: {paths[key]}")
+
+    modes = netCDF4.Dataset(paths["modes"])
+    amps = netCDF4.Dataset(paths["amplitudes"])
+    try:
+        variables = [v for v in variables if f"mode_{v}" in modes.variables]
+        if not variables:
+            raise ValueError(f"No mode_<var> variables in {paths['modes']}")
+
+        # Model source per variable
+        model = {}
+        for v in variables:
+            src = paths["model_ssh"] if v == "ssh" else paths["model_3d"]
+            name = _model_var(src, VARIABLES[v][1]) if os.path.exists(src) else None
+            if name is None:
+                raise FileNotFoundError(f"No model field for '{v}' in {src}")
+            model[v] = (src, name)
+
+        first = modes.variables[f"mode_{variables[0]}"]
+        nmode, ny, nx = first.shape[0], first.shape[-2], first.shape[-1]
+        three_d = [v for v in variables if modes.variables[f"mode_{v}"].ndim == 4]
+        nz = modes.variables[f"mode_{three_d[0]}"].shape[1] if three_d else None
+
+        amp = {v: _amplitudes(amps, v) for v in variables}
+        shared = len({name for name, _ in amp.values()}) == 1
+
+        nc_lat = modes.variables.get("nav_lat")
+        nc_lon = modes.variables.get("nav_lon")
+        out = create_increment_file(
+            paths["inc_file"], ny, nx, date_str, [VARIABLES[v][0] for v in variables], nz=nz,
+            nav_lat=nc_lat[:] if nc_lat is not None else None,
+            nav_lon=nc_lon[:] if nc_lon is not None else None,
+            description="Operational multi-variable EOF assimilation increment",
+        )
+        try:
+            # SSH (2-D)
+            if "ssh" in variables:
+                rec = _reconstruct(modes, "ssh", amp["ssh"][1], None)
+                out.variables["bckineta"][0] = _delta(rec, read_record(*model["ssh"]))
+
+            # 3-D variables, level block by level block
+            if three_d:
+                kblock = max(1, int(BLOCK_MB * 2**20 // (nmode * ny * nx * 4 * len(three_d))))
+                print(f"[INFO] EOF increment: {len(three_d)} 3-D fields, {nmode} modes, {kblock} levels per block")
+                for k0 in range(0, nz, kblock):
+                    levels = slice(k0, min(k0 + kblock, nz))
+                    if shared:
+                        recs = _reconstruct_stacked(modes, three_d, amp[three_d[0]][1], levels)
+                    else:
+                        recs = {v: _reconstruct(modes, v, amp[v][1], levels) for v in three_d}
+                    for v in three_d:
+                        field = read_record(*model[v], levels=levels)
+                        out.variables[VARIABLES[v][0]][0, levels] = _delta(recs[v], field)
+        finally:
+            out.close()
+    finally:
+        modes.close()
+        amps.close()
+
+    print(f"[OK] [OPERATIONAL] EOF increment ({', '.join(variables)}) written to: {paths['inc_file']}")
+
+
+def _mode_block(modes, var, levels):
+    v = modes.variables[f"mode_{var}"]
+    block = v[:, levels] if levels is not None else v[:]
+    block = np.ma.filled(block.astype(np.float32), np.nan)
+    mean = modes.variables.get(f"mean_{var}")
+    if mean is not None:
+        mean = np.ma.filled((mean[levels] if levels is not None else mean[:]).astype(np.float32), np.nan)
+    return block, mean
+
+
+def _reconstruct(modes, var, amp, levels):
+    block, mean = _mode_block(modes, var, levels)
+    shape = block.shape[1:]
+    rec = (amp[None, :] @ block.reshape(block.shape[0], -1)).reshape(shape)
+    return rec + mean if mean is not None else rec
+
+
+def _reconstruct_stacked(modes, names, amp, levels):
+    """One matmul for all variables sharing the amplitude vector."""
+    blocks, means = zip(*(_mode_block(modes, v, levels) for v in names))
+    nmode, shape = blocks[0].shape[0], blocks[0].shape[1:]
+    stacked = np.concatenate([b.reshape(nmode, -1) for b in blocks], axis=1)
+    flat = (amp[None, :] @ stacked)[0]
+    recs = {}
+    for v, rec, mean in zip(names, np.split(flat, len(names)), means):
+        rec = rec.reshape(shape)
+        recs[v] = rec + mean if mean is not None else rec
+    return recs
+
+
+def _delta(rec, field):
+    """Reconstruction minus model; no increment where either is undefined (land)."""
+    delta = rec - field
+    delta[~np.isfinite(delta)] = 0.0
+    return delta
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("date", help="Target date in YYYYMMDD")
+    parser.add_argument("--vars", default="t,s,u,v,ssh", help="Comma separated subset of t,s,u,v,ssh")
+    args = parser.parse_args()
+
+    generate_operational_eof_increment(args.date, variables=tuple(args.vars.split(",")))
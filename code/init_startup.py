@@ -1,51 +1,44 @@
 import os
 import sys
-import subprocess
 from datetime import datetime
-import copernicusmarine
+from backends import open_cmems_dataset, cmems_credentials_needed
 import xarray as xr
+import numpy as np
+import netCDF4
 
-def run_cmd(cmd):
-    print(f"\nRunning: {cmd}")
-    result = subprocess.run(cmd, shell=True)
-    if result.returncode != 0:
-        raise RuntimeError(f"Command failed: {cmd}")
+from regrid import grid_coords, cached_bilinear_weights, remap_bilinear, fill_nearest
+from vertical_interp import model_levels, to_model_levels
+from nemo_config import get_config
+from nc_profiles import var_options, file_format
 
 def setup_cmems_credentials():
+    if not cmems_credentials_needed():
+        return None, None  # local CMEMS backend
     username = os.getenv("CMEMS_USERNAME")
     password = os.getenv("CMEMS_PASSWORD")
     if not username or not password:
         raise EnvironmentError("CMEMS_USERNAME and CMEMS_PASSWORD must be set in the environment")
     return username, password
 
-def get_env_path(varname, fallback):
-    path = os.environ.get(varname)
-    if not path:
-        print(f"WARNING: {varname} not set. Falling back to: {fallback}")
-        path = fallback
-    return path
-
-def init_case0_coldstart(yystart, mmstart, ddstart):
+def init_case0_coldstart(yystart, mmstart, ddstart, config=None):
     date_str = f"{yystart}{mmstart}{ddstart}"
     print(f"==== Initializing cold start for {date_str} ====")
 
     # Ensure credentials are available
     setup_cmems_credentials()
 
-    # Get environment paths
-    FORCINGDIR = get_env_path("FORCINGDIR", "/ec/res4/hpcperm/eeim/nemo_ecmwf/forcing")
-    CONFDIR    = get_env_path("CONFDIR",    "/ec/res4/hpcperm/eeim/nemo_ecmwf/setup_N5")
-    print(f"Using FORCINGDIR={FORCINGDIR}")
+    config = config or get_config()
+    print(f"Using FORCINGDIR={config.forcingdir}")
     # Output paths
-    data_dir = os.path.join(FORCINGDIR, "initial")
+    initfile = config.path("initial_file", date_str)
+    data_dir = os.path.dirname(initfile)
     print(f"Using data directory: {data_dir}")
     os.makedirs(data_dir, exist_ok=True)
 
-    initfile = os.path.join(data_dir, f"initial_run_t{date_str}.nc")
-    bathy_grid = os.path.join(FORCINGDIR, "bathy_meter.nc")
+    bathy_grid = config.path("bathy")
 
     # Download from CMEMS daily product
-    ds = copernicusmarine.open_dataset(
+    ds = open_cmems_dataset(
         dataset_id="cmems_mod_bal_phy_anfc_P1D-m",
         start_datetime=f"{yystart}-{mmstart}-{ddstart}",
         end_datetime=f"{yystart}-{mmstart}-{ddstart}",
@@ -57,34 +50,53 @@ def init_case0_coldstart(yystart, mmstart, ddstart):
         minimum_depth=0,
         maximum_depth=140
     )
-    file_path = os.path.join(data_dir, f"BAL-NEMO_PHY-DailyMeans-{date_str}.nc")
-    ds.to_netcdf(file_path, format="NETCDF4_CLASSIC")
-    print(f"Downloaded and saved CMEMS initial data: {file_path}")
+    print(f"Opened CMEMS initial data for {date_str}")
 
-    # Vertical levels
-    zax = (
-        "1.51,1.52,2.5,3.5,4.5,5.5,6.5,7.5,8.5,9.5,10.5,11.5,12.5,13.5,14.5,15.5,"
-        "16.5,17.5,18.5,19.5,20.5,21.5,22.5,23.5,24.5,25.5,26.5,27.5,28.5,29.5,30.5,"
-        "31.5,32.5,33.5,34.5,35.5,36.5,37.5,38.5,39.5,40.5,41.5,42.5,43.5,44.5,45.5,"
-        "46.5,47.5,48.5,49.5,50.5,51.5,52.5,53.5,54.5,55.5,56.5,57.5,58.5,59.5,60.5,"
-        "61.5,62.5,63.5,64.5,65.5,66.5,67.5,68.5,69.5,70.5,71.5,72.5,73.5,74.5,75.5,"
-        "76.5,77.5,78.5,79.5,80.5,81.5,82.5,83.5,84.5,85.5,86.5,87.5,88.5,89.5,90.5,"
-        "91.5,92.5,93.5,94.5,95.5,96.6,97.8,99.5,102,105.4,109.3,113.4,117.5,121.1,"
-        "121.2,121.2,121.3,121.4,121.5"
-    )
+    # Model levels from domain_cfg
+    model_depth = model_levels(config.path("domain_cfg"))
 
-    # Interpolate and remap
-    cmd = (
-        f"cdo -s -O -L --reduce_dim intlevel,{zax} -setmisstonn "
-        f"-remapbil,{bathy_grid} -expr,'so=so;thetao=thetao' "
-        f"{file_path} {initfile}"
-    )
-    run_cmd(cmd)
+    build_initial_state(ds, bathy_grid, model_depth, initfile)
     print(f"Initial file prepared: {initfile}")
 
-def initialize_case(case_id, yystart, mmstart, ddstart):
+
+def build_initial_state(ds, bathy_grid, model_depth, initfile, variables=("so", "thetao")):
+    """
+    Regrid the CMEMS daily mean (time, depth, lat, lon) onto the model grid in
+    memory and write initial_run_t{date}.nc, replacing the cdo chain
+    remapbil -> setmisstonn -> intlevel.
+    """
+    dst_lon, dst_lat = grid_coords(bathy_grid)
+    weights = cached_bilinear_weights(ds["longitude"].values, ds["latitude"].values, dst_lon, dst_lat)
+    src_depth = ds["depth"].values
+
+    fields = {}
+    for var in variables:
+        data = ds[var].isel(time=0).values.astype(np.float32)   # (depth, lat, lon)
+        data = fill_nearest(remap_bilinear(data, weights))
+        fields[var] = to_model_levels(data, src_depth, model_depth)
+
+    nc = netCDF4.Dataset(initfile, "w", format=file_format("initial"))
+    try:
+        ny, nx = dst_lon.shape
+        nc.createDimension("depth", len(model_depth))
+        nc.createDimension("y", ny)
+        nc.createDimension("x", nx)
+        nc.createVariable("depth", "f8", ("depth",))[:] = model_depth
+        nc.createVariable("nav_lon", "f4", ("y", "x"))[:] = dst_lon
+        nc.createVariable("nav_lat", "f4", ("y", "x"))[:] = dst_lat
+        dims = ("depth", "y", "x")
+        for var in variables:
+            v = nc.createVariable(var, "f4", dims, fill_value=np.float32(-9e33),
+                                  **var_options("initial", dims, (len(model_depth), ny, nx)))
+            v.setncatts({k: ds[var].attrs[k] for k in ("standard_name", "long_name", "units") if k in ds[var].attrs})
+            v.coordinates = "nav_lat nav_lon"
+            v[:] = np.where(np.isnan(fields[var]), np.float32(-9e33), fields[var])
+    finally:
+        nc.close()
+
+def initialize_case(case_id, yystart, mmstart, ddstart, config=None):
     if case_id == 0:
-        init_case0_coldstart(yystart, mmstart, ddstart)
+        init_case0_coldstart(yystart, mmstart, ddstart, config)
     elif case_id == 2:
         print("Hotstart mode (case 2) — using restart files [not yet implemented]")
     elif case_id == 3:
@@ -0,0 +1,258 @@
+"""
+Per-step and per-command instrumentation for the workflow.
+
+- step(name)      : context manager (timed() is the decorator form). It
+                    records wall and CPU time of the process and its
+                    children and the bytes read/written (/proc/self/io,
+                    plus block I/O of the children). rss_hwm_mb is the
+                    high-water mark of the process (or its largest child)
+                    at the end of the step, not the step's own peak:
+                    getrusage has no per-interval maximum.
+- run_subprocess  : subprocess wrapper. It reaps the child with os.wait4,
+                    so every cdo/sbatch/... command gets its own rusage:
+                    wall, CPU, max RSS and block I/O. The workflow scripts
+                    call it through nemo_exec.run/run_many.
+
+Records are kept in memory per process; a forked worker starts with an
+empty record list and step stack. flush_timeline() appends them to the
+JSON timeline of a cycle ({FORCINGDIR}/state/timeline_{date}.json, under a
+lock, so backfill worker processes can add their steps).
+print_summary() prints the table shown at the end of a workflow run.
+"""
+import os
+import json
+import time
+import shlex
+import resource
+import subprocess
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+from scratch import tmp_path
+
+_records = []
+_stack = []
+
+
+def _reset_after_fork():
+    """Forked workers record their own steps: no inherited records, no parent step."""
+    _records.clear()
+    _stack.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _proc_io():
+    """(read_bytes, write_bytes) of this process, None where /proc is not available."""
+    try:
+        with open("/proc/self/io") as f:
+            io = dict(line.split(":") for line in f.read().splitlines())
+        return int(io["read_bytes"]), int(io["write_bytes"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _usage():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    kids = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return dict(
+        wall=time.perf_counter(),
+        cpu=own.ru_utime + own.ru_stime + kids.ru_utime + kids.ru_stime,
+        maxrss=own.ru_maxrss,
+        child_maxrss=kids.ru_maxrss,
+        child_in=kids.ru_inblock * 512,
+        child_out=kids.ru_oublock * 512,
+        io=_proc_io(),
+    )
+
+
+def _mb(nbytes):
+    return round(nbytes / 2**20, 2)
+
+
+@contextmanager
+def step(name, **tags):
+    """Record one workflow step (nesting is kept in the 'parent' field)."""
+    rec = dict(kind="step", name=name, parent=_stack[-1] if _stack else None,
+               started=datetime.now().isoformat(timespec="seconds"), **tags)
+    _stack.append(name)
+    _records.append(rec)
+    u0 = _usage()
+    status = "done"
+    try:
+        yield rec
+    except BaseException:
+        status = "failed"
+        raise
+    finally:
+        _stack.pop()
+        u1 = _usage()
+        read = write = 0
+        if u0["io"] and u1["io"]:
+            read, write = u1["io"][0] - u0["io"][0], u1["io"][1] - u0["io"][1]
+        read += u1["child_in"] - u0["child_in"]
+        write += u1["child_out"] - u0["child_out"]
+        rec.update(
+            status=status,
+            wall_s=round(u1["wall"] - u0["wall"], 3),
+            cpu_s=round(u1["cpu"] - u0["cpu"], 3),
+            rss_hwm_mb=_mb(max(u1["maxrss"], u1["child_maxrss"]) * 1024),
+            read_mb=_mb(read),
+            write_mb=_mb(write),
+        )
+
+
+def timed(name=None):
+    """Decorator form of step()."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with step(name or func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def run_subprocess(cmd, shell=None, timeout=None, **kwargs):
+    """
+    Run cmd (string for the shell, or argv list) to completion and record its
+    own rusage. Returns a CompletedProcess. With stdout=subprocess.PIPE the
+    output is read here (pass stderr=subprocess.STDOUT to merge both streams).
+    After `timeout` seconds the child and everything it started (it runs in
+    its own session) are killed and subprocess.TimeoutExpired is raised.
+    """
+    import signal
+    import threading
+    if shell is None:
+        shell = isinstance(cmd, str)
+    label = cmd if isinstance(cmd, str) else " ".join(shlex.quote(str(a)) for a in cmd)
+    t0 = time.perf_counter()
+    if timeout:
+        # Own process group, so the kill also reaches grandchildren holding the pipe open
+        kwargs.setdefault("start_new_session", True)
+    proc = subprocess.Popen(cmd, shell=shell, **kwargs)
+    timer = None
+    killed = threading.Event()
+    if timeout:
+        def kill():
+            killed.set()
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                proc.kill()
+        timer = threading.Timer(timeout, kill)
+        timer.start()
+    try:
+        output = proc.stdout.read() if proc.stdout else None
+        _, status, ru = os.wait4(proc.pid, 0)
+    finally:
+        if timer:
+            timer.cancel()
+        if proc.stdout:
+            proc.stdout.close()
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    timed_out = killed.is_set()
+    _records.append(dict(
+        kind="command",
+        name=label,
+        program=command_program(label),
+        parent=_stack[-1] if _stack else None,
+        status="timeout" if timed_out else "done" if proc.returncode == 0 else "failed",
+        returncode=proc.returncode,
+        wall_s=round(time.perf_counter() - t0, 3),
+        cpu_s=round(ru.ru_utime + ru.ru_stime, 3),
+        maxrss_mb=_mb(ru.ru_maxrss * 1024),
+        read_mb=_mb(ru.ru_inblock * 512),
+        write_mb=_mb(ru.ru_oublock * 512),
+    ))
+    if timed_out:
+        raise subprocess.TimeoutExpired(cmd, timeout, output=output)
+    return subprocess.CompletedProcess(cmd, proc.returncode, stdout=output)
+
+
+CDO_VALUE_OPTIONS = ("-f", "-z", "-P", "-b", "-t", "-k", "--pedantic", "--cmor")
+
+
+def command_program(label):
+    """'cdo remapbil' / 'ln' / 'python3 do_bdy3d_teos_conv.py' style key for aggregation."""
+    try:
+        words = shlex.split(label)
+    except ValueError:
+        words = label.split()
+    if not words:
+        return ""
+    prog = os.path.basename(words[0])
+    if prog == "cdo":
+        # First operator, skipping options and their values (-f nc4, -z zip_1, -P 4)
+        it = iter(words[1:])
+        for w in it:
+            if w in CDO_VALUE_OPTIONS:
+                next(it, None)
+                continue
+            op = w.lstrip("-").split(",")[0]
+            if len(op) > 2:
+                return f"cdo {op}"
+        return prog
+    if prog.startswith("python") and len(words) > 1:
+        return f"{prog} {os.path.basename(words[1])}"
+    return prog
+
+
+def records():
+    return list(_records)
+
+
+def timeline_path(state_dir, date_str):
+    return os.path.join(state_dir, f"timeline_{date_str}.json")
+
+
+def flush_timeline(path):
+    """Append this process's records to the timeline file and return the full timeline."""
+    import fcntl
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        timeline = []
+        if os.path.exists(path):
+            with open(path) as f:
+                timeline = json.load(f).get("records", [])
+        for rec in _records:
+            rec.setdefault("pid", os.getpid())
+        timeline.extend(_records)
+        tmp = tmp_path(path)
+        with open(tmp, "w") as f:
+            json.dump({"records": timeline}, f, indent=1)
+        os.replace(tmp, path)
+    _records.clear()
+    return timeline
+
+
+def print_summary(timeline=None, top=10):
+    """Steps in order, then the most expensive command types."""
+    timeline = _records if timeline is None else timeline
+    finished = [r for r in timeline if "wall_s" in r]
+    steps = [r for r in finished if r["kind"] == "step"]
+    commands = [r for r in finished if r["kind"] == "command"]
+    header = f"{'step':<32} {'status':<7} {'wall s':>9} {'cpu s':>9} {'rss hwm MB':>10} {'read MB':>9} {'write MB':>9}"
+
+    print("\n===== Timing summary =====")
+    print(header)
+    for r in steps:
+        name = ("  " if r.get("parent") else "") + r["name"]
+        print(f"{name[:32]:<32} {r['status']:<7} {r['wall_s']:>9.1f} {r['cpu_s']:>9.1f} "
+              f"{r.get('rss_hwm_mb', r.get('maxrss_mb', 0)):>10.0f} {r['read_mb']:>9.1f} {r['write_mb']:>9.1f}")
+
+    if commands:
+        agg = {}
+        for r in commands:
+            a = agg.setdefault(r["program"], dict(n=0, wall_s=0.0, cpu_s=0.0, maxrss_mb=0.0, read_mb=0.0, write_mb=0.0))
+            a["n"] += 1
+            for key in ("wall_s", "cpu_s", "read_mb", "write_mb"):
+                a[key] += r[key]
+            a["maxrss_mb"] = max(a["maxrss_mb"], r["maxrss_mb"])
+        print(f"\n{'command':<32} {'calls':>7} {'wall s':>9} {'cpu s':>9} {'maxrss MB':>10} {'read MB':>9} {'write MB':>9}")
+        for prog, a in sorted(agg.items(), key=lambda kv: -kv[1]["wall_s"])[:top]:
+            print(f"{prog[:32]:<32} {a['n']:>7} {a['wall_s']:>9.1f} {a['cpu_s']:>9.1f} "
+                  f"{a['maxrss_mb']:>10.0f} {a['read_mb']:>9.1f} {a['write_mb']:>9.1f}")
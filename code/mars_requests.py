@@ -0,0 +1,115 @@
+"""
+Retrieval plan for the operational ECMWF surface forecast.
+
+One request for all steps and parameters is queued and transferred by MARS
+as a single unit: nothing can be processed before the last field has
+arrived. plan_parts() splits it along the way the forecast is archived:
+
+  - steps:  the output frequency of the forecast (hourly to +90 h, 3-hourly
+            to +144 h, 6-hourly beyond), cut into blocks of
+            NEMO_MARS_BLOCK_HOURS (default 24 h, one forecast day);
+  - params: instantaneous and accumulated fields (PARAM_GROUPS).
+
+All parts of a forecast come from the same date/time field set, so the
+split adds no tape mounts. retrieve_parts() fetches the parts concurrently
+(NEMO_MARS_WORKERS, default 4) and hands each one to a callback as soon as
+it is complete, earliest steps first where possible, so the decoding of the
+first days overlaps with the transfer of the later ones. Parts already on
+disk are reused, an interrupted retrieval only fetches the missing ones.
+NEMO_MARS_SPLIT=0 retrieves the forecast as a single part.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from backends import mars_retrieve
+from scratch import tmp_path
+
+PARAM_GROUPS = {
+    "inst": "2t/10u/10v/msl/2d/sp/tcc",
+    "accum": "tp/sf/ssrd/strd",
+}
+BLOCK_HOURS = int(os.environ.get("NEMO_MARS_BLOCK_HOURS", 24))
+WORKERS = int(os.environ.get("NEMO_MARS_WORKERS", 4))
+
+
+def forecast_steps(max_hour):
+    """Output steps of the HRES surface forecast up to max_hour."""
+    return [s for s in range(max_hour + 1) if s <= 90 or (s <= 144 and s % 3 == 0) or s % 6 == 0]
+
+
+def step_blocks(steps, block_hours=BLOCK_HOURS):
+    """Steps cut into blocks of block_hours: [0..24], [25..48], ... (step 0 joins the first block)."""
+    blocks = {}
+    for s in steps:
+        blocks.setdefault(max(s - 1, 0) // block_hours, []).append(s)
+    return [blocks[k] for k in sorted(blocks)]
+
+
+def plan_parts(date_str, ndays, area, grid, part_dir, split=None):
+    """
+    MARS requests of one forecast: a list of dicts with name, group, steps,
+    request and target (GRIB file in part_dir), ordered by first step.
+    """
+    if split is None:
+        split = os.environ.get("NEMO_MARS_SPLIT", "1") != "0"
+    steps = forecast_steps(ndays * 24)
+    base = {
+        "class": "od", "stream": "oper", "expver": "0001",
+        "domain": "g", "type": "fc", "levtype": "sfc",
+        "date": f"{date_str[:4]}-{date_str[4:6]}-{date_str[6:8]}", "time": "00",
+        "use": "bc", "area": area, "grid": grid, "format": "grib2",
+    }
+    if not split:
+        request = dict(base, step="/".join(map(str, steps)), param="/".join(PARAM_GROUPS.values()))
+        return [dict(name="all", group="all", steps=steps, request=request,
+                     target=os.path.join(part_dir, f"all_{steps[0]:03d}-{steps[-1]:03d}.grib"))]
+
+    parts = []
+    for block in step_blocks(steps):
+        for group, params in PARAM_GROUPS.items():
+            name = f"{group}_{block[0]:03d}-{block[-1]:03d}"
+            request = dict(base, step="/".join(map(str, block)), param=params)
+            parts.append(dict(name=name, group=group, steps=block, request=request,
+                              target=os.path.join(part_dir, f"{name}.grib")))
+    return parts
+
+
+def _retrieve(part):
+    tmp = tmp_path(part["target"])
+    mars_retrieve(part["request"], tmp)
+    os.replace(tmp, part["target"])
+    return part
+
+
+def retrieve_parts(parts, on_part=None, workers=None):
+    """
+    Retrieve the missing parts concurrently; on_part(part) is called in the
+    calling thread for every part, as soon as its GRIB file is complete.
+    The first failure cancels the parts not yet started and is raised.
+    """
+    workers = workers or WORKERS
+    for part in parts:
+        os.makedirs(os.path.dirname(part["target"]), exist_ok=True)
+    missing = [p for p in parts if not os.path.exists(p["target"])]
+    print(f"[INFO] MARS: {len(parts)} part(s), {len(parts) - len(missing)} already on disk, "
+          f"{len(missing)} to retrieve with {min(workers, max(len(missing), 1))} worker(s)")
+
+    for part in parts:
+        if part not in missing and on_part:
+            on_part(part)
+    if not missing:
+        return parts
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(missing))) as pool:
+        futures = [pool.submit(_retrieve, p) for p in missing]
+        try:
+            for future in as_completed(futures):
+                part = future.result()
+                print(f"[OK] MARS part {part['name']} ({len(part['steps'])} steps) -> {part['target']}")
+                if on_part:
+                    on_part(part)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+    return parts
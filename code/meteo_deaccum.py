@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+ECMWF forecast -> hourly NEMO meteo forcing (FORCE_ecmwf_y*m*d*.nc), in NumPy.
+
+The operational surface forecast is hourly to +90 h, 3-hourly to +144 h and
+6-hourly beyond. Accumulated fields (strd, ssrd, tp, sf) are differenced at
+their native steps and divided by the actual interval length, so the mean
+flux over (t_k-1, t_k] is exact whatever the step; that rate is then held
+over every hour of the interval (zero-order hold), which keeps the hourly
+forcing conservative: the hourly values of an interval add up to its
+accumulation. Interpolating the accumulations to hourly before differencing
+(cdo inttime + deltat) spreads the 3-/6-hourly totals linearly and gives
+wrong radiation and precipitation beyond +90 h.
+
+Instantaneous fields are interpolated linearly in time. Every output field
+is produced in one pass over the forecast, day by day, so memory stays at
+the decoded forecast plus one day of hourly output.
+
+Output (one record per hour, stamped at the end of the hour for the fluxes):
+  slp [Pa], sh [kg/kg], t2 [K], u10, v10 [m/s], lwr, swr [W/m2], tp, snow [kg/m2/s]
+
+The first record of the cycle (00 UTC, flux over the last hour of the day
+before) comes from the previous cycle. Every cycle leaves that record for the
+next one in a small sidecar next to its FORCE files,
+FLUX_state_ecmwf_y*m*d*.npz (named after the date it is valid for), read
+without decompressing any NetCDF. Without a sidecar the record is read from
+the previous cycle's FORCE file for this date, else the first forecast hour
+is used.
+"""
+import os
+import argparse
+from datetime import datetime, timedelta
+
+import numpy as np
+import netCDF4
+
+from scratch import tmp_path
+from nc_profiles import var_options, file_format
+
+# Instantaneous fields: name -> candidate names in the decoded GRIB (cdo codes, ecCodes short names)
+INSTANT = {
+    "t2": ("var167", "2t", "t2m", "t2"),
+    "u10": ("var165", "10u", "u10"),
+    "v10": ("var166", "10v", "v10"),
+    "msl": ("var151", "msl"),
+    "sp": ("var134", "sp"),
+    "d2": ("var168", "2d", "d2m", "d2"),
+}
+# Accumulated fields: output name -> (candidate names, factor to J/m2 or kg/m2)
+ACCUMULATED = {
+    "lwr": (("var175", "strd"), 1.0),
+    "swr": (("var169", "ssrd"), 1.0),
+    "tp": (("var228", "tp"), 1000.0),
+    "snow": (("var144", "sf"), 1000.0),
+}
+OUTPUT = {
+    "slp": "Pa", "sh": "kg/kg", "t2": "K", "u10": "m/s", "v10": "m/s",
+    "lwr": "W/m2", "swr": "W/m2", "tp": "kg/m2/s", "snow": "kg/m2/s",
+}
+MAX_DAYS = 15
+STATE_FILE = "FLUX_state_ecmwf_y{:%Y}m{:%m}d{:%d}.npz"
+
+
+def _coord(nc, names):
+    name = next((n for n in names if n in nc.variables), None)
+    if name is None:
+        raise KeyError(f"No {names[0]} coordinate in {nc.filepath()}")
+    return np.asarray(nc.variables[name][:], dtype=np.float64)
+
+
+def read_forecast(files, start):
+    """
+    Decoded forecast files (any split by step and parameter) ->
+    (lat, lon, {name: (hours since start, (nsteps, ny, nx) float32)}).
+    """
+    wanted = {name: cands for name, cands in INSTANT.items()}
+    wanted.update({name: cands for name, (cands, _) in ACCUMULATED.items()})
+    pieces = {}
+    lat = lon = None
+    for path in files:
+        with netCDF4.Dataset(path) as nc:
+            if lat is None:
+                lat, lon = _coord(nc, ("lat", "latitude")), _coord(nc, ("lon", "longitude"))
+            t = nc.variables["time"]
+            dates = netCDF4.num2date(t[:], t.units, getattr(t, "calendar", "standard"),
+                                     only_use_cftime_datetimes=False, only_use_python_datetimes=True)
+            hours = np.array([(d - start).total_seconds() / 3600.0 for d in np.atleast_1d(dates)])
+            for name, cands in wanted.items():
+                var = next((c for c in cands if c in nc.variables), None)
+                if var is not None:
+                    data = np.asarray(nc.variables[var][:], dtype=np.float32).reshape(len(hours), lat.size, lon.size)
+                    pieces.setdefault(name, []).append((hours, data))
+
+    missing = sorted(set(wanted) - set(pieces))
+    if missing:
+        raise KeyError(f"Fields missing from the forecast: {', '.join(missing)}")
+
+    fields = {}
+    for name, parts in pieces.items():
+        hours = np.concatenate([h for h, _ in parts])
+        data = np.concatenate([d for _, d in parts])
+        hours, first = np.unique(np.round(hours, 3), return_index=True)   # sorted, duplicates dropped
+        fields[name] = (hours, data[first])
+    return lat, lon, fields
+
+
+def accumulation_rates(hours, acc, factor):
+    """
+    Mean rate over each native interval: rates[k] = factor * (A[k+1] - A[k]) / dt[k]
+    for (hours[k], hours[k+1]]. A forecast without step 0 starts from zero.
+    """
+    if hours[0] > 0:
+        hours = np.concatenate([[0.0], hours])
+        acc = np.concatenate([np.zeros_like(acc[:1]), acc])
+    dt = np.diff(hours) * 3600.0
+    rates = np.diff(acc, axis=0)
+    rates *= (factor / dt).astype(np.float32)[:, None, None]
+    np.maximum(rates, 0.0, out=rates)   # packing noise in the accumulations
+    return hours, rates
+
+
+def hold_index(hours, out_hours):
+    """Native interval holding each output hour (h-1, h], h >= 1."""
+    return np.clip(np.searchsorted(hours, out_hours, side="left") - 1, 0, len(hours) - 2)
+
+
+def interp_weights(hours, out_hours):
+    """Upper neighbour k and weight w of linear interpolation between hours[k-1] and hours[k]."""
+    k = np.clip(np.searchsorted(hours, out_hours, side="left"), 1, len(hours) - 1)
+    w = (out_hours - hours[k - 1]) / (hours[k] - hours[k - 1])
+    return k, w.astype(np.float32)[:, None, None]
+
+
+def specific_humidity(d2, sp):
+    """Same formula as the former cdo expr (Magnus vapour pressure in hPa)."""
+    e = 6.112 * np.exp((17.67 * (d2 - 273.15)) / (d2 - 273.15 + 243.5))
+    return (0.622 * e) / (sp - 0.378 * e) * 100
+
+
+def state_path(odir, valid):
+    """Flux state sidecar in odir for the 00 UTC record of the date `valid`."""
+    return os.path.join(odir, STATE_FILE.format(valid, valid, valid))
+
+
+def write_flux_state(path, valid, lat, lon, fluxes):
+    """Save the 00 UTC flux record of `valid` for the next cycle (atomic)."""
+    tmp = tmp_path(path)
+    with open(tmp, "wb") as f:
+        np.savez(f, valid=f"{valid:%Y%m%d%H}", lat=lat, lon=lon,
+                 **{name: np.asarray(fluxes[name], dtype=np.float32) for name in ACCUMULATED})
+    os.replace(tmp, path)
+
+
+def read_flux_state(path, valid, lat, lon):
+    """Flux record from a sidecar, or None if missing, for another time or for another grid."""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as state:
+            if str(state["valid"]) != f"{valid:%Y%m%d%H}" or state["lat"].shape != lat.shape \
+                    or state["lon"].shape != lon.shape or not np.allclose(state["lat"], lat) \
+                    or not np.allclose(state["lon"], lon):
+                print(f"WARNING: Flux state {path} does not match this cycle, ignored")
+                return None
+            return {name: state[name] for name in ACCUMULATED}
+    except (OSError, KeyError, ValueError) as e:
+        print(f"WARNING: Cannot read flux state {path}: {e}")
+        return None
+
+
+def first_fluxes(valid, lat, lon, prev_state=None, prev_force=None):
+    """
+    Flux record at 00 UTC of `valid` from the previous cycle: its sidecar, else
+    record 0 of its FORCE file for this date. Returns (fluxes or None, source).
+    """
+    fluxes = read_flux_state(prev_state, valid, lat, lon)
+    if fluxes is not None:
+        return fluxes, "previous cycle state"
+    if not prev_force or not os.path.exists(prev_force):
+        return None, "first forecast hour"
+    with netCDF4.Dataset(prev_force) as nc:
+        if not all(name in nc.variables for name in ACCUMULATED):
+            return None, "first forecast hour"
+        return {name: np.asarray(nc.variables[name][0], dtype=np.float32) for name in ACCUMULATED}, \
+            "previous cycle FORCE file"
+
+
+def write_force(path, start, out_hours, lat, lon, fields):
+    """One FORCE file: hourly records of out_hours (hours since start)."""
+    tmp = tmp_path(path)
+    with netCDF4.Dataset(tmp, "w", format=file_format("forcing")) as nc:
+        nc.createDimension("time", None)
+        nc.createDimension("lat", lat.size)
+        nc.createDimension("lon", lon.size)
+        t = nc.createVariable("time", "f8", ("time",))
+        t.standard_name = "time"
+        t.units = f"hours since {start:%Y-%m-%d %H:%M:%S}"
+        t.calendar = "standard"
+        t.axis = "T"
+        t[:] = out_hours
+        for name, units, values in (("lat", "degrees_north", lat), ("lon", "degrees_east", lon)):
+            v = nc.createVariable(name, "f8", (name,))
+            v.units = units
+            v[:] = values
+        for name, units in OUTPUT.items():
+            dims = ("time", "lat", "lon")
+            v = nc.createVariable(name, "f4", dims, **var_options("forcing", dims, (1, lat.size, lon.size)))
+            v.units = units
+            v[:] = fields[name]
+    os.replace(tmp, path)
+
+
+def deaccumulate(files, date_str, ndays, odir, prev_force=None, prev_state=None):
+    """
+    Decoded forecast files -> FORCE_ecmwf_y*m*d*.nc in odir, one per day, and
+    the flux state of the next day's 00 UTC. Returns the FORCE files written.
+    """
+    start = datetime.strptime(date_str, "%Y%m%d")
+    lat, lon, fields = read_forecast(files, start)
+
+    rates = {}
+    for name, (_, factor) in ACCUMULATED.items():
+        rates[name] = accumulation_rates(*fields[name], factor)
+    last = min(min(h[-1] for h, _ in fields.values()), ndays * 24)
+    step1, source = first_fluxes(start, lat, lon, prev_state, prev_force)
+    print(f"[INFO] De-accumulation: {len(fields['lwr'][0])} native steps to +{last:g} h, "
+          f"00 UTC fluxes from {source}")
+
+    os.makedirs(odir, exist_ok=True)
+    written = []
+    for n in range(min(ndays, MAX_DAYS) + 1):
+        out_hours = np.arange(24 * n, min(24 * n + 24, last + 1), dtype=np.float64)
+        if out_hours.size == 0:
+            break
+        day = {}
+        for name in INSTANT:
+            hours, data = fields[name]
+            k, w = interp_weights(hours, out_hours)
+            day[name] = data[k - 1] * (1 - w) + data[k] * w
+        for name in ACCUMULATED:
+            hours, rate = rates[name]
+            # Flux of the hour ending at h; 00 UTC of the cycle ends the previous day
+            day[name] = rate[hold_index(hours, np.maximum(out_hours, 1.0))]
+            if n == 0 and step1 is not None:
+                day[name][0] = step1[name]
+
+        out = {
+            "slp": day["msl"], "sh": specific_humidity(day["d2"], day["sp"]),
+            "t2": day["t2"], "u10": day["u10"], "v10": day["v10"],
+            "lwr": day["lwr"], "swr": day["swr"], "tp": day["tp"], "snow": day["snow"],
+        }
+        date = start + timedelta(days=n)
+        path = os.path.join(odir, f"FORCE_ecmwf_y{date:%Y}m{date:%m}d{date:%d}.nc")
+        write_force(path, start, out_hours, lat, lon, out)
+        written.append(path)
+
+    if last >= 24:
+        valid = start + timedelta(days=1)
+        state = {name: rates[name][1][hold_index(rates[name][0], np.array([24.0]))[0]] for name in ACCUMULATED}
+        write_flux_state(state_path(odir, valid), valid, lat, lon, state)
+    print(f"[OK] {len(written)} FORCE file(s) written to {odir}")
+    return written
+
+
+def main():
+    ap = argparse.ArgumentParser(description="De-accumulate a decoded ECMWF forecast into hourly FORCE files")
+    ap.add_argument("files", nargs="+", help="Decoded forecast NetCDF files (any split by step / parameter)")
+    ap.add_argument("--date", required=True, help="Forecast start date YYYYMMDD (00 UTC)")
+    ap.add_argument("--ndays", type=int, required=True, help="Forecast length in days")
+    ap.add_argument("--odir", required=True, help="Output directory")
+    ap.add_argument("--prev-force", default=None, help="Previous cycle's FORCE file for --date")
+    ap.add_argument("--prev-state", default=None, help="Previous cycle's flux state sidecar for --date")
+    args = ap.parse_args()
+    deaccumulate(args.files, args.date, args.ndays, args.odir, args.prev_force, args.prev_state)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+NetCDF write profiles: format, chunk shapes, precision and compression per file type.
+
+NEMO's fldread/iom reads one time record per call, and for 3-D fields one
+level at a time (bdy: the whole column of every boundary point). A chunk
+that spans several records or levels is decompressed in full for every
+read, and the HDF5 default chunking of an unlimited time axis makes that
+the common case. Every writer therefore takes its layout from a profile:
+
+  forcing   : meteo FORCE, runoff, raw CMEMS boxes - one chunk per record
+              (and level), float32, zlib + shuffle
+  bdy       : bdy_hourly_2d/3d files - one chunk per record holding the whole
+              boundary (all points, all levels), float32, zlib + shuffle
+  initial   : initial state - one chunk per level, float32
+  increment : assimilation increments/state - one chunk per record and level, float32
+  restart   : rebuilt/split restarts - one chunk per record and level, precision kept
+  scratch   : intermediates re-read by the workflow itself - uncompressed
+
+Float fields are written as float32 where the profile allows it (every
+product of the workflow is at most single precision); coordinates and time
+keep their type. NEMO_NC_COMPLEVEL overrides the zlib level of every
+compressed profile (e.g. 4 for files kept long on HPCPERM).
+
+  var_options(kind, dims, shape)  -> netCDF4 createVariable keyword arguments
+  encoding(kind, ds)              -> xarray to_netcdf encoding of the data variables
+  cdo_options(kind)               -> cdo output options (-f, -z, --shuffle, -k, -b)
+"""
+import os
+from dataclasses import dataclass
+
+import numpy as np
+
+RECORD_DIMS = ("time", "t", "time_counter")
+LEVEL_DIMS = ("depth", "z", "deptht", "nav_lev")
+
+
+@dataclass(frozen=True)
+class WriteProfile:
+    format: str = "NETCDF4_CLASSIC"
+    complevel: int = 1
+    shuffle: bool = True
+    float32: bool = True
+    per_level: bool = True    # one chunk per level; False: the whole column in one chunk
+
+
+PROFILES = {
+    "forcing": WriteProfile(),
+    "bdy": WriteProfile(per_level=False),
+    "initial": WriteProfile(),
+    "increment": WriteProfile(),
+    "restart": WriteProfile(format="NETCDF4", float32=False),
+    "scratch": WriteProfile(complevel=0, shuffle=False),
+}
+
+
+def profile(kind):
+    return PROFILES[kind]
+
+
+def complevel(kind):
+    level = profile(kind).complevel
+    if level and os.environ.get("NEMO_NC_COMPLEVEL"):
+        level = int(os.environ["NEMO_NC_COMPLEVEL"])
+    return level
+
+
+def file_format(kind):
+    return profile(kind).format
+
+
+def chunk_shape(kind, dims, shape):
+    """One record (and one level unless the profile keeps columns whole) per chunk."""
+    per_level = profile(kind).per_level
+    return tuple(1 if d in RECORD_DIMS or (per_level and d in LEVEL_DIMS) else max(int(n), 1)
+                 for d, n in zip(dims, shape))
+
+
+def var_dtype(kind, dtype):
+    dtype = np.dtype(dtype)
+    return np.dtype(np.float32) if profile(kind).float32 and dtype.kind == "f" else dtype
+
+
+def var_options(kind, dims, shape):
+    """createVariable(..., **var_options(kind, dims, shape)); scalars get no options."""
+    if not dims:
+        return {}
+    level = complevel(kind)
+    options = dict(chunksizes=chunk_shape(kind, dims, shape), zlib=level > 0)
+    if level:
+        options.update(complevel=level, shuffle=profile(kind).shuffle)
+    return options
+
+
+def encoding(kind, ds, names=None):
+    """xarray encoding of the data variables `names` (default: all) of ds."""
+    result = {}
+    for name in names or ds.data_vars:
+        var = ds[name]
+        enc = var_options(kind, var.dims, var.shape)
+        if "chunksizes" in enc:
+            enc["chunksizes"] = list(enc["chunksizes"])
+        if var.dtype.kind == "f":
+            enc["dtype"] = var_dtype(kind, var.dtype).name
+        result[name] = enc
+    return result
+
+
+def cdo_options(kind):
+    """cdo output options of a profile: NetCDF4 classic, per-record chunks, compression, float32."""
+    p = profile(kind)
+    options = ["-f", "nc4c" if p.format == "NETCDF4_CLASSIC" else "nc4", "-k", "grid"]
+    level = complevel(kind)
+    if level:
+        options += ["-z", f"zip_{level}"] + (["--shuffle"] if p.shuffle else [])
+    if p.float32:
+        options += ["-b", "F32"]
+    return options
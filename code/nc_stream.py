@@ -0,0 +1,163 @@
+"""
+Streaming netCDF writer for lazily opened remote datasets (copernicusmarine).
+
+The dataset is written in time slabs: up to `workers` slabs are fetched
+concurrently in threads, and the main thread writes them in order into
+{path}.part. So peak memory is about workers x slab and does not depend on
+the length of the forecast window. After every slab the .part file records
+how many time records it holds. A rerun with the same request continues
+from there, and the file is renamed to `path` once complete.
+
+A dataset read from local netCDF files (the local CMEMS backend) goes through
+the same libnetcdf/HDF5 as the writer, which is not thread-safe: with
+lock_reads=True the fetches and the writes share one lock, as in
+cpandadjust_boundary. Remote (zarr over HTTP) reads stay concurrent.
+"""
+import os
+import time
+import threading
+from contextlib import nullcontext
+import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import netCDF4
+
+from nc_profiles import var_options, file_format
+
+SLAB = int(os.environ.get("NEMO_STREAM_SLAB", 24))
+WORKERS = int(os.environ.get("NEMO_STREAM_WORKERS", 4))
+SKIP_ATTRS = ("_FillValue", "missing_value")
+
+
+def _signature(ds, time_dim):
+    """Identifies the request (times, variables, shapes) a .part file belongs to."""
+    h = hashlib.sha1()
+    h.update(np.asarray(ds[time_dim].values).astype("datetime64[s]").tobytes())
+    for name in sorted(ds.variables):
+        h.update(f"{name}{ds[name].dims}{ds[name].shape}".encode())
+    return h.hexdigest()
+
+
+def _time_values(times):
+    return np.asarray(times).astype("datetime64[s]").astype(np.int64).astype(np.float64)
+
+
+def _create(path, ds, time_dim, signature):
+    nc = netCDF4.Dataset(path, "w", format=file_format("forcing"))
+    try:
+        _define(nc, ds, time_dim, signature)
+    except Exception:
+        nc.close()
+        os.remove(path)
+        raise
+    return nc
+
+
+def _define(nc, ds, time_dim, signature):
+    for dim, size in ds.sizes.items():
+        nc.createDimension(dim, size)
+    nc.setncatts({k: v for k, v in ds.attrs.items() if isinstance(v, (str, int, float))})
+
+    t = nc.createVariable(time_dim, "f8", (time_dim,))
+    t.units = "seconds since 1970-01-01 00:00:00"
+    t.calendar = "standard"
+    t.standard_name = "time"
+    t[:] = _time_values(ds[time_dim].values)
+
+    for name, var in ds.variables.items():
+        if name == time_dim:
+            continue
+        # Classic model types: float fields as float32, 64-bit ints narrowed
+        if var.dtype.kind == "f":
+            dtype = np.float32 if time_dim in var.dims else var.dtype
+        else:
+            dtype = np.int32 if var.dtype.kind in "iu" else var.dtype
+        # Time-dependent fields: one chunk per record (and level), see nc_profiles "forcing"
+        options = var_options("forcing", var.dims, var.shape) if time_dim in var.dims else {}
+        if "chunksizes" in options:
+            options["chunksizes"] = tuple(1 if d == time_dim else c for d, c in zip(var.dims, options["chunksizes"]))
+        v = nc.createVariable(name, dtype, var.dims,
+                              fill_value=np.float32(np.nan) if time_dim in var.dims and dtype == np.float32 else None,
+                              **options)
+        v.setncatts({k: val for k, val in var.attrs.items() if k not in SKIP_ATTRS})
+        if time_dim not in var.dims:
+            v[...] = var.values
+    nc.stream_signature = signature
+    nc.records_written = 0
+
+
+def _open_part(path, ds, time_dim, signature):
+    """Reopen a matching .part file, or start a new one."""
+    if os.path.exists(path):
+        try:
+            nc = netCDF4.Dataset(path, "a")
+            if getattr(nc, "stream_signature", None) == signature:
+                return nc
+            nc.close()
+        except OSError:
+            pass
+        print(f"WARNING: Discarding unusable partial file {path}")
+        os.remove(path)
+    return _create(path, ds, time_dim, signature)
+
+
+def _fetch(ds, names, time_dim, start, stop, lock):
+    with lock:
+        return {n: np.asarray(ds[n].isel({time_dim: slice(start, stop)}).values) for n in names}
+
+
+def stream_to_netcdf(ds, path, time_dim="time", slab=None, workers=None, lock_reads=False):
+    """
+    Write `ds` to `path` slab by slab along time_dim, resuming from {path}.part.
+    lock_reads: ds is backed by local netCDF files (see the module docstring).
+    """
+    slab = slab or SLAB
+    workers = workers or WORKERS
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    part = f"{path}.part"
+    names = [n for n, v in ds.data_vars.items() if time_dim in v.dims]
+    ntime = ds.sizes[time_dim]
+
+    nc = _open_part(part, ds, time_dim, _signature(ds, time_dim))
+    done = int(nc.records_written)
+    if done:
+        print(f"[INFO] Resuming {os.path.basename(path)} at record {done}/{ntime}")
+
+    nc_lock = threading.Lock()
+    read_lock = nc_lock if lock_reads else nullcontext()
+    t0 = time.perf_counter()
+    nbytes = 0
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            starts = iter(range(done, ntime, slab))
+            window = deque()
+            for start in starts:
+                window.append((start, pool.submit(_fetch, ds, names, time_dim, start, min(start + slab, ntime), read_lock)))
+                if len(window) >= workers:
+                    break
+            while window:
+                start, future = window.popleft()
+                data = future.result()
+                next_start = next(starts, None)
+                if next_start is not None:
+                    window.append((next_start, pool.submit(_fetch, ds, names, time_dim, next_start,
+                                                           min(next_start + slab, ntime), read_lock)))
+                with nc_lock:
+                    for n, values in data.items():
+                        v = nc.variables[n]
+                        index = tuple(slice(start, start + values.shape[i]) if d == time_dim else slice(None)
+                                      for i, d in enumerate(v.dimensions))
+                        v[index] = values
+                        nbytes += values.nbytes
+                    nc.records_written = min(start + slab, ntime)
+                    nc.sync()
+                elapsed = time.perf_counter() - t0
+                print(f"[INFO] {os.path.basename(path)}: {nc.records_written}/{ntime} records, "
+                      f"{nbytes / 2**20:.1f} MB at {nbytes / 2**20 / max(elapsed, 1e-6):.1f} MB/s")
+    finally:
+        nc.close()
+
+    os.replace(part, path)
+    print(f"[OK] Saved: {path} ({nbytes / 2**20:.1f} MB in {time.perf_counter() - t0:.1f} s)")
@@ -0,0 +1,550 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark of the pre-processing stages on synthetic EST05-sized data.
+
+The inputs are generated once into --workdir. They are a CMEMS-like boundary
+box, daily BDY files, an ECMWF-like GRIB forecast, the previous days' FORCE
+files and the 256 restart tiles of the previous cycle. By default they have
+the real sizes: 403x300 CMEMS source grid, 529x455 model grid, 110 model
+levels, 144 hourly steps and 256 restart tiles. Each stage then runs in a
+forked child, so its wall/CPU time and peak RSS (including its cdo and python
+subprocesses) are its own. Stage output goes to {workdir}/logs/{stage}.log.
+Stages whose tools are not installed (cdo, gsw) are reported as
+skipped. Nothing is downloaded or submitted.
+
+  python nemo_benchmark.py --output bench.json
+  python nemo_benchmark.py --output bench.json --baseline bench_baseline.json
+  python nemo_benchmark.py --preset small --stages bdy_extract,link_restart
+
+With --baseline, any stage whose wall time or peak RSS is more than
+--tolerance above the baseline is listed, and the exit status is 1.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import importlib.util
+from datetime import datetime, timedelta
+
+import numpy as np
+import netCDF4
+
+PRESETS = {
+    # (nx, ny) source and model grids, model/source levels, hourly steps, restart tiles
+    "est05": dict(src=(403, 300), dst=(529, 455), levels=110, src_levels=56, hours=144, tiles=256),
+    "small": dict(src=(101, 75), dst=(133, 114), levels=30, src_levels=20, hours=48, tiles=16),
+}
+DATE = "20250105"
+RUNID = "EST05nm_op_deode21"
+MODEL_BOX = dict(lon=(21.0, 30.4), lat=(57.5, 60.8))
+SOURCE_BOX = dict(lon=(20.8, 30.6), lat=(57.3, 61.0))
+ECMWF_BOX = dict(lon=(9.0, 31.0), lat=(53.0, 66.0), step=0.08)   # area 66/9/53/31, grid .08/.08
+# Bumped when the generators change, so existing --workdir inputs are regenerated
+INPUTS_VERSION = 2
+
+STAGES = ["bdy_extract", "teos10", "meteo_deaccum", "ecmwf_postprocess", "runoff",
+          "fill_nan_with_nearest", "cpandadjust_boundary", "link_restart"]
+
+
+class Skip(Exception):
+    """A tool or module needed by the stage is not available."""
+
+
+def _ymd(date):
+    return date.strftime("%Y"), date.strftime("%m"), date.strftime("%d")
+
+
+def _days(sizes):
+    return sizes["hours"] // 24
+
+
+def _paths(workdir):
+    return dict(
+        forcing=os.path.join(workdir, "forcing"),
+        rundir=os.path.join(workdir, "run") + "/",
+        setup=os.path.join(workdir, "setup"),
+        weights=os.path.join(workdir, "weights"),
+        coords=os.path.join(workdir, "setup", "coordinates.bdy.nc"),
+        cmems=os.path.join(workdir, "cmems_bdy_box.nc"),
+        grib=os.path.join(workdir, "forcing", "ECMWF_fc", "temp", "FC_synthetic.grb"),
+        forecast=os.path.join(workdir, "forcing", "ECMWF_fc", "temp", "FC_synthetic.nc"),
+        logs=os.path.join(workdir, "logs"),
+    )
+
+
+def _bdy_dir(forcing, date_str=DATE):
+    y, m, d = date_str[:4], date_str[4:6], date_str[6:8]
+    return os.path.join(forcing, "boundary", "cmems_nrt_bc_V110", y, m, d, "00")
+
+
+def _axis(box, n):
+    return np.linspace(box[0], box[1], n)
+
+
+def _model_depth(levels):
+    if levels == 110:
+        from vertical_interp import EST05_LEVELS
+        return np.asarray(EST05_LEVELS, dtype=np.float64)
+    return np.cumsum(np.linspace(1.0, 6.0, levels)) - 0.5
+
+
+def _field(rng, shape, base, amplitude):
+    return (base + amplitude * rng.standard_normal(shape)).astype(np.float32)
+
+
+def _time_var(nc, start, hours):
+    t = nc.createVariable("time", "f8", ("time",))
+    t.units = f"hours since {start:%Y-%m-%d} 00:00:00"
+    t.calendar = "standard"
+    t.standard_name = "time"
+    t[:] = np.arange(hours, dtype=np.float64)
+
+
+# ---------------------------------------------------------------- synthetic inputs
+
+def make_grid_files(p, sizes, rng):
+    """bathy_meter.nc on the model grid, coordinates.bdy.nc on its western edge."""
+    nx, ny = sizes["dst"]
+    lon, lat = _axis(MODEL_BOX["lon"], nx), _axis(MODEL_BOX["lat"], ny)
+    os.makedirs(p["forcing"], exist_ok=True)
+    os.makedirs(p["setup"], exist_ok=True)
+
+    with netCDF4.Dataset(os.path.join(p["forcing"], "bathy_meter.nc"), "w") as nc:
+        nc.createDimension("y", ny)
+        nc.createDimension("x", nx)
+        glon, glat = np.meshgrid(lon, lat)
+        for name, values, units in (("nav_lon", glon, "degrees_east"), ("nav_lat", glat, "degrees_north")):
+            v = nc.createVariable(name, "f4", ("y", "x"))
+            v.units = units
+            v[:] = values
+        b = nc.createVariable("Bathymetry", "f4", ("y", "x"))
+        b.coordinates = "nav_lat nav_lon"
+        b[:] = np.where(glat > 59.8, 0.0, 60.0)
+
+    with netCDF4.Dataset(p["coords"], "w") as nc:
+        nc.createDimension("yb", 1)
+        nc.createDimension("xbT", ny)
+        nc.createVariable("glamt", "f8", ("yb", "xbT"))[:] = np.full((1, ny), lon[0])
+        nc.createVariable("gphit", "f8", ("yb", "xbT"))[:] = lat.reshape(1, ny)
+
+
+def make_cmems_box(p, sizes, rng):
+    """Raw CMEMS file as fetched for the boundary: the source grid cut to fetch_region()."""
+    from bdy_extract import fetch_region
+    nx, ny = sizes["src"]
+    lon, lat = _axis(SOURCE_BOX["lon"], nx), _axis(SOURCE_BOX["lat"], ny)
+    region = fetch_region(p["coords"])
+    ix = np.flatnonzero((lon >= region["minimum_longitude"]) & (lon <= region["maximum_longitude"]))
+    iy = np.flatnonzero((lat >= region["minimum_latitude"]) & (lat <= region["maximum_latitude"]))
+    ix = np.arange(max(ix[0] - 1, 0), min(ix[-1] + 2, nx))
+    iy = np.arange(max(iy[0] - 1, 0), min(iy[-1] + 2, ny))
+    depth = np.cumsum(np.geomspace(1.0, 12.0, sizes["src_levels"])) - 0.5
+    hours = sizes["hours"]
+    land = rng.random((iy.size, ix.size)) < 0.1
+
+    with netCDF4.Dataset(p["cmems"], "w", format="NETCDF4_CLASSIC") as nc:
+        nc.createDimension("time", hours)
+        nc.createDimension("depth", depth.size)
+        nc.createDimension("latitude", iy.size)
+        nc.createDimension("longitude", ix.size)
+        _time_var(nc, datetime.strptime(DATE, "%Y%m%d"), hours)
+        nc.createVariable("depth", "f4", ("depth",))[:] = depth
+        nc.createVariable("latitude", "f4", ("latitude",))[:] = lat[iy]
+        nc.createVariable("longitude", "f4", ("longitude",))[:] = lon[ix]
+        sla = nc.createVariable("sla", "f4", ("time", "latitude", "longitude"), fill_value=np.float32(np.nan))
+        sla.units = "m"
+        for name, base, amp, units in (("thetao", 8.0, 2.0, "degrees_C"), ("so", 6.5, 0.5, "1e-3")):
+            v = nc.createVariable(name, "f4", ("time", "depth", "latitude", "longitude"),
+                                  fill_value=np.float32(np.nan), chunksizes=(1, depth.size, iy.size, ix.size))
+            v.units = units
+            for t in range(hours):
+                values = _field(rng, (depth.size, iy.size, ix.size), base, amp)
+                values[:, land] = np.nan
+                v[t] = values
+        values = _field(rng, (hours, iy.size, ix.size), 0.0, 0.1)
+        values[:, land] = np.nan
+        sla[:] = values
+
+
+def make_bdy_files(p, sizes, rng):
+    """Daily bdy_hourly_2d/3d files as written by bdy_extract (input of TEOS-10 and cpandadjust_boundary)."""
+    odir = _bdy_dir(p["forcing"])
+    os.makedirs(odir, exist_ok=True)
+    npts = sizes["dst"][1]
+    depth = _model_depth(sizes["levels"])
+    start = datetime.strptime(DATE, "%Y%m%d")
+    for i in range(_days(sizes)):
+        day = start + timedelta(days=i)
+        label = "y{}m{}d{}".format(*_ymd(day))
+        for kind, names in (("2d", ("sla", "uos", "vos")), ("3d", ("thetao", "so", "vo", "uo"))):
+            with netCDF4.Dataset(os.path.join(odir, f"bdy_hourly_{kind}_{label}.nc"), "w", format="NETCDF4_CLASSIC") as nc:
+                nc.createDimension("time", 24)
+                nc.createDimension("yb", 1)
+                nc.createDimension("xbT", npts)
+                _time_var(nc, day, 24)
+                nc.createVariable("nav_lon", "f4", ("yb", "xbT"))[:] = np.full((1, npts), MODEL_BOX["lon"][0])
+                nc.createVariable("nav_lat", "f4", ("yb", "xbT"))[:] = _axis(MODEL_BOX["lat"], npts).reshape(1, -1)
+                dims = ("time", "yb", "xbT")
+                if kind == "3d":
+                    nc.createDimension("depth", depth.size)
+                    nc.createVariable("depth", "f8", ("depth",))[:] = depth
+                    dims = ("time", "depth", "yb", "xbT")
+                shape = tuple(len(nc.dimensions[d]) for d in dims)
+                for name in names:
+                    base = {"thetao": 8.0, "so": 6.5}.get(name, 0.0)
+                    nc.createVariable(name, "f4", dims, zlib=True, complevel=2)[:] = _field(rng, shape, base, 0.1)
+
+
+def make_meteo(p, sizes, rng):
+    """Previous days' FORCE files (runoff input), the decoded forecast and, with cdo, its GRIB version."""
+    lon = np.arange(ECMWF_BOX["lon"][0], ECMWF_BOX["lon"][1] + 1e-6, ECMWF_BOX["step"])
+    lat = np.arange(ECMWF_BOX["lat"][1], ECMWF_BOX["lat"][0] - 1e-6, -ECMWF_BOX["step"])
+    start = datetime.strptime(DATE, "%Y%m%d")
+
+    def grid_file(path, times, start_time, fields):
+        with netCDF4.Dataset(path, "w", format="NETCDF4_CLASSIC") as nc:
+            nc.createDimension("time", len(times))
+            nc.createDimension("lat", lat.size)
+            nc.createDimension("lon", lon.size)
+            t = nc.createVariable("time", "f8", ("time",))
+            t.units = f"hours since {start_time:%Y-%m-%d %H:%M:%S}"
+            t.calendar = "standard"
+            t[:] = times
+            for name, units, values in ((("lat", "degrees_north", lat), ("lon", "degrees_east", lon))):
+                v = nc.createVariable(name, "f8", (name,))
+                v.units = units
+                v[:] = values
+            for name, values in fields(len(times)).items():
+                nc.createVariable(name, "f4", ("time", "lat", "lon"))[:] = values
+
+    for d in range(0, 5):
+        day = start - timedelta(days=d)
+        y, m, dd = _ymd(day)
+        odir = os.path.join(p["forcing"], "meteo", "meteo_nemo_ecmwf_BAL", y, m, dd, "00")
+        os.makedirs(odir, exist_ok=True)
+        grid_file(os.path.join(odir, f"FORCE_ecmwf_y{y}m{m}d{dd}.nc"), np.arange(24.0), day,
+                  lambda n: {"t2": _field(rng, (n, lat.size, lon.size), 276.0, 2.0)})
+
+    # Operational step list: hourly to 90 h, then 3-hourly
+    steps = [h for h in range(sizes["hours"] + 1) if h <= 90 or h % 3 == 0]
+    shape = lambda n: (n, lat.size, lon.size)
+
+    def fields(n):
+        acc = np.cumsum(np.ones(shape(n), np.float32), axis=0)
+        return {
+            "var167": _field(rng, shape(n), 276.0, 2.0), "var168": _field(rng, shape(n), 272.0, 2.0),
+            "var165": _field(rng, shape(n), 0.0, 5.0), "var166": _field(rng, shape(n), 0.0, 5.0),
+            "var151": _field(rng, shape(n), 101300.0, 500.0), "var134": _field(rng, shape(n), 101000.0, 500.0),
+            "var164": rng.random(shape(n)).astype(np.float32),
+            "var169": acc * 3.6e5, "var175": acc * 1.0e6, "var228": acc * 1e-4, "var144": acc * 1e-5,
+        }
+
+    os.makedirs(os.path.dirname(p["grib"]), exist_ok=True)
+    grid_file(p["forecast"], np.asarray(steps, dtype=np.float64), start, fields)
+    if shutil.which("cdo"):
+        from nemo_exec import run
+        run(["cdo", "-O", "-f", "grb", "copy", p["forecast"], p["grib"]])
+
+
+def make_restart(p, sizes, rng):
+    """Tiles of the previous cycle in {RUNDIR}nemo_deode21/NEMO5_EST_0.5nm_op_{prev}/restarts."""
+    from nemo_restart_tool import split_restart, write_restart_index
+    nx, ny = sizes["dst"]
+    tiles = sizes["tiles"]
+    jpni = int(np.sqrt(tiles))
+    while tiles % jpni:
+        jpni -= 1
+    jpnj = tiles // jpni
+    prev = datetime.strptime(DATE, "%Y%m%d") - timedelta(days=1)
+    rdir = os.path.join(p["rundir"], "nemo_deode21", f"NEMO5_EST_0.5nm_op_{prev:%Y%m%d}")
+    restart_dir = os.path.join(rdir, "restarts")
+    os.makedirs(restart_dir, exist_ok=True)
+    step = 24 * 3600 // 150
+    with open(os.path.join(rdir, "stock1_num.dat"), "w") as f:
+        f.write(f"{step}\n")
+
+    for kind, fields in (("restart_out", {"tn": sizes["levels"], "sn": sizes["levels"], "sshn": 0}),
+                         ("restart_ice_out", {"a_i": 5, "v_i": 5, "t_su": 0})):
+        global_path = os.path.join(p["rundir"], f"global_{kind}.nc")
+        with netCDF4.Dataset(global_path, "w", format="NETCDF4") as nc:
+            nc.createDimension("x", nx)
+            nc.createDimension("y", ny)
+            nc.createDimension("nav_lev", sizes["levels"])
+            nc.createDimension("jpl", 5)
+            nc.createDimension("time_counter", None)
+            nc.createVariable("kt", "f8", ("time_counter",))[0] = step
+            for name, nz in fields.items():
+                zdim = () if nz == 0 else ("nav_lev",) if nz == sizes["levels"] else ("jpl",)
+                dims = ("time_counter",) + zdim + ("y", "x")
+                shape = (1,) + ((nz,) if nz else ()) + (ny, nx)
+                nc.createVariable(name, "f8", dims)[:] = rng.standard_normal(shape)
+        split_restart(global_path, os.path.join(restart_dir, f"{RUNID}_{step:08d}_{kind}"), jpni, jpnj)
+        os.remove(global_path)
+    write_restart_index(restart_dir, RUNID, step)
+
+
+GENERATORS = [make_grid_files, make_cmems_box, make_bdy_files, make_meteo, make_restart]
+
+
+def generate_inputs(p, sizes):
+    rng = np.random.default_rng(42)
+    for make in GENERATORS:
+        t0 = time.perf_counter()
+        make(p, sizes, rng)
+        print(f"[OK] {make.__name__} ({time.perf_counter() - t0:.1f} s)")
+
+
+# ---------------------------------------------------------------- stages
+
+def _require(module=None, program=None):
+    if program and not shutil.which(program):
+        raise Skip(f"{program} not found")
+    if module and importlib.util.find_spec(module) is None:
+        raise Skip(f"python module {module} not installed")
+
+
+def _runner(sizes):
+    from nemo_model_runner import NemoModelRunner
+    y, m, d = DATE[:4], DATE[4:6], DATE[6:8]
+    runner = NemoModelRunner(y, m, d, _days(sizes))
+    runner.prepare_workdir()
+    return runner
+
+
+def stage_bdy_extract(p, sizes):
+    from bdy_extract import extract_boundary
+    odir = os.path.join(p["forcing"], "bench_bdy_extract")
+    shutil.rmtree(odir, ignore_errors=True)
+    extract_boundary(p["cmems"], odir, DATE, _days(sizes), _model_depth(sizes["levels"]))
+    return os.path.getsize(p["cmems"]) / 2**20, "MB"
+
+
+def stage_teos10(p, sizes):
+    _require(module="gsw")
+    from nemo_exec import run_many
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "do_bdy3d_teos_conv.py")
+    odir = _bdy_dir(p["forcing"])
+    files = sorted(f for f in os.listdir(odir) if f.startswith("bdy_hourly_3d_y"))
+    run_many([[sys.executable, script, os.path.join(odir, f), os.path.join(odir, f.replace("3d_", "3d_TEOS10_"))]
+              for f in files])
+    return sum(os.path.getsize(os.path.join(odir, f)) for f in files) / 2**20, "MB"
+
+
+def stage_meteo_deaccum(p, sizes):
+    from meteo_deaccum import deaccumulate
+    odir = os.path.join(p["forcing"], "bench_meteo_deaccum")
+    shutil.rmtree(odir, ignore_errors=True)
+    deaccumulate([p["forecast"]], DATE, _days(sizes), odir)
+    return os.path.getsize(p["forecast"]) / 2**20, "MB"
+
+
+def stage_ecmwf_postprocess(p, sizes):
+    _require(program="cdo")
+    from do_meteo_ecmwf import postprocess_ecmwf_det
+    postprocess_ecmwf_det(p["grib"], DATE, _days(sizes))
+    return os.path.getsize(p["grib"]) / 2**20, "MB"
+
+
+def stage_runoff(p, sizes):
+    _require(program="cdo")
+    from do_runoff import generate_runoff
+    generate_runoff(DATE)
+    return 4, "days"
+
+
+def stage_fill_nan_with_nearest(p, sizes):
+    from assimilation_increment import fill_nan_with_nearest
+    nx, ny = sizes["dst"]
+    rng = np.random.default_rng(1)
+    field = rng.standard_normal((ny, nx))
+    field[rng.random((ny, nx)) < 0.35] = np.nan
+    repeat = 10
+    for _ in range(repeat):
+        fill_nan_with_nearest(field.copy())
+    return repeat * nx * ny / 1e6, "Mpoints"
+
+
+def stage_cpandadjust_boundary(p, sizes):
+    runner = _runner(sizes)
+    runner.cpandadjust_boundary()
+    return 2 * _days(sizes), "files"
+
+
+def stage_link_restart(p, sizes):
+    runner = _runner(sizes)
+    runner.configure_run()
+    runner.link_restart()
+    return 2 * sizes["tiles"], "tiles"
+
+
+# ---------------------------------------------------------------- measurement
+
+def in_child(func, log_path, *args):
+    """
+    Run func(*args) in a forked child with stdout/stderr sent to log_path.
+    Returns (result dict written by the child, rusage of the child and its subprocesses).
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(r)
+        log = os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.dup2(log, 1)
+        os.dup2(log, 2)
+        t0 = time.perf_counter()
+        try:
+            amount, units = func(*args) or (None, None)
+            result = dict(status="ok", amount=amount, units=units)
+        except Skip as e:
+            result = dict(status="skipped", reason=str(e))
+        except BaseException as e:
+            import traceback
+            traceback.print_exc()
+            result = dict(status="failed", reason=f"{type(e).__name__}: {e}")
+        result["wall_s"] = round(time.perf_counter() - t0, 3)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.write(w, json.dumps(result).encode())
+        os._exit(0)
+
+    os.close(w)
+    chunks = []
+    while True:
+        chunk = os.read(r, 65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    os.close(r)
+    _, status, ru = os.wait4(pid, 0)
+    try:
+        result = json.loads(b"".join(chunks))
+    except ValueError:
+        result = dict(status="failed", reason=f"child exited with status {os.waitstatus_to_exitcode(status)}")
+    return result, ru
+
+
+def run_stage(name, p, sizes, repeat):
+    """Best of `repeat` runs of one stage."""
+    best = None
+    for _ in range(repeat):
+        result, ru = in_child(globals()[f"stage_{name}"], os.path.join(p["logs"], f"{name}.log"), p, sizes)
+        result.update(
+            cpu_s=round(ru.ru_utime + ru.ru_stime, 3),
+            maxrss_mb=round(ru.ru_maxrss / 1024, 1),
+            read_mb=round(ru.ru_inblock * 512 / 2**20, 1),
+            write_mb=round(ru.ru_oublock * 512 / 2**20, 1),
+        )
+        if result["status"] != "ok":
+            return result
+        if best is None or result["wall_s"] < best["wall_s"]:
+            best = result
+    if best.get("amount") is not None:
+        best["throughput"] = round(best["amount"] / max(best["wall_s"], 1e-6), 3)
+    return best
+
+
+def compare(results, baseline, tolerance):
+    """Stages slower or larger than the baseline by more than `tolerance` (fraction)."""
+    regressions = []
+    for name, cur in results["stages"].items():
+        ref = baseline.get("stages", {}).get(name)
+        if not ref or cur["status"] != "ok" or ref.get("status") != "ok":
+            continue
+        for key in ("wall_s", "maxrss_mb"):
+            if ref[key] > 0 and cur[key] > ref[key] * (1 + tolerance):
+                regressions.append(f"{name}: {key} {ref[key]} -> {cur[key]} (+{100 * (cur[key] / ref[key] - 1):.0f}%)")
+        cur["baseline"] = {key: ref[key] for key in ("wall_s", "maxrss_mb")}
+    return regressions
+
+
+def print_table(results):
+    print("\n===== Benchmark =====")
+    print(f"{'stage':<24} {'status':<8} {'wall s':>9} {'cpu s':>9} {'maxrss MB':>10} {'throughput':>18} {'vs base':>8}")
+    for name, r in results["stages"].items():
+        if r["status"] != "ok":
+            print(f"{name:<24} {r['status']:<8} {r.get('reason', '')}")
+            continue
+        rate = f"{r['throughput']:.2f} {r['units']}/s" if "throughput" in r else ""
+        ratio = f"{r['wall_s'] / r['baseline']['wall_s']:.2f}x" if r.get("baseline", {}).get("wall_s") else ""
+        print(f"{name:<24} {'ok':<8} {r['wall_s']:>9.2f} {r['cpu_s']:>9.2f} {r['maxrss_mb']:>10.0f} {rate:>18} {ratio:>8}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Offline benchmark of the NEMO pre-processing stages")
+    ap.add_argument("--workdir", default=os.path.join(os.environ.get("SCRATCH", "/tmp"), "nemo_benchmark"),
+                    help="Synthetic inputs and stage outputs")
+    ap.add_argument("--preset", default="est05", choices=sorted(PRESETS))
+    ap.add_argument("--stages", default=",".join(STAGES), help="Comma separated subset of: " + ", ".join(STAGES))
+    ap.add_argument("--repeat", type=int, default=1, help="Runs per stage; the fastest is reported")
+    ap.add_argument("--output", help="Write the results as JSON")
+    ap.add_argument("--baseline", help="Results JSON of a previous run to compare against")
+    ap.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown / memory growth (fraction)")
+    ap.add_argument("--regenerate", action="store_true", help="Regenerate the synthetic inputs")
+    args = ap.parse_args()
+
+    stages = [s for s in args.stages.split(",") if s]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        ap.error(f"unknown stages: {', '.join(sorted(unknown))}")
+
+    sizes = PRESETS[args.preset]
+    workdir = os.path.abspath(args.workdir)
+    p = _paths(workdir)
+    os.makedirs(p["logs"], exist_ok=True)
+
+    # Environment of the workflow modules, all inside workdir
+    os.environ.update(
+        FORCINGDIR=p["forcing"], CONFDIR=p["setup"], RUNDIR=p["rundir"], HPCPERM=workdir,
+        BDY_COORDINATES=p["coords"], NEMO_WEIGHTS_DIR=p["weights"],
+        NEMO_NPROC=str(sizes["tiles"]), NEMO_BUILD_CACHE="0",
+    )
+
+    stamp = os.path.join(workdir, "inputs.json")
+    current = json.loads(json.dumps(dict(preset=args.preset, sizes=sizes, cdo=bool(shutil.which("cdo")),
+                                         version=INPUTS_VERSION)))
+    if args.regenerate or not os.path.exists(stamp) or json.load(open(stamp)) != current:
+        print(f"===== Generating synthetic inputs ({args.preset}) in {workdir} =====")
+        for sub in ("forcing", "run", "setup", "weights"):
+            shutil.rmtree(os.path.join(workdir, sub), ignore_errors=True)
+        result, _ = in_child(generate_inputs, os.path.join(p["logs"], "generate.log"), p, sizes)
+        if result["status"] != "ok":
+            print(f"ERROR: Input generation failed: {result.get('reason')} (see {p['logs']}/generate.log)")
+            sys.exit(1)
+        with open(stamp, "w") as f:
+            json.dump(current, f)
+        print(f"[OK] Inputs ready in {result['wall_s']:.1f} s")
+
+    results = dict(created=datetime.now().isoformat(timespec="seconds"), host=platform.node(),
+                   python=platform.python_version(), cpus=os.cpu_count(), preset=args.preset,
+                   sizes=sizes, stages={})
+    for name in stages:
+        print(f"Running stage {name} ...")
+        results["stages"][name] = run_stage(name, p, sizes, args.repeat)
+        if results["stages"][name]["status"] == "failed":
+            print(f"ERROR: Stage {name} failed, see {p['logs']}/{name}.log")
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+    print_table(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+        print(f"\n[OK] Results written to {args.output}")
+
+    if regressions:
+        print(f"\nWARNING: {len(regressions)} regression(s) above {100 * args.tolerance:.0f}% of the baseline:")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Configuration of one workflow instance: root directories and the paths of a cycle.
+
+NemoConfig is loaded once and passed to every stage. Values come from,
+in increasing priority:
+
+  1. the operational defaults below,
+  2. the environment (FORCINGDIR, CONFDIR, RUNDIR, HPCPERM, SCRATCH, NEMO_RUNID,
+     NEMO_WEIGHTS_DIR, NEMO_NPROC),
+  3. a JSON file (--config / NEMO_CONFIG) with any of the NemoConfig fields.
+
+Every file path of a cycle comes from one of the PATHS templates, compiled
+once at import; a config with different roots therefore never touches the
+files of another one, and several instances can run side by side on a node.
+export() puts the roots back into os.environ for the scripts and jobs
+started from the workflow (run_nemo, cdo wrappers, worker processes).
+
+Dry run, printing every input and output path of a cycle:
+  python nemo_config.py --date 20250105 --ndays 2 [--config my_config.json]
+"""
+import os
+import sys
+import json
+import string
+import argparse
+from dataclasses import dataclass, fields, asdict
+from datetime import datetime, timedelta
+
+DEFAULTS = {
+    "forcingdir": "/ec/res4/hpcperm/eeim/deode_sswf/forcing",
+    "confdir": "/ec/res4/hpcperm/eeim/deode_sswf/setup_N5",
+    "rundir": "/ec/res4/scratch/eeim/",
+    "hpcperm": "/ec/res4/hpcperm/eeim",
+    "scratch": "/ec/res4/scratch/eeim/",
+}
+
+ENV_VARS = {
+    "forcingdir": "FORCINGDIR",
+    "confdir": "CONFDIR",
+    "rundir": "RUNDIR",
+    "hpcperm": "HPCPERM",
+    "scratch": "SCRATCH",
+    "runid_s": "NEMO_RUNID",
+    "weightsdir": "NEMO_WEIGHTS_DIR",
+    "nproc": "NEMO_NPROC",
+}
+
+
+class PathTemplate:
+    """A str.format template parsed once; the field names are checked at load."""
+    __slots__ = ("name", "template", "kind", "fields")
+
+    def __init__(self, name, template, kind):
+        self.name = name
+        self.template = template
+        self.kind = kind  # "input", "output" or "dir"
+        self.fields = frozenset(f for _, f, _, _ in string.Formatter().parse(template) if f)
+
+    def __call__(self, values):
+        return self.template.format_map(values)
+
+
+# {maindir} = {rundir}nemo_{runid_s}/ ; {date} the cycle date, {prev} the day before
+_TEMPLATES = [
+    # setup and static forcing
+    ("bathy", "{forcingdir}/bathy_meter.nc", "input"),
+    ("domain_cfg", "{confdir}/domain_cfg_EST_0.5nm_V110_fix.nc", "input"),
+    ("coordinates_bdy", "{confdir}/coordinates.bdy.nc", "input"),
+    ("weights_dir", "{weightsdir}", "dir"),
+    ("initial_file", "{forcingdir}/initial/initial_run_t{date}.nc", "output"),
+    # model runs and restarts
+    ("workdir", "{maindir}NEMO5_EST_0.5nm_op_{date}/", "dir"),
+    ("restart_dir", "{maindir}NEMO5_EST_0.5nm_op_{date}/restarts", "output"),
+    ("prev_rundir", "{maindir}NEMO5_EST_0.5nm_op_{prev}/", "dir"),
+    ("prev_restart_dir", "{maindir}NEMO5_EST_0.5nm_op_{prev}/restarts", "input"),
+    ("prev_ssh_output", "{scratch}NEMO5_EST_0.5nm_op_{prev}/EST05nm_op_rerun21_2ts_SSH_grid_T_{prev}-{prev}.nc", "input"),
+    ("prev_3d_output", "{scratch}NEMO5_EST_0.5nm_op_{prev}/EST05nm_op_rerun21_1h_stuvw_{prev}-{prev}.nc", "input"),
+    # meteo
+    ("grib_dir", "{forcingdir}/ECMWF_fc/temp/FC_d{date}ltd{ndays}", "output"),
+    ("meteo_root", "{forcingdir}/meteo/meteo_nemo_ecmwf_BAL", "dir"),
+    ("meteo_dir", "{forcingdir}/meteo/meteo_nemo_ecmwf_BAL/{Y}/{m}/{d}/00", "output"),
+    ("meteo_file", "{forcingdir}/meteo/meteo_nemo_ecmwf_BAL/{Y}/{m}/{d}/00/FORCE_ecmwf_y{Y}m{m}d{d}.nc", "output"),
+    ("prev_meteo_file", "{forcingdir}/meteo/meteo_nemo_ecmwf_BAL/{pY}/{pm}/{pd}/00/FORCE_ecmwf_y{Y}m{m}d{d}.nc", "input"),
+    ("prev_flux_state", "{forcingdir}/meteo/meteo_nemo_ecmwf_BAL/{pY}/{pm}/{pd}/00/FLUX_state_ecmwf_y{Y}m{m}d{d}.npz", "input"),
+    # boundary
+    ("boundary_raw", "{forcingdir}/boundary/cmems_nrt/raw/bc_est_{date}.nc", "output"),
+    ("boundary_dir", "{forcingdir}/boundary/cmems_nrt_bc_V110/{Y}/{m}/{d}/00", "output"),
+    # runoff
+    ("runoff_dir", "{forcingdir}/runoff", "dir"),
+    ("runoff_t_file", "{forcingdir}/runoff/runoff_t_atmt2/river_data_t_y{Y}m{m}d{d}.nc", "output"),
+    # assimilation
+    ("assim_dir", "{forcingdir}/assim", "dir"),
+    ("sla_state", "{forcingdir}/assim/sla_state_cmems_{date}.nc", "output"),
+    ("ssh_rec", "{forcingdir}/assim/ssh_rec/ssh_rec.d{date}.t0000.nc", "input"),
+    ("eof_modes", "{forcingdir}/assim/eof/eof_modes.nc", "input"),
+    ("eof_amplitudes", "{forcingdir}/assim/eof/eof_amplitudes.d{date}.nc", "input"),
+    ("assim_increment", "{forcingdir}/assim/assim_background_increments.d{date}.nc", "output"),
+    ("assim_di_state", "{forcingdir}/assim/assim_background_state_DI.d{date}.nc", "output"),
+    # workflow bookkeeping
+    ("state_dir", "{forcingdir}/state", "dir"),
+]
+PATHS = {name: PathTemplate(name, template, kind) for name, template, kind in _TEMPLATES}
+
+_DATE_FIELDS = {"date", "prev", "Y", "m", "d", "pY", "pm", "pd", "ndays"}
+
+
+def _date_values(date_str, ndays):
+    dt = datetime.strptime(date_str, "%Y%m%d")
+    prev = dt - timedelta(days=1)
+    return dict(date=date_str, prev=prev.strftime("%Y%m%d"),
+                Y=f"{dt:%Y}", m=f"{dt:%m}", d=f"{dt:%d}",
+                pY=f"{prev:%Y}", pm=f"{prev:%m}", pd=f"{prev:%d}", ndays=ndays)
+
+
+@dataclass(frozen=True)
+class NemoConfig:
+    forcingdir: str
+    confdir: str
+    rundir: str
+    hpcperm: str
+    scratch: str
+    runid_s: str = "deode21"
+    weightsdir: str = ""
+    nproc: int = 256  # ocean subdomains of the run (jpni x jpnj of run_nemo)
+
+    def __post_init__(self):
+        # rundir/scratch are used as prefixes ("{rundir}nemo_..."), the others as directories
+        for name in ("rundir", "scratch"):
+            value = getattr(self, name)
+            if not value.endswith("/"):
+                object.__setattr__(self, name, value + "/")
+        for name in ("forcingdir", "confdir", "hpcperm"):
+            object.__setattr__(self, name, getattr(self, name).rstrip("/") or "/")
+        object.__setattr__(self, "nproc", int(self.nproc))
+        if not self.weightsdir:
+            object.__setattr__(self, "weightsdir", os.path.join(self.forcingdir, "weights"))
+
+        known = set(self._values()) | _DATE_FIELDS
+        for tpl in PATHS.values():
+            unknown = tpl.fields - known
+            if unknown:
+                raise ValueError(f"Path template {tpl.name!r} uses unknown field(s): {', '.join(sorted(unknown))}")
+
+    @property
+    def runid(self):
+        return f"EST05nm_op_{self.runid_s}"
+
+    @property
+    def maindir(self):
+        return f"{self.rundir}nemo_{self.runid_s}/"
+
+    def _values(self):
+        values = asdict(self)
+        values.update(runid=self.runid, maindir=self.maindir)
+        return values
+
+    def path(self, name, date_str=None, ndays=None):
+        """Resolve the PATHS template `name`, for the cycle date_str when it needs one."""
+        tpl = PATHS[name]
+        values = self._values()
+        if tpl.fields & _DATE_FIELDS:
+            if date_str is None:
+                raise ValueError(f"Path {name!r} needs a cycle date")
+            values.update(_date_values(date_str, ndays))
+        return tpl(values)
+
+    def cycle_paths(self, date_str, ndays=1):
+        """Every PATHS entry resolved for one cycle: {name: (kind, path)}."""
+        values = self._values()
+        values.update(_date_values(date_str, ndays))
+        return {name: (tpl.kind, tpl(values)) for name, tpl in PATHS.items()}
+
+    def export(self):
+        """Set FORCINGDIR/CONFDIR/... for subprocesses, jobs and worker processes."""
+        for name, var in ENV_VARS.items():
+            os.environ[var] = str(getattr(self, name))
+
+
+def load_config(path=None):
+    """NemoConfig from defaults, the environment and the JSON file `path` (or NEMO_CONFIG)."""
+    values = dict(DEFAULTS)
+    for name, var in ENV_VARS.items():
+        if os.environ.get(var):
+            values[name] = os.environ[var]
+    path = path or os.environ.get("NEMO_CONFIG")
+    if path:
+        with open(path) as f:
+            from_file = json.load(f)
+        names = {f.name for f in fields(NemoConfig)}
+        unknown = set(from_file) - names
+        if unknown:
+            raise ValueError(f"Unknown configuration key(s) in {path}: {', '.join(sorted(unknown))}")
+        values.update(from_file)
+    return NemoConfig(**values)
+
+
+_current = None
+
+
+def get_config():
+    """The configuration of this process (loaded on first use)."""
+    global _current
+    if _current is None:
+        _current = load_config()
+    return _current
+
+
+def set_config(config):
+    global _current
+    _current = config
+    return config
+
+
+def dry_run(config, date_str, ndays):
+    """Print the configuration and every path of one cycle, marking those that exist."""
+    print("===== Configuration =====")
+    for name, value in asdict(config).items():
+        print(f"  {name:<12} {value}")
+    print(f"  {'maindir':<12} {config.maindir}")
+    print(f"  {'runid':<12} {config.runid}")
+    resolved = config.cycle_paths(date_str, ndays)
+    for kind in ("input", "output", "dir"):
+        print(f"\n===== {kind} paths for {date_str} ({ndays} days) =====")
+        for name, (k, path) in resolved.items():
+            if k == kind:
+                mark = "[x]" if os.path.exists(path) else "[ ]"
+                print(f"  {mark} {name:<18} {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resolve the NEMO workflow configuration (dry run)")
+    parser.add_argument("--date", required=True, help="Cycle date YYYYMMDD (the workflow's date - 1 day)")
+    parser.add_argument("--ndays", type=int, default=1, help="Forecast length in days")
+    parser.add_argument("--config", default=None, help="JSON configuration file (default: NEMO_CONFIG)")
+    args = parser.parse_args()
+    try:
+        config = load_config(args.config)
+        datetime.strptime(args.date, "%Y%m%d")
+    except (ValueError, OSError) as e:
+        print(f"ERROR: {e}")
+        sys.exit(1)
+    dry_run(config, args.date, args.ndays)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+import os
+import re
+import sys
+import glob
+import json
+import shutil
+
+from nemo_model_runner import NemoModelRunner
+from nemo_exec import CommandError
+from backends import submit_job
+from nemo_restart_tool import preflight_restart, write_restart_index
+
+# Entries of the staged base workdir that every member reads but never writes.
+# They are shared through symlinks, so preparing a member costs a handful of
+# inode operations instead of another copy of the setup and forcing.
+SHARED_ENTRIES = [
+    "*.xml",
+    "namelist_*",
+    "do_*",
+    "run_nemo",
+    "coordinates.bdy.nc",
+    "bfr_roughness.nc",
+    "domain_cfg_*.nc",
+    "nemo.exe",
+    "xios_server.exe",
+    "initial_run.nc",
+    "assim_background_*.nc",
+    "stock1_num.dat",
+    "stock2_num.dat",
+    "bc_V110",
+    "forcing_ecmwf",
+    "runoff_seas",
+]
+
+# Namelists that may receive per-member overrides (copied, never linked).
+NAMELIST_FILES = ["namelist_ref", "namelist_cfg", "namelist_ice_ref", "namelist_ice_cfg"]
+
+
+def member_name(index):
+    return f"mbr{index:03d}"
+
+
+def format_namelist_value(value):
+    if isinstance(value, bool):
+        return ".true." if value else ".false."
+    if isinstance(value, str) and not value.startswith((".", "'", '"')) and not re.match(r"^[-+0-9.eEdD]+$", value):
+        return f"'{value}'"
+    return str(value)
+
+
+def apply_namelist_overrides(content, overrides):
+    """
+    Replace `key = value` assignments in a Fortran namelist text.
+    Returns the new text and the set of keys that were found.
+    """
+    found = set()
+    for key, value in overrides.items():
+        pattern = re.compile(rf"^(\s*{re.escape(key)}\s*=\s*)([^!\n]*?)(\s*(?:!.*)?)$", re.MULTILINE | re.IGNORECASE)
+        content, n = pattern.subn(lambda m: f"{m.group(1)}{format_namelist_value(value)}{m.group(3)}", content)
+        if n:
+            found.add(key)
+    return content, found
+
+
+def load_member_overrides(path):
+    """
+    Load per-member namelist overrides from JSON, e.g.
+    {"mbr001": {"rn_rdt": 120}, "mbr002": {"ln_asmiau": false}}
+    """
+    if not path:
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+class NemoEnsembleRunner:
+    """
+    Multi-member NEMO run sharing one staged workdir.
+
+    The deterministic runner stages namelists, restarts and forcing once; each
+    member directory then links to those read-only inputs, owns copies of the
+    namelists (with its overrides applied) and its own restarts/ output folder.
+    All members are submitted together as one Slurm job array.
+    """
+
+    def __init__(self, yystart, mmstart, ddstart, ndays, members, overrides=None, config=None):
+        self.base = NemoModelRunner(yystart, mmstart, ddstart, ndays, config=config)
+        self.members = [member_name(i) for i in range(members)]
+        self.overrides = overrides or {}
+        self.ensdir = os.path.join(self.base.workdir, "members")
+
+    def restart_outputs(self):
+        """Restart tiles of every member (the base restart directory stays empty)."""
+        return [os.path.join(self.ensdir, member, "restarts", "*_restart_out_*.nc") for member in self.members]
+
+    def prepare_member(self, member):
+        base = self.base
+        mdir = os.path.join(self.ensdir, member)
+        os.makedirs(mdir, exist_ok=True)
+
+        # Shared read-only inputs
+        for pattern in SHARED_ENTRIES:
+            for src in glob.glob(os.path.join(base.workdir, pattern)):
+                dst = os.path.join(mdir, os.path.basename(src))
+                if os.path.lexists(dst):
+                    os.remove(dst)
+                os.symlink(src, dst)
+
+        # Per-member namelists (copy + overrides)
+        overrides = self.overrides.get(member, {})
+        applied = set()
+        for fname in NAMELIST_FILES:
+            src = os.path.join(base.workdir, fname)
+            if not os.path.exists(src):
+                continue
+            dst = os.path.join(mdir, fname)
+            if os.path.lexists(dst):
+                os.remove(dst)
+            with open(src) as fin:
+                content = fin.read()
+            content, found = apply_namelist_overrides(content, overrides)
+            applied |= found
+            with open(dst, "w") as fout:
+                fout.write(content)
+        missing = set(overrides) - applied
+        if missing:
+            print(f"WARNING: [{member}] namelist keys not found: {', '.join(sorted(missing))}")
+
+        # Writable per-member folders
+        os.makedirs(os.path.join(mdir, "restarts"), exist_ok=True)
+        self.link_member_restart(member, mdir)
+        return mdir
+
+    def link_member_restart(self, member, mdir):
+        """
+        Members continue from their own restart of the previous cycle when it
+        exists, otherwise they start from the shared (deterministic) initial state.
+        """
+        base = self.base
+        dst_dir = os.path.join(mdir, "initialstate")
+        if os.path.lexists(dst_dir):
+            if os.path.islink(dst_dir):
+                os.remove(dst_dir)
+            else:
+                shutil.rmtree(dst_dir)
+
+        prev_workdir = base.config.path("prev_rundir", base.date_str)
+        prev_restarts = os.path.join(prev_workdir, "members", member, "restarts")
+        tiles = sorted(glob.glob(os.path.join(prev_restarts, f"{base.runid}_*_restart_out_*.nc")))
+
+        if base.ln_tsd_init.lower() == ".true." or not tiles:
+            os.symlink(os.path.join(base.workdir, "initialstate"), dst_dir)
+            return
+
+        # Same preflight as the deterministic restart: never submit on missing or stale tiles
+        num = base.restart_step(prev_workdir)
+        problems, _ = preflight_restart(prev_restarts, base.runid, num)
+        if problems:
+            for problem in problems:
+                print(f"ERROR: [{member}] Restart preflight: {problem}")
+            print(f"ERROR: [{member}] Incomplete restart in {prev_restarts}, not submitting")
+            sys.exit(1)
+
+        os.makedirs(dst_dir)
+        for src in glob.glob(os.path.join(prev_restarts, f"{base.runid}_{num:08d}_restart*_out_*.nc")):
+            name = os.path.basename(src)
+            tile = name.rsplit("_", 1)[-1]
+            kind = "restart_ice_in" if "_restart_ice_out_" in name else "restart_in"
+            os.symlink(src, os.path.join(dst_dir, f"{kind}_{tile}"))
+        print(f"[{member}] Using member restart from {prev_restarts}")
+
+    def write_array_script(self):
+        """
+        Job-array wrapper: keeps the #SBATCH header of run_nemo and runs it
+        inside the member directory selected by SLURM_ARRAY_TASK_ID.
+        """
+        base = self.base
+        with open(os.path.join(base.workdir, "run_nemo")) as f:
+            header = [line for line in f if line.startswith("#SBATCH")]
+
+        script = os.path.join(base.workdir, "run_nemo_array")
+        with open(script, "w") as f:
+            f.write("#!/bin/bash\n")
+            f.writelines(header)
+            f.write('member=$(printf "mbr%03d" "${SLURM_ARRAY_TASK_ID}")\n')
+            f.write(f'export model_run_dir="{self.ensdir}/${{member}}/"\n')
+            f.write('cd "${model_run_dir}"\n')
+            f.write("exec bash ./run_nemo\n")
+        os.chmod(script, 0o755)
+        return script
+
+    def launch_members(self):
+        print(f"\n===== Launching NEMO Ensemble ({len(self.members)} members) =====")
+        script = self.write_array_script()
+        log_out = os.path.join(self.ensdir, "mbr%3a", "nemo_run_stdout.log")
+        log_err = os.path.join(self.ensdir, "mbr%3a", "nemo_run_stderr.log")
+        # The wrapper selects the member directory itself; the export gives the
+        # same directory per task to the local fake scheduler.
+        run_dir = os.path.join(self.ensdir, "mbr%3a", "")
+        try:
+            submit_job(script, self.base.workdir, export={"model_run_dir": run_dir},
+                       output=log_out, error=log_err, array=len(self.members))
+        except CommandError as e:
+            print(f"ERROR: sbatch job array failed! {e}")
+            sys.exit(1)
+        print("NEMO ensemble finished successfully.")
+
+        # Restart index of every member for the preflight of the next cycle
+        for member in self.members:
+            try:
+                write_restart_index(os.path.join(self.ensdir, member, "restarts"), self.base.runid, self.base.stock1)
+            except (OSError, KeyError, ValueError) as e:
+                print(f"WARNING: [{member}] Could not write restart index: {e}")
+
+    def full_run(self):
+        self.base.stage_run()
+        print(f"\n===== Preparing {len(self.members)} ensemble members in {self.ensdir} =====")
+        for member in self.members:
+            self.prepare_member(member)
+        self.launch_members()
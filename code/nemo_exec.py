@@ -0,0 +1,116 @@
+"""
+Command execution for the workflow scripts.
+
+- run(argv)          : one command as an argv list, without a shell. Output
+                       is captured and printed as one block when the command
+                       ends, so parallel commands do not interleave. Supports
+                       a timeout and retries, and raises CommandError with the
+                       tail of the output on failure.
+- run_many(commands) : independent commands (per-day cdo calls, uploads, ...)
+                       on a bounded thread pool (NEMO_EXEC_WORKERS, default 4).
+
+Every attempt goes through instrumentation.run_subprocess, so it appears in
+the timing summary and the cycle timeline.
+"""
+import os
+import time
+import shlex
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import run_subprocess
+
+WORKERS = int(os.environ.get("NEMO_EXEC_WORKERS", 4))
+TAIL_LINES = 20
+
+
+class CommandError(RuntimeError):
+    """A command exited non-zero, timed out or could not be started."""
+
+    def __init__(self, argv, returncode, output="", timeout=None):
+        self.argv = list(argv)
+        self.returncode = returncode
+        self.output = output or ""
+        self.timeout = timeout
+        if timeout is not None:
+            reason = f"timed out after {timeout} s"
+        else:
+            reason = f"exit status {returncode}"
+        message = f"Command failed ({reason}): {format_command(argv)}"
+        tail = self.output.strip().splitlines()[-TAIL_LINES:]
+        if tail:
+            message += "\n" + "\n".join(f"    {line}" for line in tail)
+        super().__init__(message)
+
+
+def format_command(argv):
+    return shlex.join(str(a) for a in argv)
+
+
+def _attempt(argv, cwd, env, timeout, capture):
+    pipe = dict(stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors="replace") if capture else {}
+    try:
+        result = run_subprocess(argv, shell=False, cwd=cwd, env=env, timeout=timeout, **pipe)
+    except subprocess.TimeoutExpired as e:
+        return CommandError(argv, None, e.output, timeout=timeout), e.output
+    except OSError as e:
+        # Program not found / not executable: same convention as the shell
+        return CommandError(argv, 127, str(e)), str(e)
+    if result.returncode != 0:
+        return CommandError(argv, result.returncode, result.stdout), result.stdout
+    return result, result.stdout
+
+
+def run(argv, cwd=None, env=None, timeout=None, retries=0, retry_delay=10, capture=True, check=True):
+    """
+    Run argv and return the CompletedProcess (stdout holds the captured output).
+
+    Failed attempts are repeated `retries` times, `retry_delay` seconds apart.
+    With check=False the last failure is returned as a CompletedProcess with
+    its non-zero returncode instead of being raised.
+    """
+    if isinstance(argv, str):
+        raise TypeError(f"argv list expected, got a string: {argv!r}")
+    argv = [str(a) for a in argv]
+    label = format_command(argv)
+
+    for attempt in range(retries + 1):
+        print(f"Running: {label}")
+        result, output = _attempt(argv, cwd, env, timeout, capture)
+        if output and output.strip():
+            print(output.rstrip())
+        if not isinstance(result, CommandError):
+            return result
+        if attempt < retries:
+            print(f"WARNING: Attempt {attempt + 1}/{retries + 1} failed ({label}), retrying in {retry_delay} s")
+            time.sleep(retry_delay)
+
+    if check:
+        raise result
+    return subprocess.CompletedProcess(argv, result.returncode if result.returncode is not None else -9,
+                                       stdout=result.output)
+
+
+def run_many(commands, workers=None, **kwargs):
+    """
+    Run independent argv lists concurrently (at most `workers` at a time) and
+    return their results in order. All commands run to the end; with check=True
+    (the default) the first failure is raised afterwards.
+    """
+    commands = list(commands)
+    if not commands:
+        return []
+    workers = max(1, min(len(commands), workers or WORKERS))
+    check = kwargs.pop("check", True)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run, argv, check=False, **kwargs) for argv in commands]
+        results = [f.result() for f in futures]
+
+    failed = [r for r in results if r.returncode != 0]
+    if failed and check:
+        for r in failed:
+            print(f"ERROR: Command failed (exit status {r.returncode}): {format_command(r.args)}")
+        first = failed[0]
+        raise CommandError(first.args, first.returncode, first.stdout)
+    return results
@@ -1,71 +1,75 @@
 import os
-import subprocess
 import sys
 import shutil
 import glob
 from datetime import datetime, timedelta
+from workdir_staging import stage_workdir, reflink_or_copy, force_symlink, remove_matching
+from instrumentation import timed
+from nemo_exec import CommandError
+from backends import submit_job, upload_files
+from nemo_restart_tool import restart_tiles, rebuild_restart, preflight_restart, write_restart_index
+from assim_increment_writer import increment_flags
+from nemo_config import get_config
 
 
 class NemoModelRunner:
-    def __init__(self, yystart, mmstart, ddstart, ndays):
+    # (pattern in setupdir, name in workdir, staging mode) -- see workdir_staging.stage_file.
+    # Namelists and XIOS files are tuned in place in CONFDIR, so each workdir keeps
+    # its own (reflinked) copy; a hard link would carry later edits into past runs.
+    # The hard-linked scripts must be replaced in CONFDIR, never edited in place.
+    SETUP_MANIFEST = [
+        ("namelist_*", None, "copy"),
+        ("*.xml", None, "copy"),
+        ("do_*", None, "link"),
+        ("run_nemo", None, "link"),
+        ("coordinates.bdy.nc", None, "symlink"),
+        ("bfr_roughness.nc", None, "symlink"),
+        ("domain_cfg_EST_0.5nm_V110_fix.nc", "domain_cfg_EST_0.5nm_V110.nc", "symlink"),
+#        ("nemo.exe", "nemo.exe", "symlink"),
+        ("nemo_asminc.exe", "nemo.exe", "symlink"),
+        ("xios_server.exe", None, "symlink"),
+    ]
+    # Staged as private copies because generate_namelists rewrites them in the workdir
+    SETUP_TEMPLATES = {"namelist_ref", "namelist_ice_ref"}
+
+    def __init__(self, yystart, mmstart, ddstart, ndays, config=None):
         self.yystart = yystart
         self.mmstart = mmstart
         self.ddstart = ddstart
         self.ndays   = ndays 
+        self.config = config = config or get_config()
+        self.date_str = f"{yystart}{mmstart}{ddstart}"
 
         # Run identifier
-        self.runid_s = "deode21"
+        self.runid_s = config.runid_s
+        self.runid = config.runid
 
-        # Main working directory
-        RUNDIR = os.environ.get("RUNDIR", "/ec/res4/scratch/eeim/")
-        self.maindir = f"{RUNDIR}nemo_{self.runid_s}/"
-        work_dir = os.environ.get("HPCPERM", os.getcwd()) + "/nemo_ecmwf"
-        FORCINGDIR = os.environ.get("FORCINGDIR", f"{work_dir}/forcing")
-        self.forcingdir = f"{FORCINGDIR}/"
+        # Main working directory: {rundir}nemo_{runid_s}/
+        self.maindir = config.maindir
+        self.workdir = config.path("workdir", self.date_str)
+        self.restart_dir = config.path("restart_dir", self.date_str)
 
-        self.workdir = f"{self.maindir}NEMO5_EST_0.5nm_op_{yystart}{mmstart}{ddstart}/"
-        self.runid = f"EST05nm_op_{self.runid_s}"
-
-        # Get CONFDIR and FORCINGDIR from environment, with fallback
-        self.setupdir = os.environ.get("CONFDIR", "/ec/res4/hpcperm/eeim/nemo_ecmwf/setup_N5")
+        self.setupdir = config.confdir
         self.scrdir   = os.path.join(self.setupdir, "../main_scripts")
 
-        forcing_root = os.environ.get("FORCINGDIR", "/ec/res4/hpcperm/eeim/nemo_ecmwf/forcing")
-        self.meteodir  = os.path.join(forcing_root, "meteo")
-        self.runoffdir = os.path.join(forcing_root, "runoff")
-        self.bdydir    = os.path.join(forcing_root, "boundary")
-
-        # Create and prepare workdir
-        self.prepare_workdir()
+        self.runoffdir = config.path("runoff_dir")
 
-    def run(self, cmd):
-        #print(f"Running: {cmd}")
-        result = subprocess.run(cmd, shell=True)
-        if result.returncode != 0:
-            print(f"ERROR running command: {cmd}")
-            sys.exit(1)
+        # The workdir is staged by stage_run, so a skipped model step touches nothing
+        self._staged = False
 
     def prepare_workdir(self):
         os.makedirs(self.workdir, exist_ok=True)
         os.chdir(self.workdir)
+        if self._staged:
+            return
 
-        # Copy namelists, xmls, binaries
-        self.run(f"cp {self.setupdir}/namelist_* {self.workdir}/")
-        self.run(f"cp {self.setupdir}/*.xml {self.workdir}/")
-        self.run(f"cp {self.setupdir}/do_* {self.workdir}/")
-        self.run(f"cp {self.setupdir}/do_bdy2d_conv.py {self.workdir}/")
-
-        self.run(f"ln -sf {self.setupdir}/coordinates.bdy.nc {self.workdir}/")
-        self.run(f"ln -sf {self.setupdir}/bfr_roughness.nc {self.workdir}/")
-        self.run(f"cp {self.setupdir}/run_nemo {self.workdir}/")
-        self.run(f"ln -sf {self.setupdir}/domain_cfg_EST_0.5nm_V110_fix.nc {self.workdir}/domain_cfg_EST_0.5nm_V110.nc")
-#        self.run(f"ln -sf {self.setupdir}/nemo.exe {self.workdir}/nemo.exe")
-        self.run(f"ln -sf {self.setupdir}/nemo_asminc.exe {self.workdir}/nemo.exe")
-        self.run(f"ln -sf {self.setupdir}/xios_server.exe {self.workdir}/xios_server.exe")
+        # Link immutable setup files, copy the templates rewritten in the workdir
+        stage_workdir(self.setupdir, self.workdir, self.SETUP_MANIFEST, private=self.SETUP_TEMPLATES)
+        self._staged = True
 
         # Create subfolders
         os.makedirs(f"{self.workdir}/initialstate", exist_ok=True)
-        os.makedirs(f"{self.workdir}/restarts", exist_ok=True)
+        os.makedirs(self.restart_dir, exist_ok=True)
         os.makedirs(f"{self.workdir}/runoff_seas", exist_ok=True)
         os.makedirs(f"{self.workdir}/bc_V110", exist_ok=True)
         os.makedirs(f"{self.workdir}/forcing_ecmwf", exist_ok=True)
@@ -89,7 +93,7 @@ class NemoModelRunner:
 #            self.ln_asmdin = ".true."
             self.ln_sshinc = ".true."
             #self.rlen_hours = 24
-            self.run(f"ln -sf {self.forcingdir}/initial/initial_run_t{rdate}.nc {self.workdir}/initial_run.nc")
+            force_symlink(self.config.path("initial_file", rdate), f"{self.workdir}/initial_run.nc")
         elif f"{self.yystart}{self.mmstart}{self.ddstart}" != current_date:
             self.ln_rstart = ".true."
             self.ln_tsd_init = ".false."
@@ -103,6 +107,8 @@ class NemoModelRunner:
 
         self.ln_asmiau = ".true."           
         self.ln_sshinc = ".true."  
+        # T/S and U/V increments only when the increment file carries them
+        self.ln_trainc, self.ln_dyninc = increment_flags(self.config.path("assim_increment", self.date_str))
 
         self.start_date = start_date
         self.stop_date = start_date + timedelta(hours=self.rlen_hours)
@@ -114,9 +120,9 @@ class NemoModelRunner:
         self.stock1 = int(24 * 3600 / self.rn_rdt)
         self.stock2 = int(2 * 24 * 3600 / self.rn_rdt)
 
-        with open("stock1_num.dat", "w") as f:
+        with open(os.path.join(self.workdir, "stock1_num.dat"), "w") as f:
             f.write(str(self.stock1) + "\n")
-        with open("stock2_num.dat", "w") as f:
+        with open(os.path.join(self.workdir, "stock2_num.dat"), "w") as f:
             f.write(str(self.stock2) + "\n")
 
     def generate_namelists(self):
@@ -134,27 +140,27 @@ class NemoModelRunner:
                          .replace("_ln_asmdin_",self.ln_asmdin)\
                          .replace("_ln_asmiau_",self.ln_asmiau)\
                          .replace("_ln_sshinc_", self.ln_sshinc)\
+                         .replace("_ln_trainc_", self.ln_trainc)\
+                         .replace("_ln_dyninc_", self.ln_dyninc)\
 
-        with open("namelist_ref", "w") as fout:
+        with open(os.path.join(self.workdir, "namelist_ref"), "w") as fout:
             fout.write(content)
 
         # Generate namelist_ice_ref
         with open(f"{self.setupdir}/namelist_ice_ref_template") as fin:
             ice_content = fin.read()
         ice_content = ice_content.replace("_ln_iceini_", self.ln_iceini)
-        with open("namelist_ice_ref", "w") as fout:
+        with open(os.path.join(self.workdir, "namelist_ice_ref"), "w") as fout:
             fout.write(ice_content)
 
     def copy_assimilation_increment(self):
         print("\n===== Copying Assimilation Increment (SLA) =====")
 
-        base_src_dir = f"{self.forcingdir}/assim/"
-        date_str = f"{self.yystart}{self.mmstart}{self.ddstart}"
-        assim_inc_src = os.path.join(base_src_dir, f"assim_background_increments.d{date_str}.nc")
+        assim_inc_src = self.config.path("assim_increment", self.date_str)
         assim_inc_dst = os.path.join(self.workdir, "assim_background_increments.nc")
 
-
-        assim_di_src = os.path.join(base_src_dir, "assim_background_state_DI.nc")
+        # Dated DI state, as written by create_assim_background_files
+        assim_di_src = self.config.path("assim_di_state", self.date_str)
         assim_di_dst = os.path.join(self.workdir, "assim_background_state_DI.nc")
 
         # Check assimilation flags
@@ -182,15 +188,27 @@ class NemoModelRunner:
             else:
                 print(f"WARNING: Direct Initialization file not found: {assim_di_src}")
             
+    def restart_outputs(self):
+        """Restart tiles of this run: the outputs that mark the model step complete."""
+        return [f"{self.restart_dir}/*_restart_out_*.nc"]
+
+    def restart_step(self, rdir):
+        """Restart timestep written by the run in rdir (stock1_num.dat), else the configured one."""
+        stock1_file = os.path.join(rdir, "stock1_num.dat")
+        if os.path.exists(stock1_file):
+            with open(stock1_file) as f:
+                num = int(f.read().strip())
+            print(f"Read restart timestep from stock1_num.dat: {num}")
+        else:
+            num = self.stock1
+            print(f"WARNING: stock1_num.dat not found, using default restart timestep: {num}")
+        return num
+
     def link_restart(self):
         print("\n===== Linking Restart Files =====")
 
-        # Determine previous day
-        restart_date = self.start_date - timedelta(days=1)
-        yyrest, mmrest, ddrest = restart_date.strftime("%Y"), restart_date.strftime("%m"), restart_date.strftime("%d")
-        base_restart_dir = f"/ec/res4/scratch/eeim/nemo_{self.runid_s}/"
-#        rdir = f"{base_restart_dir}NEMO42_EST_0.5nm_op_{yyrest}{mmrest}{ddrest}/"
-        rdir = f"{base_restart_dir}NEMO5_EST_0.5nm_op_{yyrest}{mmrest}{ddrest}/"
+        # Run directory of the previous day
+        rdir = self.config.path("prev_rundir", f"{self.start_date:%Y%m%d}")
         print(f"Looking for restart in: {rdir}")
 
         if not os.path.exists(rdir):
@@ -198,32 +216,45 @@ class NemoModelRunner:
             sys.exit(1)
 
         # Detect restart step number
-        stock1_file = os.path.join(rdir, "stock1_num.dat")
-        if os.path.exists(stock1_file):
-            with open(stock1_file) as f:
-                num = int(f.read().strip())
-            print(f"Read restart timestep from stock1_num.dat: {num}")
-        else:
-            num = self.stock1
-            print(f"WARNING: stock1_num.dat not found, using default restart timestep: {num}")
+        num = self.restart_step(rdir)
 
         restnn = f"{num:08d}"
 #        reststr = f"{self.runid}_{restnn}"
         reststr = f"{self.runid}_{restnn}"        
-        nd = 256  # number of subdomains (adapt if needed)
+        nd = self.config.nproc  # number of ocean subdomains of this run
 
         print(f"Restart string: {reststr}")
-        print(f"Linking {nd} domain restart files...")
 
-        restart_src_dir = os.path.join(rdir, "restarts")
+        restart_src_dir = self.config.path("prev_restart_dir", self.date_str)
         restart_dst_dir = os.path.join(self.workdir, "initialstate")
 
         if not os.path.exists(restart_dst_dir):
             os.makedirs(restart_dst_dir)
 
-        # Clean existing initialstate links
-        self.run(f"rm -f {restart_dst_dir}/restart_in_*.nc")
-        self.run(f"rm -f {restart_dst_dir}/restart_ice_in_*.nc")
+        # Clean existing initialstate links and rebuilt global restarts
+        remove_matching(f"{restart_dst_dir}/restart_in_*.nc", f"{restart_dst_dir}/restart_in.nc",
+                        f"{restart_dst_dir}/restart_ice_in_*.nc", f"{restart_dst_dir}/restart_ice_in.nc")
+
+        # Preflight: never submit a run that would stop on missing or stale restart tiles
+        problems, prev_nd = preflight_restart(restart_src_dir, self.runid, num)
+        if problems:
+            for problem in problems:
+                print(f"ERROR: Restart preflight: {problem}")
+            print(f"ERROR: Incomplete restart in {restart_src_dir}, not submitting")
+            sys.exit(1)
+        print(f"[OK] Restart preflight passed ({prev_nd} ocean tiles at step {num})")
+
+        # Different decomposition in the previous run: NEMO reads a global restart with any decomposition
+        ocean_prefix = f"{restart_src_dir}/{reststr}_restart_out"
+        ice_prefix = f"{restart_src_dir}/{reststr}_restart_ice_out"
+        if prev_nd != nd:
+            print(f"[INFO] Previous run used {prev_nd} subdomains, this run {nd}: rebuilding global restarts")
+            rebuild_restart(ocean_prefix, f"{restart_dst_dir}/restart_in.nc")
+            if restart_tiles(ice_prefix):
+                rebuild_restart(ice_prefix, f"{restart_dst_dir}/restart_ice_in.nc")
+            return
+
+        print(f"Linking {nd} domain restart files...")
 
         for d in range(nd):
             dd = f"{d:04d}"
@@ -235,29 +266,32 @@ class NemoModelRunner:
 
             if os.path.exists(ocean_src):
                 #print(f"Linking ocean restart: {ocean_src} -> {ocean_dst}")
-                self.run(f"ln -sf {ocean_src} {ocean_dst}")
+                force_symlink(ocean_src, ocean_dst)
             else:
-                print(f"WARNING: Missing ocean restart: {ocean_src}")
+                print(f"ERROR: Missing ocean restart: {ocean_src}")
+                sys.exit(1)
 
             if os.path.exists(ice_src):
                 #print(f"Linking ice restart: {ice_src} -> {ice_dst}")
-                self.run(f"ln -sf {ice_src} {ice_dst}")
+                force_symlink(ice_src, ice_dst)
             else:
-                print(f"WARNING: Missing ice restart: {ice_src}")
+                print(f"ERROR: Missing ice restart: {ice_src}")
+                sys.exit(1)
             
 #import glob
 #    def link_meteo(self):
 #        self.run(f"rm {self.workdir}/forcing_ecmwf/FORCE_*")
 #        self.run(f"ln -sf {self.meteodir}/meteo_nemo_ecmwf_BAL/weights_meteo* {self.workdir}/forcing_ecmwf/")
-#        meteo_path = f"{self.meteodir}/meteo_nemo_ecmwf_BAL/{self.yystart}/{self.mmstart}/{self.ddstart}/00/"
+#        meteo_path = self.config.path("meteo_dir", self.date_str) + "/"
 #        self.run(f"ln -sf {meteo_path}/FORCE_*{self.workdir}/ forcing_ecmwf/")
     def link_meteo(self):
         print("\n===== Linking Meteo Forcing =====")
 
-        self.run(f"rm -f {self.workdir}/forcing_ecmwf/FORCE_*")
-        self.run(f"ln -sf {self.meteodir}/meteo_nemo_ecmwf_BAL/weights_meteo* {self.workdir}/forcing_ecmwf/")
+        remove_matching(f"{self.workdir}/forcing_ecmwf/FORCE_*")
+        for weights in glob.glob(f"{self.config.path('meteo_root')}/weights_meteo*"):
+            force_symlink(weights, f"{self.workdir}/forcing_ecmwf/{os.path.basename(weights)}")
 
-        meteo_path = f"{self.meteodir}/meteo_nemo_ecmwf_BAL/{self.yystart}/{self.mmstart}/{self.ddstart}/00/"
+        meteo_path = self.config.path("meteo_dir", self.date_str) + "/"
         print(f"Looking for meteo forcing files in: {meteo_path}")
 
         if not os.path.exists(meteo_path):
@@ -271,13 +305,13 @@ class NemoModelRunner:
             for file in forcing_files:
                 filename = os.path.basename(file)
                 print(f"Linking {file} -> {self.workdir}/forcing_ecmwf/{filename}")
-                self.run(f"ln -sf {file} {self.workdir}/forcing_ecmwf/{filename}")
+                force_symlink(file, f"{self.workdir}/forcing_ecmwf/{filename}")
 
     def link_runoff(self):
         print("\n===== Linking Runoff Forcing =====")
 
         # Remove existing runoff files
-        self.run(f"rm -f {self.workdir}/runoff_seas/river_data_*")
+        remove_matching(f"{self.workdir}/runoff_seas/river_data_*")
 
         rqdir = f"{self.runoffdir}/runoff_q_seasonal"
         rtdir = f"{self.runoffdir}/runoff_t_atmt2"
@@ -290,7 +324,7 @@ class NemoModelRunner:
         if not os.path.exists(river_static_src):
             print(f"ERROR: Static runoff file not found: {river_static_src}")
             sys.exit(1)
-        self.run(f"ln -sf {river_static_src} {river_static_dst}")
+        force_symlink(river_static_src, river_static_dst)
 
         # Now link dynamic daily runoff files
         for day_offset in range(self.n_days + 1):
@@ -304,7 +338,7 @@ class NemoModelRunner:
             if not os.path.exists(q_src):
                 print(f"WARNING: Runoff discharge file missing: {q_src}")
             else:
-                self.run(f"ln -sf {q_src} {q_dst}")
+                force_symlink(q_src, q_dst)
 
             t_src = f"{rtdir}/river_data_t_y{self.yystart}m{self.mmstart}d{self.ddstart}.nc"
             t_dst = f"{self.workdir}/runoff_seas/river_data_t_y{yy}m{mm}d{dd}.nc"
@@ -313,14 +347,14 @@ class NemoModelRunner:
             if not os.path.exists(t_src):
                 print(f"WARNING: Runoff temperature file missing: {t_src}")
             else:
-                self.run(f"ln -sf {t_src} {t_dst}")
+                force_symlink(t_src, t_dst)
 
     def link_boundary(self):
         print("\n===== Linking Boundary Forcing =====")
 
-        self.run(f"rm -f {self.workdir}/bc_V110/bdy*")
+        remove_matching(f"{self.workdir}/bc_V110/bdy*")
 
-        bdydir_run = f"{self.bdydir}/cmems_nrt_bc_V110/{self.yystart}/{self.mmstart}/{self.ddstart}/00/"
+        bdydir_run = self.config.path("boundary_dir", self.date_str) + "/"
         print(f"Boundary directory: {bdydir_run}")
 
         if not os.path.exists(bdydir_run):
@@ -336,7 +370,7 @@ class NemoModelRunner:
                 filename = os.path.basename(file)
                 target = f"{self.workdir}/bc_V110/{filename}"
                 #print(f"Linking 2D boundary: {file} -> {target}")
-                self.run(f"ln -sf {file} {target}")
+                force_symlink(file, target)
 
         # Link 3D boundary files
         bdy3d_files = glob.glob(f"{bdydir_run}/bdy_hourly_3d_*")
@@ -347,35 +381,26 @@ class NemoModelRunner:
                 filename = os.path.basename(file)
                 target = f"{self.workdir}/bc_V110/{filename}"
                 #print(f"Linking 3D boundary: {file} -> {target}")
-                self.run(f"ln -sf {file} {target}")
+                force_symlink(file, target)
 
     def cpandadjust_boundary(self):
         print("\n===== Copying and Zeroing First Timestep of SLA in Boundary Forcing =====")
 
-        import xarray as xr
-        import numpy as np
-        import os
-        import sys
-        import glob
+        import threading
+        import netCDF4
+        from concurrent.futures import ThreadPoolExecutor
+
+        # The netCDF-C library is not thread-safe: only the copies run concurrently
+        nc_lock = threading.Lock()
 
-        # Setup paths
-        date_str = f"{self.yystart}{self.mmstart}{self.ddstart}"
-        bdy_dir = os.path.join(self.forcingdir, "boundary")
         target_dir = os.path.join(self.workdir, "bc_V110")
         os.makedirs(target_dir, exist_ok=True)
 
         # Clear old 2D files
-        self.run(f"rm -f {target_dir}/bdy_hourly_2d_*")
+        remove_matching(f"{target_dir}/bdy_hourly_2d_*")
 
         # Input files
-        bdydir_run = os.path.join(
-            self.bdydir,
-            "cmems_nrt_bc_V110",
-            self.yystart,
-            self.mmstart,
-            self.ddstart,
-            "00"
-        )
+        bdydir_run = self.config.path("boundary_dir", self.date_str)
         bdy2d_files = sorted(glob.glob(os.path.join(bdydir_run, "bdy_hourly_2d_*.nc")))
         if not bdy2d_files:
             print(f"ERROR: No 2D boundary files found in {bdydir_run}")
@@ -383,20 +408,26 @@ class NemoModelRunner:
 
         print(f"[INFO] Processing {len(bdy2d_files)} 2D boundary files...")
 
-        for src in bdy2d_files:
+        def adjust(src):
             fname = os.path.basename(src)
             dst = os.path.join(target_dir, fname)
-
-            ds = xr.open_dataset(src)
-            if "sla" in ds:
-                sla = ds["sla"].copy()
-                sla[0] = 0.0  # Zero out first timestep
-                ds["sla"] = sla
-                ds.to_netcdf(dst, format="NETCDF4_CLASSIC")
-                print(f"[OK] Zeroed SLA[0] in {fname}")
-            else:
-                print(f"[SKIP] No 'sla' found in {fname}; copying as-is")
-                ds.to_netcdf(dst, format="NETCDF4_CLASSIC")
+            with nc_lock, netCDF4.Dataset(src) as nc:
+                has_sla = "sla" in nc.variables
+            if not has_sla:
+                force_symlink(src, dst)
+                return f"[SKIP] No 'sla' found in {fname}; linked as-is"
+
+            # Private copy-on-write clone (never a hard link: the patch must not reach the forcing archive),
+            # then overwrite only the first record in place
+            action = reflink_or_copy(src, dst)
+            with nc_lock, netCDF4.Dataset(dst, "a") as nc:
+                nc.variables["sla"][0] = 0.0  # Zero out first timestep
+            return f"[OK] Zeroed SLA[0] in {fname} ({action})"
+
+        workers = min(len(bdy2d_files), int(os.environ.get("NEMO_BDY_WORKERS", 8)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for message in pool.map(adjust, bdy2d_files):
+                print(message)
 
         # === Link 3D boundary files as-is
         bdy3d_files = glob.glob(os.path.join(bdydir_run, "bdy_hourly_3d_*"))
@@ -406,11 +437,12 @@ class NemoModelRunner:
             for file in bdy3d_files:
                 filename = os.path.basename(file)
                 target = os.path.join(target_dir, filename)
-                self.run(f"ln -sf {file} {target}")
+                force_symlink(file, target)
                 print(f"[LINKED] 3D boundary file: {filename}")
 
 
 
+    @timed()
     def launch_model(self):
         print("\n===== Launching NEMO Model =====")
 
@@ -433,25 +465,22 @@ class NemoModelRunner:
             f.write(str(now_timestamp) + "\n")
         print(f"Model start time written to model_last_start: {now_timestamp}")
 
-        # Submit the actual NEMO run via sbatch
+        # Submit the actual NEMO run via sbatch (or the local stand-in, see backends.py)
         log_out = os.path.join(self.workdir, "nemo_run_stdout.log")
         log_err = os.path.join(self.workdir, "nemo_run_stderr.log")
-        run_command = (
-            f"sbatch -W "
-            f"--export=ALL,model_run_dir={self.workdir} "
-            f"--output={log_out} "
-            f"--error={log_err} "
-            f"run_nemo"
-        )
-
-        print(f"Submitting NEMO job with command: {run_command}")
-
-        result = subprocess.run(run_command, shell=True)
-        if result.returncode != 0:
-            print(f"ERROR: sbatch job submission failed!")
+        try:
+            submit_job("run_nemo", self.workdir, export={"model_run_dir": self.workdir},
+                       output=log_out, error=log_err)
+        except CommandError as e:
+            print(f"ERROR: sbatch job submission failed! {e}")
             sys.exit(1)
-        else:
-            print("NEMO job finished successfully.")
+        print("NEMO job finished successfully.")
+
+        # Restart index for the preflight of the next cycle
+        try:
+            write_restart_index(self.restart_dir, self.runid, self.stock1)
+        except (OSError, KeyError, ValueError) as e:
+            print(f"WARNING: Could not write restart index: {e}")
 
 
     import shutil
@@ -482,12 +511,9 @@ class NemoModelRunner:
     def upload_outputs(self, lt0=[0, 1, 2, 3, 4, 5]):
         print("\n===== Uploading Model Outputs via rsync =====")
 
-        USER = "ilja.maljutenko"
-        HOST = "atlas.msi.ttu.ee"
-        odir = "/mnt/archive/ECMWF_op/"
-        rsyncop = "-avz --inplace --checksum --ignore-times"
         rundir = self.workdir  # already defined in the class
         runid = self.runid
+        uploads = []
 
         for n in lt0:
             # Date range for filename
@@ -527,17 +553,12 @@ class NemoModelRunner:
 
                 # Prepare remote path
                 remote_path = remote_template.format(runid=runid)
-                rsync_cmd = (
-                    f"rsync {rsyncop} "
-                    f"--rsh='ssh -p2222' "
-                    f"--rsync-path=\"mkdir -p {odir}{remote_path} && rsync\" "
-                    f"{dst_path} {USER}@{HOST}:{odir}{remote_path}"
-                )
-
-                print(f"Uploading: {dst_path} → {odir}{remote_path}")
-                result = subprocess.run(rsync_cmd, shell=True)
-                if result.returncode != 0:
-                    print(f"ERROR: rsync failed for {dst_path}")
+                print(f"Uploading: {dst_path} → {remote_path}")
+                uploads.append((dst_path, remote_path))
+
+        # Independent transfers (rsync, or the local archive stand-in); failures do not stop the others
+        for dst_path in upload_files(uploads):
+            print(f"ERROR: rsync failed for {dst_path}")
 #            for fname, remotepath in file_pairs:
 #                fpath = os.path.join(rundir, fname)
 #                if not os.path.exists(fpath):
@@ -557,9 +578,11 @@ class NemoModelRunner:
 #                    print(f"ERROR uploading {fname}")
 
 
-    def full_run(self):
+    @timed()
+    def stage_run(self):
+        """Prepare the complete workdir (namelists, restart, forcing) without submitting."""
+        self.prepare_workdir()
         self.configure_run()
-        self.prepare_workdir()         
         self.generate_namelists()
         if self.ln_tsd_init.lower() == ".false.":
             self.link_restart()
@@ -577,5 +600,8 @@ class NemoModelRunner:
         self.link_meteo()
         self.link_runoff()
 #        self.link_boundary()
+
+    def full_run(self):
+        self.stage_run()
         self.launch_model()
         #self.upload_outputs(lt0=[0])
@@ -0,0 +1,69 @@
+"""
+Hyperslab reader for NEMO output files.
+
+Reads single records of a variable through netCDF4 instead of realising the
+whole file with xarray. Open handles are kept in a small LRU for the whole
+assimilation step of a cycle, so the variable lookups and the per-variable,
+per-level-block reads of the previous run's grid_T / 3-D output reuse one
+handle per file. The drivers call close_nemo_dataset() once the increment
+is written, before the model run.
+"""
+import os
+from collections import OrderedDict
+
+import numpy as np
+import netCDF4
+
+MAX_OPEN = int(os.environ.get("NEMO_READER_MAX_OPEN", 4))
+TIME_DIMS = ("time_counter", "time", "t")
+
+_handles = OrderedDict()
+
+
+def open_nemo_dataset(path):
+    """Return a cached read-only netCDF4.Dataset, closing the least recently used one if needed."""
+    path = os.path.abspath(path)
+    nc = _handles.pop(path, None)
+    if nc is None or not nc.isopen():
+        nc = netCDF4.Dataset(path, "r")
+    _handles[path] = nc
+    while len(_handles) > MAX_OPEN:
+        _, old = _handles.popitem(last=False)
+        old.close()
+    return nc
+
+
+def close_nemo_dataset(path=None):
+    """Close one cached file, or all of them when path is None."""
+    paths = [os.path.abspath(path)] if path else list(_handles)
+    for p in paths:
+        nc = _handles.pop(p, None)
+        if nc is not None and nc.isopen():
+            nc.close()
+
+
+def read_record(path, var, record=-1, levels=None):
+    """
+    Read one time record of `var` as a float array with NaN where masked.
+    `levels` optionally selects a slice of the vertical axis (second dimension
+    of 4-D variables). Size-1 dimensions are squeezed.
+    """
+    v = open_nemo_dataset(path).variables[var]
+    index = []
+    for i, dim in enumerate(v.dimensions):
+        if dim in TIME_DIMS:
+            index.append(record)
+        elif levels is not None and v.ndim == 4 and i == 1:
+            index.append(levels)
+        else:
+            index.append(slice(None))
+
+    data = v[tuple(index)]
+    if np.ma.isMaskedArray(data):
+        data = data.astype(np.float32).filled(np.nan)
+    return np.squeeze(np.asarray(data, dtype=np.float32))
+
+
+def read_last_record(path, var):
+    """Last time record of `var` (e.g. SSH at the end of the previous run)."""
+    return read_record(path, var, record=-1)
@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""
+NEMO restart tiles: check, rebuild to one global file, re-split for another decomposition.
+
+Every tile {prefix}_NNNN.nc carries the IOIPSL DOMAIN_* attributes
+(DOMAIN_number_total, DOMAIN_number, DOMAIN_size_global, DOMAIN_size_local,
+DOMAIN_position_first, DOMAIN_halo_size_start/end) that place its x/y window
+in the global grid.
+
+- rebuild : one variable per process (ProcessPoolExecutor), each reading
+            that variable from all tiles; the global file is written with
+            one chunk per record/level and light zlib compression.
+            Land-only subdomains removed by NEMO are left at 0.
+- split   : writes jpni x jpnj tiles with NEMO's mpp_basesplit sizes, one
+            tile per process, reading only the tile window of the global file.
+- check   : tile count, numbering and layout consistency.
+- advance : stand-in for a model run (local fake scheduler): the restart
+            read from initialstate/ is written as the tiles of the next
+            restart step in restarts/, so the next cycle's preflight passes.
+- index   : restart_index.json written next to the tiles when a run
+            finishes (tile counts, sizes, restart step from stock1_num.dat),
+            so the next cycle's completeness check is a JSON read; the
+            presence, size and kt stamp of every tile are then confirmed
+            in one parallel scan.
+
+NEMO also reads a single global restart_in.nc with any decomposition, so
+link_restart uses a rebuild when the tile count changed between cycles.
+
+Usage:
+  python nemo_restart_tool.py check   RESTART/EST05nm_op_deode21_00000576_restart_out
+  python nemo_restart_tool.py rebuild RESTART/EST05nm_op_deode21_00000576_restart_out restart_in.nc [--workers 8]
+  python nemo_restart_tool.py split   restart_in.nc initialstate/restart_in --jpni 16 --jpnj 16 [--workers 8]
+  python nemo_restart_tool.py index     RUNDIR/restarts EST05nm_op_deode21 576
+  python nemo_restart_tool.py preflight RUNDIR/restarts EST05nm_op_deode21 576
+"""
+import os
+import re
+import sys
+import glob
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import netCDF4
+
+from scratch import tmp_path
+from workdir_staging import reflink_or_copy
+from nc_profiles import var_options, file_format
+
+XY_DIMS = ("y", "x")
+INDEX_FILE = "restart_index.json"
+KINDS = ("restart_out", "restart_ice_out")
+
+
+def restart_tiles(prefix):
+    """Sorted {prefix}_NNNN.nc tile files."""
+    pattern = re.compile(re.escape(os.path.basename(prefix)) + r"_(\d{4,})\.nc$")
+    files = glob.glob(f"{glob.escape(prefix)}_*.nc")
+    return sorted(f for f in files if pattern.search(os.path.basename(f)))
+
+
+def tile_layout(path):
+    """DOMAIN_* placement of one tile as 0-based (j0, j1, i0, i1) global window plus local crop."""
+    nc = netCDF4.Dataset(path)
+    try:
+        a = {k: np.atleast_1d(nc.getncattr(k)) for k in nc.ncattrs() if k.startswith("DOMAIN_")}
+    finally:
+        nc.close()
+    first = a["DOMAIN_position_first"] - 1
+    local = a["DOMAIN_size_local"]
+    hs = a.get("DOMAIN_halo_size_start", np.zeros(2, int))
+    he = a.get("DOMAIN_halo_size_end", np.zeros(2, int))
+    return dict(
+        number=int(a["DOMAIN_number"][0]),
+        total=int(a["DOMAIN_number_total"][0]),
+        global_size=tuple(int(n) for n in a["DOMAIN_size_global"]),   # (nx, ny)
+        window=(int(first[1] + hs[1]), int(first[1] + local[1] - he[1]),
+                int(first[0] + hs[0]), int(first[0] + local[0] - he[0])),
+        crop=(int(hs[1]), int(local[1] - he[1]), int(hs[0]), int(local[0] - he[0])),
+    )
+
+
+def check_tiles(prefix, expected=None):
+    """
+    Layouts of a complete, consistent tile set. Raises ValueError listing
+    what is missing or inconsistent.
+    """
+    files = restart_tiles(prefix)
+    if not files:
+        raise ValueError(f"No restart tiles found for {prefix}")
+    layouts = [tile_layout(f) for f in files]
+    total = layouts[0]["total"]
+    problems = []
+    if expected is not None and total != expected:
+        problems.append(f"decomposition has {total} tiles, expected {expected}")
+    if len({lay["total"] for lay in layouts}) != 1 or len({lay["global_size"] for lay in layouts}) != 1:
+        problems.append("tiles come from different decompositions or grids")
+    missing = sorted(set(range(total)) - {lay["number"] for lay in layouts})
+    if missing:
+        problems.append(f"{len(missing)} of {total} tiles missing (e.g. {missing[:5]})")
+    if len(files) != total:
+        problems.append(f"{len(files)} files for {total} tiles")
+    if problems:
+        raise ValueError(f"{prefix}: " + "; ".join(problems))
+    return files, layouts
+
+
+def _is_tiled(var):
+    return var.dimensions[-2:] == XY_DIMS
+
+
+def _assemble(args):
+    """Worker: one variable assembled from all tiles."""
+    name, files, layouts = args
+    out = None
+    for path, lay in zip(files, layouts):
+        nc = netCDF4.Dataset(path)
+        try:
+            v = nc.variables[name]
+            v.set_auto_mask(False)
+            if out is None:
+                nx, ny = lay["global_size"]
+                out = np.zeros(v.shape[:-2] + (ny, nx), dtype=v.dtype)
+            j0, j1, i0, i1 = lay["window"]
+            cj0, cj1, ci0, ci1 = lay["crop"]
+            out[..., j0:j1, i0:i1] = v[..., cj0:cj1, ci0:ci1]
+        finally:
+            nc.close()
+    return name, out
+
+
+def _copy_header(src, dst, sizes, skip_attrs=("DOMAIN_",)):
+    for dim, length in src.dimensions.items():
+        dst.createDimension(dim, None if length.isunlimited() else sizes.get(dim, len(length)))
+    dst.setncatts({k: src.getncattr(k) for k in src.ncattrs() if not k.startswith(skip_attrs)})
+
+
+def _create_var(dst, var, shape):
+    # Tiled fields: one chunk per record and level, precision kept (nc_profiles "restart")
+    options = var_options("restart", var.dimensions, shape) if _is_tiled(var) else {}
+    v = dst.createVariable(var.name, var.dtype, var.dimensions, **options)
+    v.setncatts({k: var.getncattr(k) for k in var.ncattrs() if k != "_FillValue"})
+    return v
+
+
+def rebuild_restart(prefix, out_path, workers=None, expected=None):
+    """Rebuild {prefix}_NNNN.nc tiles into the global restart out_path."""
+    files, layouts = check_tiles(prefix, expected)
+    nx, ny = layouts[0]["global_size"]
+    print(f"[INFO] Rebuilding {len(files)} tiles -> {out_path} ({nx} x {ny})")
+
+    first = netCDF4.Dataset(files[0])
+    tmp = tmp_path(out_path)
+    out = netCDF4.Dataset(tmp, "w", format=file_format("restart"))
+    try:
+        first.set_auto_mask(False)
+        _copy_header(first, out, {"x": nx, "y": ny})
+        tiled = []
+        for name, var in first.variables.items():
+            if _is_tiled(var):
+                tiled.append(name)
+                _create_var(out, var, var.shape[:-2] + (ny, nx))
+            else:
+                _create_var(out, var, var.shape)[...] = var[...]
+
+        jobs = [(name, files, layouts) for name in tiled]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for name, data in pool.map(_assemble, jobs):
+                out.variables[name][...] = data
+    finally:
+        out.close()
+        first.close()
+    os.replace(tmp, out_path)
+    print(f"[OK] Rebuilt {len(tiled)} tiled variables into {out_path}")
+    return out_path
+
+
+def basesplit(n, parts):
+    """NEMO mpp_basesplit: the first (1 + (n-1) % parts) pieces are one point larger."""
+    big = (n + parts - 1) // parts
+    nbig = 1 + (n - 1) % parts
+    sizes = [big if k < nbig else big - 1 for k in range(parts)]
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    return [(int(s), int(s + size)) for s, size in zip(starts, sizes)]
+
+
+def _write_tile(args):
+    """Worker: one tile of the global restart."""
+    global_path, out_path, number, total, (j0, j1), (i0, i1) = args
+    src = netCDF4.Dataset(global_path)
+    tmp = tmp_path(out_path)
+    dst = netCDF4.Dataset(tmp, "w", format=file_format("restart"))
+    try:
+        src.set_auto_mask(False)
+        nx, ny = len(src.dimensions["x"]), len(src.dimensions["y"])
+        _copy_header(src, dst, {"x": i1 - i0, "y": j1 - j0})
+        dst.setncatts(dict(
+            DOMAIN_number_total=np.int32(total), DOMAIN_number=np.int32(number),
+            DOMAIN_dimensions_ids=np.array([1, 2], np.int32),
+            DOMAIN_size_global=np.array([nx, ny], np.int32),
+            DOMAIN_size_local=np.array([i1 - i0, j1 - j0], np.int32),
+            DOMAIN_position_first=np.array([i0 + 1, j0 + 1], np.int32),
+            DOMAIN_position_last=np.array([i1, j1], np.int32),
+            DOMAIN_halo_size_start=np.array([0, 0], np.int32),
+            DOMAIN_halo_size_end=np.array([0, 0], np.int32),
+            DOMAIN_type="BOX",
+        ))
+        for name, var in src.variables.items():
+            if _is_tiled(var):
+                _create_var(dst, var, var.shape[:-2] + (j1 - j0, i1 - i0))[...] = var[..., j0:j1, i0:i1]
+            else:
+                _create_var(dst, var, var.shape)[...] = var[...]
+    finally:
+        dst.close()
+        src.close()
+    os.replace(tmp, out_path)
+    return out_path
+
+
+def split_restart(global_path, out_prefix, jpni, jpnj, workers=None):
+    """Split a global restart into jpni x jpnj tiles {out_prefix}_NNNN.nc (i fastest)."""
+    nc = netCDF4.Dataset(global_path)
+    nx, ny = len(nc.dimensions["x"]), len(nc.dimensions["y"])
+    nc.close()
+    total = jpni * jpnj
+    jobs = []
+    for j, jwin in enumerate(basesplit(ny, jpnj)):
+        for i, iwin in enumerate(basesplit(nx, jpni)):
+            number = i + jpni * j
+            jobs.append((global_path, f"{out_prefix}_{number:04d}.nc", number, total, jwin, iwin))
+    print(f"[INFO] Splitting {global_path} into {jpni} x {jpnj} tiles")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        paths = list(pool.map(_write_tile, jobs))
+    print(f"[OK] Wrote {len(paths)} tiles {out_prefix}_NNNN.nc")
+    return paths
+
+
+def near_square(n):
+    """(jpni, jpnj) with jpni * jpnj == n and jpnj the largest divisor <= sqrt(n)."""
+    jpnj = max(d for d in range(1, int(n ** 0.5) + 1) if n % d == 0)
+    return n // jpnj, jpnj
+
+
+def _set_kt(path, step):
+    nc = netCDF4.Dataset(path, "r+")
+    try:
+        if "kt" in nc.variables:
+            nc.variables["kt"][...] = step
+    finally:
+        nc.close()
+
+
+def advance_restart(run_dir, runid, step, nproc):
+    """
+    Write the restart read from {run_dir}/initialstate (restart_in_NNNN.nc
+    tiles, or a global restart_in.nc split into nproc tiles) as the tiles of
+    timestep `step` in {run_dir}/restarts, with kt = step. Stands in for the
+    restart a real run leaves behind; returns the tiles written.
+    """
+    src_dir = os.path.join(run_dir, "initialstate")
+    dst_dir = os.path.join(run_dir, "restarts")
+    os.makedirs(dst_dir, exist_ok=True)
+    written = []
+    for kind_in, kind_out in (("restart_in", "restart_out"), ("restart_ice_in", "restart_ice_out")):
+        prefix = os.path.join(dst_dir, f"{runid}_{int(step):08d}_{kind_out}")
+        tiles = restart_tiles(os.path.join(src_dir, kind_in))
+        if tiles:
+            for src in tiles:
+                dst = f"{prefix}_{src.rsplit('_', 1)[-1]}"
+                tmp = tmp_path(dst)
+                reflink_or_copy(os.path.realpath(src), tmp)
+                _set_kt(tmp, step)
+                os.replace(tmp, dst)
+                written.append(dst)
+        elif os.path.exists(os.path.join(src_dir, f"{kind_in}.nc")):
+            for dst in split_restart(os.path.join(src_dir, f"{kind_in}.nc"), prefix, *near_square(nproc)):
+                _set_kt(dst, step)
+                written.append(dst)
+    return written
+
+
+def write_restart_index(restart_dir, runid, step):
+    """Record the restart tiles of timestep `step` in {restart_dir}/restart_index.json."""
+    index = dict(runid=runid, step=int(step), written=time.strftime("%Y-%m-%dT%H:%M:%S"), kinds={})
+    for kind in KINDS:
+        files = restart_tiles(os.path.join(restart_dir, f"{runid}_{int(step):08d}_{kind}"))
+        if not files:
+            continue
+        index["kinds"][kind] = dict(
+            total=tile_layout(files[0])["total"],
+            files={os.path.basename(f): os.path.getsize(f) for f in files},
+        )
+    path = os.path.join(restart_dir, INDEX_FILE)
+    tmp = tmp_path(path)
+    with open(tmp, "w") as f:
+        json.dump(index, f, indent=1)
+    os.replace(tmp, path)
+    counts = ", ".join(f"{kind} {len(v['files'])}/{v['total']}" for kind, v in index["kinds"].items())
+    print(f"[OK] Restart index written: {path} (step {step}: {counts or 'no tiles'})")
+    return index
+
+
+def _tile_stamp(path):
+    """Worker: (path, size, kt) of one tile; size None if missing, kt None if unreadable or absent."""
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return path, None, None
+    try:
+        nc = netCDF4.Dataset(path)
+    except OSError:
+        return path, size, "unreadable"
+    try:
+        return path, size, int(np.asarray(nc.variables["kt"][...]).ravel()[0]) if "kt" in nc.variables else None
+    finally:
+        nc.close()
+
+
+def scan_tiles(files, workers=None):
+    """(path, size, kt) of every tile, read in parallel."""
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        chunk = max(1, len(files) // (4 * (workers or os.cpu_count() or 1)))
+        return list(pool.map(_tile_stamp, files, chunksize=chunk))
+
+
+def preflight_restart(restart_dir, runid, step, kinds=KINDS, workers=None):
+    """
+    (problems, ocean tile count) of a restart from {restart_dir}; an empty list means ready.
+
+    With a matching index the completeness check is a JSON read (tile counts
+    against the decomposition); an incomplete run is refused before any tile
+    is opened. Runs without an index, or with one for another run or step,
+    fall back to the DOMAIN_* scan. The tiles are then scanned in parallel:
+    every one must exist, keep the size recorded in the index and carry kt = step.
+    """
+    problems, sizes, totals = [], {}, {}
+    path = os.path.join(restart_dir, INDEX_FILE)
+    index = None
+    if os.path.exists(path):
+        with open(path) as f:
+            index = json.load(f)
+        if index.get("runid") != runid or index.get("step") != int(step):
+            print(f"WARNING: Restart index is for {index.get('runid')} step {index.get('step')}, "
+                  f"expected {runid} step {step}; scanning the tiles instead")
+            index = None
+
+    for kind in kinds:
+        if index is not None:
+            entry = index["kinds"].get(kind)
+            if entry is None:
+                problems.append(f"no {kind} tiles in the index")
+                continue
+            if len(entry["files"]) != entry["total"]:
+                problems.append(f"{kind}: {len(entry['files'])} of {entry['total']} tiles written")
+            sizes.update({os.path.join(restart_dir, name): size for name, size in entry["files"].items()})
+            totals[kind] = entry["total"]
+        else:
+            prefix = os.path.join(restart_dir, f"{runid}_{int(step):08d}_{kind}")
+            try:
+                kind_files, layouts = check_tiles(prefix)
+            except ValueError as e:
+                problems.append(str(e))
+                continue
+            sizes.update({f: None for f in kind_files})
+            totals[kind] = layouts[0]["total"]
+
+    if sizes and not problems:
+        for tile, size, kt in scan_tiles(sorted(sizes), workers):
+            name = os.path.basename(tile)
+            if size is None:
+                problems.append(f"missing {name}")
+            elif sizes[tile] is not None and size != sizes[tile]:
+                problems.append(f"size changed since the run: {name}")
+            elif kt is not None and kt != int(step):
+                problems.append(f"{name} has kt={kt}, expected {step}")
+    return problems, totals.get("restart_out")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NEMO restart tile tool")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("check")
+    p.add_argument("prefix")
+    p.add_argument("--expected", type=int, default=None)
+    p = sub.add_parser("rebuild")
+    p.add_argument("prefix")
+    p.add_argument("output")
+    p.add_argument("--workers", type=int, default=None)
+    p = sub.add_parser("preflight")
+    p.add_argument("restart_dir")
+    p.add_argument("runid")
+    p.add_argument("step", type=int)
+    p = sub.add_parser("index")
+    p.add_argument("restart_dir")
+    p.add_argument("runid")
+    p.add_argument("step", type=int)
+    p = sub.add_parser("split")
+    p.add_argument("input")
+    p.add_argument("prefix")
+    p.add_argument("--jpni", type=int, required=True)
+    p.add_argument("--jpnj", type=int, required=True)
+    p.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    try:
+        if args.cmd == "check":
+            files, _ = check_tiles(args.prefix, args.expected)
+            print(f"[OK] {len(files)} complete restart tiles for {args.prefix}")
+        elif args.cmd == "preflight":
+            problems, total = preflight_restart(args.restart_dir, args.runid, args.step)
+            for problem in problems:
+                print(f"ERROR: {problem}")
+            if problems:
+                sys.exit(1)
+            print(f"[OK] Restart step {args.step} complete ({total} ocean tiles)")
+        elif args.cmd == "index":
+            write_restart_index(args.restart_dir, args.runid, args.step)
+        elif args.cmd == "rebuild":
+            rebuild_restart(args.prefix, args.output, args.workers)
+        else:
+            split_restart(args.input, args.prefix, args.jpni, args.jpnj, args.workers)
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Bilinear regridding from a regular lon/lat source grid (CMEMS) onto the
+model grid, in NumPy.
+
+The four source neighbours and weights of every target point are computed
+once per (source grid, target grid) pair and cached as .npz under
+{FORCINGDIR}/weights (NEMO_WEIGHTS_DIR overrides), so the remap itself is a
+single gather + weighted sum over whole (..., y, x) arrays. Like cdo
+remapbil, a target point is missing when it lies outside the source grid or
+any of its four neighbours is missing; fill_nearest then plays the part of
+cdo setmisstonn.
+"""
+import os
+import hashlib
+
+import numpy as np
+import netCDF4
+
+from nemo_config import get_config
+
+LON_NAMES = ("lon", "longitude", "nav_lon", "glamt")
+LAT_NAMES = ("lat", "latitude", "nav_lat", "gphit")
+
+
+def weights_dir(config=None):
+    return (config or get_config()).path("weights_dir")
+
+
+def grid_coords(path):
+    """2-D (lon, lat) of a grid file (e.g. bathy_meter.nc), from 1-D or 2-D coordinates."""
+    nc = netCDF4.Dataset(path)
+    try:
+        lon_name = next((n for n in LON_NAMES if n in nc.variables), None)
+        lat_name = next((n for n in LAT_NAMES if n in nc.variables), None)
+        if lon_name is None or lat_name is None:
+            raise KeyError(f"No lon/lat coordinates in {path}")
+        lon = np.squeeze(np.asarray(nc.variables[lon_name][:], dtype=np.float64))
+        lat = np.squeeze(np.asarray(nc.variables[lat_name][:], dtype=np.float64))
+    finally:
+        nc.close()
+    if lon.ndim == 1:
+        lon, lat = np.meshgrid(lon, lat)
+    return lon, lat
+
+
+def _axis_weights(src, dst):
+    """Left neighbour index and fraction along one ascending or descending 1-D axis."""
+    src = np.asarray(src, dtype=np.float64)
+    flip = src[0] > src[-1]
+    if flip:
+        src = src[::-1]
+    i = np.clip(np.searchsorted(src, dst, side="right") - 1, 0, src.size - 2)
+    frac = (dst - src[i]) / (src[i + 1] - src[i])
+    inside = (frac >= 0.0) & (frac <= 1.0)
+    if flip:
+        i, frac = src.size - 2 - i, 1.0 - frac
+    return i, frac, inside
+
+
+def bilinear_weights(src_lon, src_lat, dst_lon, dst_lat):
+    """
+    Neighbour indices (4, N) into the flattened source grid, weights (4, N)
+    and validity (N,) for every target point of the 2-D dst_lon/dst_lat.
+    """
+    nx = np.size(src_lon)
+    ix, fx, okx = _axis_weights(src_lon, np.ravel(dst_lon))
+    iy, fy, oky = _axis_weights(src_lat, np.ravel(dst_lat))
+    index = np.stack([iy * nx + ix, iy * nx + ix + 1, (iy + 1) * nx + ix, (iy + 1) * nx + ix + 1])
+    weight = np.stack([(1 - fx) * (1 - fy), fx * (1 - fy), (1 - fx) * fy, fx * fy]).astype(np.float32)
+    return dict(index=index.astype(np.int64), weight=weight, valid=okx & oky,
+                src_shape=np.array([np.size(src_lat), nx]), dst_shape=np.array(np.shape(dst_lon)))
+
+
+def _grid_key(*arrays):
+    h = hashlib.sha1()
+    for a in arrays:
+        a = np.ascontiguousarray(a, dtype=np.float64)
+        h.update(str(a.shape).encode())
+        h.update(a.tobytes())
+    return h.hexdigest()[:16]
+
+
+def cached_bilinear_weights(src_lon, src_lat, dst_lon, dst_lat, cache_dir=None):
+    """bilinear_weights(), stored once per grid pair in cache_dir."""
+    cache_dir = cache_dir or weights_dir()
+    path = os.path.join(cache_dir, f"bilinear_{_grid_key(src_lon, src_lat, dst_lon, dst_lat)}.npz")
+    if os.path.exists(path):
+        with np.load(path) as f:
+            return {k: f[k] for k in f.files}
+
+    weights = bilinear_weights(src_lon, src_lat, dst_lon, dst_lat)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp, **weights)
+    os.replace(tmp, path)
+    print(f"[OK] Bilinear weights cached: {path}")
+    return weights
+
+
+def remap_bilinear(data, weights):
+    """Remap (..., ny_src, nx_src) onto the target grid -> (..., ny_dst, nx_dst), NaN where missing."""
+    data = np.asarray(data, dtype=np.float32)
+    lead = data.shape[:-2]
+    flat = data.reshape(-1, int(np.prod(weights["src_shape"])))
+    out = np.einsum("knp,np->kp", flat[:, weights["index"]], weights["weight"])
+    out[:, ~weights["valid"]] = np.nan
+    return out.reshape(lead + tuple(int(n) for n in weights["dst_shape"]))
+
+
+def fill_nearest(data):
+    """Fill NaNs of every 2-D (y, x) slice with the nearest valid value, in place; all-NaN slices stay NaN."""
+    from scipy import ndimage
+
+    flat = data.reshape(-1, *data.shape[-2:])
+    cache = {}
+    for k in range(flat.shape[0]):
+        missing = np.isnan(flat[k])
+        if not missing.any() or missing.all():
+            continue
+        key = hashlib.sha1(np.packbits(missing).tobytes()).digest()
+        if key not in cache:
+            cache[key] = tuple(ndimage.distance_transform_edt(missing, return_distances=False,
+                                                              return_indices=True))
+        flat[k] = flat[k][cache[key]]
+    return data
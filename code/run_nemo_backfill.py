@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Multi-date backfill / hindcast driver for the NEMO ECMWF workflow.
+
+Runs the operational cycle for every date in [--start, --end] (same
+"date - 1 day" convention as run_nemo_ecmwf_workflow.py). While the NEMO job
+of day N runs, the boundary and meteo forcing of the following days is
+prepared in background processes:
+
+  - boundary forcing : independent per day, up to --workers days in parallel
+  - meteo forcing    : one worker, strictly in date order (step-1 continuity
+                       uses the previous day's FORCE file)
+  - runoff, SSH increment and the model run itself stay in the main process,
+    in date order, so restarts are chained through link_restart.
+
+Usage:
+  python run_nemo_backfill.py --start 20241019 --end 20241118 --ndays 1 [--prefetch 3] [--workers 2] [--config cfg.json]
+"""
+import os
+import sys
+import argparse
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+
+from run_nemo_ecmwf_workflow import cycle_paths
+from nemo_config import load_config, set_config
+from cycle_state import CycleState
+from nemo_output_reader import close_nemo_dataset
+from instrumentation import flush_timeline, print_summary, timeline_path
+from eof_increment import eof_increment_available, eof_paths, generate_operational_eof_increment
+from do_boundary_cmemsnrt import run_physical_boundary
+from do_meteo_ecmwf import generate_meteo_ecmwf
+from do_runoff import generate_runoff
+from nemo_model_runner import NemoModelRunner
+from assimilation_increment import generate_operational_ssh_increment, operational_ssh_paths
+
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _forcing_step(step, date_str, ndays, config):
+    """Worker entry point: one forcing step of one cycle."""
+    # Workers may be forked after the main process moved into a run directory
+    os.chdir(CODE_DIR)
+    set_config(config).export()
+    start_date = datetime.strptime(date_str, "%Y%m%d")
+    paths = cycle_paths(start_date, config)
+    state = CycleState(date_str, config.path("state_dir"))
+    params = {"date": date_str, "ndays": ndays}
+    if step == "boundary":
+        state.run_step("boundary", run_physical_boundary, date_str, ndays, config=config,
+                       outputs=paths["bdy_outputs"], params=params)
+    elif step == "meteo":
+        state.run_step("meteo", generate_meteo_ecmwf, date_str, ndays, config=config,
+                       outputs=paths["meteo_outputs"], params=params)
+    flush_timeline(timeline_path(config.path("state_dir"), date_str))
+    return date_str, step
+
+
+def run_model_cycle(start_date, ndays, config):
+    """Runoff, SSH increment and NEMO run for one date (forcing already prepared)."""
+    date_str = start_date.strftime("%Y%m%d")
+    paths = cycle_paths(start_date, config)
+    state = CycleState(date_str, config.path("state_dir"))
+    params = {"date": date_str, "ndays": ndays}
+
+    print(f"\n===== [{date_str}] Runoff forcing =====")
+    state.run_step("runoff", generate_runoff, date_str, ndays, config=config,
+                   inputs=paths["runoff_inputs"], outputs=paths["runoff_outputs"], params=params)
+
+    try:
+        if eof_increment_available(date_str, config):
+            print(f"\n===== [{date_str}] Assimilation Increment (EOF T/S/U/V/SSH) =====")
+            eof = eof_paths(date_str, config)
+            state.run_step("assim_increment", generate_operational_eof_increment, date_str, config=config,
+                           inputs=[eof["modes"], eof["amplitudes"], eof["model_ssh"], eof["model_3d"]],
+                           outputs=[eof["inc_file"]], params=dict(params, kind="eof"))
+        else:
+            print(f"\n===== [{date_str}] Assimilation Increment (Operational SSH delta) =====")
+            ssh_paths = operational_ssh_paths(date_str, config)
+            state.run_step("assim_increment", generate_operational_ssh_increment, date_str, config=config,
+                           inputs=[ssh_paths["eof_file"], ssh_paths["nemo_file"]],
+                           outputs=[ssh_paths["inc_file"]], params=params)
+    except Exception as e:
+        print(f"WARNING: Operational increment step failed: {e}")
+    finally:
+        close_nemo_dataset()   # handles on the previous run's output
+
+    print(f"\n===== [{date_str}] Run NEMO model =====")
+    runner = NemoModelRunner(yystart=start_date.strftime("%Y"), mmstart=start_date.strftime("%m"),
+                             ddstart=start_date.strftime("%d"), ndays=ndays, config=config)
+    state.run_step("model", runner.full_run,
+                   outputs=runner.restart_outputs(),
+                   params=dict(params, members=1))
+    os.chdir(CODE_DIR)
+    print_summary(flush_timeline(timeline_path(config.path("state_dir"), date_str)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NEMO ECMWF backfill / hindcast over a date range")
+    parser.add_argument("--start", required=True, help="First target date YYYYMMDD")
+    parser.add_argument("--end", required=True, help="Last target date YYYYMMDD (inclusive)")
+    parser.add_argument("--ndays", required=True, type=int, help="Forecast length in days per cycle")
+    parser.add_argument("--prefetch", type=int, default=2, help="Days of forcing prepared ahead of the running model")
+    parser.add_argument("--workers", type=int, default=2, help="Parallel boundary preparation processes")
+    parser.add_argument("--config", default=None, help="JSON configuration file (default: NEMO_CONFIG, then the environment)")
+    parser.add_argument("--keep-scratch", action="store_true", help="Keep the per-task scratch directories (NEMO_KEEP_SCRATCH=1)")
+    args = parser.parse_args()
+
+    try:
+        first = datetime.strptime(args.start, "%Y%m%d") - timedelta(days=1)
+        last = datetime.strptime(args.end, "%Y%m%d") - timedelta(days=1)
+    except ValueError:
+        print("ERROR: Invalid date format. Use YYYYMMDD.")
+        sys.exit(1)
+    if last < first:
+        print("ERROR: --end is before --start")
+        sys.exit(1)
+
+    dates = [first + timedelta(days=i) for i in range((last - first).days + 1)]
+    print(f"Backfill: {len(dates)} cycles {dates[0]:%Y%m%d} .. {dates[-1]:%Y%m%d}, prefetch {args.prefetch} days")
+
+    try:
+        config = set_config(load_config(args.config))
+    except (ValueError, OSError) as e:
+        print(f"ERROR: Invalid configuration: {e}")
+        sys.exit(1)
+    config.export()
+    if args.keep_scratch:
+        os.environ["NEMO_KEEP_SCRATCH"] = "1"
+    os.chdir(CODE_DIR)
+
+    pending = {}
+    with ProcessPoolExecutor(max_workers=args.workers) as bdy_pool, \
+         ProcessPoolExecutor(max_workers=1) as meteo_pool:
+
+        def submit_ahead(i):
+            for j in range(i, min(i + args.prefetch + 1, len(dates))):
+                if j not in pending:
+                    date_str = dates[j].strftime("%Y%m%d")
+                    pending[j] = [
+                        bdy_pool.submit(_forcing_step, "boundary", date_str, args.ndays, config),
+                        meteo_pool.submit(_forcing_step, "meteo", date_str, args.ndays, config),
+                    ]
+
+        for i, start_date in enumerate(dates):
+            submit_ahead(i)
+            for future in pending.pop(i):
+                date_str, step = future.result()
+                print(f"[OK] {step} forcing ready for {date_str}")
+            # Forcing of the next days keeps being prepared while this model runs
+            submit_ahead(i + 1)
+            run_model_cycle(start_date, args.ndays, config)
+
+    print("\n===== BACKFILL DONE =====")
+
+
+if __name__ == "__main__":
+    main()
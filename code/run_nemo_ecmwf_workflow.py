@@ -1,10 +1,11 @@
 import argparse
-import subprocess
+import atexit
 import sys
 import os
 from datetime import datetime, timedelta
 from do_meteo_ecmwf import generate_meteo_ecmwf
 from nemo_model_runner import NemoModelRunner
+from nemo_ensemble_runner import NemoEnsembleRunner, load_member_overrides
 from do_boundary_cmemsnrt import run_physical_boundary
 from init_startup import initialize_case
 from do_runoff import generate_runoff
@@ -12,23 +13,45 @@ from assimilation_increment import (
     generate_sla_increment,
     create_assim_background_files,
     generate_operational_ssh_increment,
+    operational_ssh_paths,
 )
+from cycle_state import CycleState
+from nemo_output_reader import close_nemo_dataset
+from instrumentation import flush_timeline, print_summary, timeline_path
+from eof_increment import eof_increment_available, eof_paths, generate_operational_eof_increment
+from nemo_config import load_config, set_config, dry_run
 
-def run_command(cmd):
-    print(f"\nRunning: {cmd}")
-    result = subprocess.run(cmd, shell=True)
-    if result.returncode != 0:
-        print(f"ERROR: Command failed: {cmd}")
-        sys.exit(1)
+def report_timeline(path):
+    timeline = flush_timeline(path)
+    print_summary([r for r in timeline if r.get("pid") == os.getpid()])
+    print(f"Timeline: {path}")
 
 #def generate_runoff(date_str, ndays):
 #    print(f"(placeholder) Runoff generation for {date_str}, {ndays} days")
 #    # Implement or import actual runoff generator here
 
+def cycle_paths(start_date, config):
+    """Files produced / consumed by the forcing steps of one cycle (for CycleState)."""
+    date_str = start_date.strftime("%Y%m%d")
+    lookback = [start_date - timedelta(days=d) for d in range(0, 5)]
+    return dict(
+        bdy_outputs=[f"{config.path('boundary_dir', date_str)}/bdy_hourly_*.nc"],
+        meteo_outputs=[f"{config.path('meteo_dir', date_str)}/FORCE_ecmwf_*.nc"],
+        runoff_inputs=[config.path("meteo_file", f"{p:%Y%m%d}") for p in lookback],
+        runoff_outputs=[config.path("runoff_t_file", date_str)],
+    )
+
+
 def main():
     parser = argparse.ArgumentParser(description="Unified NEMO ECMWF workflow with spin-up date shift")
     parser.add_argument("--date", required=True, help="Target start date in YYYYMMDD format")
     parser.add_argument("--ndays", required=True, type=int, help="Forecast length in days")
+    parser.add_argument("--members", type=int, default=1, help="Number of ensemble members (1 = deterministic run)")
+    parser.add_argument("--member-overrides", default=None, help="JSON file with per-member namelist overrides")
+    parser.add_argument("--force", action="store_true", help="Ignore the cycle state and rerun every step")
+    parser.add_argument("--config", default=None, help="JSON configuration file (default: NEMO_CONFIG, then the environment)")
+    parser.add_argument("--dry-run", action="store_true", help="Print the configuration and every path of the cycle, then exit")
+    parser.add_argument("--keep-scratch", action="store_true", help="Keep the per-task scratch directories (NEMO_KEEP_SCRATCH=1)")
     args = parser.parse_args()
 
     # Adjust workflow date to args.date - 1 day
@@ -46,14 +69,25 @@ def main():
 
     print(f"Adjusted workflow: Processing date {date_str} (original input was {args.date})")
 
-    # Define shared environment variables
-    FORCINGDIR = "/ec/res4/hpcperm/eeim/deode_sswf/forcing"
-    CONFDIR = "/ec/res4/hpcperm/eeim/deode_sswf/setup_N5"
-    RUNDIR = "/ec/res4/scratch/eeim/"
-    
-    os.environ["FORCINGDIR"] = FORCINGDIR
-    os.environ["CONFDIR"] = CONFDIR
-    os.environ["RUNDIR"] = RUNDIR
+    # One configuration for every stage; exported for run_nemo and the scripts started from here
+    try:
+        config = set_config(load_config(args.config))
+    except (ValueError, OSError) as e:
+        print(f"ERROR: Invalid configuration: {e}")
+        sys.exit(1)
+    if args.dry_run:
+        dry_run(config, date_str, args.ndays)
+        return
+    config.export()
+    if args.keep_scratch:
+        os.environ["NEMO_KEEP_SCRATCH"] = "1"
+
+    # Per-cycle step state: a rerun resumes from the first incomplete step
+    state = CycleState(date_str, config.path("state_dir"), force=args.force)
+    # Timeline + summary table on every exit (the runners sys.exit on errors)
+    atexit.register(report_timeline, timeline_path(config.path("state_dir"), date_str))
+    cycle_params = {"date": date_str, "ndays": args.ndays}
+    paths = cycle_paths(start_date, config)
 
         # === ECMWF OPERATIONAL WORKFLOW ===
     if date_str == "20241118":
@@ -67,22 +101,44 @@ def main():
             print(f"WARNING: Assimilation increment step failed: {e}")
     else:
         try:
-            print("\n===== STEP 1.2: Assimilation Increment (Operational SSH delta) =====")
-            generate_operational_ssh_increment(date_str)
+            if eof_increment_available(date_str, config):
+                print("\n===== STEP 1.2: Assimilation Increment (EOF T/S/U/V/SSH) =====")
+                eof = eof_paths(date_str, config)
+                state.run_step("assim_increment", generate_operational_eof_increment, date_str, config=config,
+                               inputs=[eof["modes"], eof["amplitudes"], eof["model_ssh"], eof["model_3d"]],
+                               outputs=[eof["inc_file"]], params=dict(cycle_params, kind="eof"))
+            else:
+                print("\n===== STEP 1.2: Assimilation Increment (Operational SSH delta) =====")
+                ssh_paths = operational_ssh_paths(date_str, config)
+                state.run_step("assim_increment", generate_operational_ssh_increment, date_str, config=config,
+                               inputs=[ssh_paths["eof_file"], ssh_paths["nemo_file"]],
+                               outputs=[ssh_paths["inc_file"]], params=cycle_params)
         except Exception as e:
-            print(f"WARNING: Operational SSH increment step failed: {e}")
+            print(f"WARNING: Operational increment step failed: {e}")
+        finally:
+            close_nemo_dataset()   # handles on the previous run's output
 #    sys.exit(1)
     print("\n===== STEP 2: Physical boundary (Copernicus Marine) =====")
-    run_physical_boundary(date_str, args.ndays)
+    state.run_step("boundary", run_physical_boundary, date_str, args.ndays, config=config,
+                   outputs=paths["bdy_outputs"], params=cycle_params)
 
     print("\n===== STEP 3: ECMWF meteo forcing =====")
-#    generate_meteo_ecmwf(date_str, args.ndays)
+#    state.run_step("meteo", generate_meteo_ecmwf, date_str, args.ndays, config=config,
+#                   outputs=paths["meteo_outputs"], params=cycle_params)
     print("\n===== STEP 4: Runoff forcing =====")
-#    generate_runoff(date_str, args.ndays)
+#    state.run_step("runoff", generate_runoff, date_str, args.ndays, config=config,
+#                   inputs=paths["runoff_inputs"], outputs=paths["runoff_outputs"], params=cycle_params)
     print("\n===== STEP 5: Run NEMO model =====")
 #    sys.exit(1)
-    runner = NemoModelRunner(yystart=yyyy, mmstart=mm, ddstart=dd, ndays=args.ndays)
-    runner.full_run()
+    if args.members > 1:
+        overrides = load_member_overrides(args.member_overrides)
+        runner = NemoEnsembleRunner(yystart=yyyy, mmstart=mm, ddstart=dd, ndays=args.ndays,
+                                    members=args.members, overrides=overrides, config=config)
+    else:
+        runner = NemoModelRunner(yystart=yyyy, mmstart=mm, ddstart=dd, ndays=args.ndays, config=config)
+    state.run_step("model", runner.full_run,
+                   outputs=runner.restart_outputs(),
+                   params=dict(cycle_params, members=args.members))
     
     print("\n===== SPINUP completed =====")
     sys.exit(1)
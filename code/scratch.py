@@ -0,0 +1,76 @@
+"""
+Private scratch space for the intermediates of one task.
+
+Every task (a meteo postprocess, an SLA remap, a runoff mean, ...) gets its
+own fresh directory, so cycles and members running at the same time never
+share an intermediate file name. The directories live under
+NEMO_SCRATCH_ROOT, or $TMPDIR (node-local on the compute nodes), or /tmp;
+point NEMO_SCRATCH_ROOT at /dev/shm to keep small intermediates in tmpfs.
+They are removed when the task ends, successful or not, unless
+NEMO_KEEP_SCRATCH=1 (or keep=True) keeps them for debugging.
+
+Files written in place next to their final path go through tmp_path(),
+a per-process name renamed over the target once complete;
+remove_stale_tmp() deletes the ones left behind by a crashed process.
+"""
+import os
+import re
+import glob
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+
+def scratch_root():
+    return os.environ.get("NEMO_SCRATCH_ROOT") or os.environ.get("TMPDIR") or tempfile.gettempdir()
+
+
+def keep_scratch():
+    return os.environ.get("NEMO_KEEP_SCRATCH", "0") == "1"
+
+
+@contextmanager
+def scratch_dir(task, root=None, keep=None):
+    """Fresh directory for `task` (e.g. "meteo_20250105"), removed on exit unless kept."""
+    root = root or scratch_root()
+    os.makedirs(root, exist_ok=True)
+    path = tempfile.mkdtemp(prefix=f"nemo_{re.sub(r'[^A-Za-z0-9_.-]', '_', task)}.", dir=root)
+    try:
+        yield path
+    finally:
+        if keep or (keep is None and keep_scratch()):
+            print(f"[INFO] Keeping scratch directory: {path}")
+        else:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def tmp_path(path):
+    """Temporary name next to `path`, unique per process and thread, for write + os.replace."""
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def remove_stale_tmp(path):
+    """
+    Remove the tmp_path() files of `path` whose process is gone (crashed or
+    killed before its os.replace). Files of live processes are left alone.
+    Returns the number removed.
+    """
+    removed = 0
+    for tmp in glob.glob(f"{glob.escape(path)}.*.*.tmp"):
+        m = re.fullmatch(r"\.(\d+)\.\d+\.tmp", tmp[len(path):])
+        if not m:
+            continue
+        try:
+            os.kill(int(m.group(1)), 0)
+            continue
+        except ProcessLookupError:
+            pass
+        except PermissionError:
+            continue  # alive, owned by someone else
+        try:
+            os.remove(tmp)
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
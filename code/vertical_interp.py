@@ -0,0 +1,93 @@
+"""
+Vertical interpolation from CMEMS depth levels onto the EST05 model levels.
+
+The model levels are read once per process from domain_cfg (gdept_1d, or
+rebuilt from e3w_1d the way NEMO does it), falling back to the EST05 level
+list. Interpolation indices and weights for a (source levels, model levels)
+pair are computed once; applying them is a gather of the two bracketing
+levels and a blend over whole (time, depth, y, x) arrays, instead of cdo
+intlevel searching the levels again for every timestep and column.
+"""
+import os
+from functools import lru_cache
+
+import numpy as np
+import netCDF4
+
+from nemo_config import get_config
+
+# EST05 T-level depths (m), used when domain_cfg is not available
+EST05_LEVELS = np.array([
+    1.51, 1.52, 2.5, 3.5, 4.5, 5.5, 6.5, 7.5, 8.5, 9.5, 10.5, 11.5, 12.5, 13.5, 14.5, 15.5,
+    16.5, 17.5, 18.5, 19.5, 20.5, 21.5, 22.5, 23.5, 24.5, 25.5, 26.5, 27.5, 28.5, 29.5,
+    30.5, 31.5, 32.5, 33.5, 34.5, 35.5, 36.5, 37.5, 38.5, 39.5, 40.5, 41.5, 42.5, 43.5,
+    44.5, 45.5, 46.5, 47.5, 48.5, 49.5, 50.5, 51.5, 52.5, 53.5, 54.5, 55.5, 56.5, 57.5,
+    58.5, 59.5, 60.5, 61.5, 62.5, 63.5, 64.5, 65.5, 66.5, 67.5, 68.5, 69.5, 70.5, 71.5,
+    72.5, 73.5, 74.5, 75.5, 76.5, 77.5, 78.5, 79.5, 80.5, 81.5, 82.5, 83.5, 84.5, 85.5,
+    86.5, 87.5, 88.5, 89.50001, 90.50003, 91.50011, 92.5004, 93.50152, 94.50575,
+    95.52176, 96.5815, 97.7951, 99.46341, 102.0134, 105.4451, 109.3315,
+    114, 114, 114, 114, 114, 114, 114, 114,
+])
+
+
+def domain_cfg_path(config=None):
+    return os.environ.get("DOMAIN_CFG") or (config or get_config()).path("domain_cfg")
+
+
+@lru_cache(maxsize=None)
+def model_levels(path=None):
+    """1-D model T-level depths from domain_cfg, or EST05_LEVELS if it cannot be read."""
+    path = path or domain_cfg_path()
+    if os.path.exists(path):
+        nc = netCDF4.Dataset(path)
+        try:
+            if "gdept_1d" in nc.variables:
+                return np.squeeze(np.asarray(nc.variables["gdept_1d"][:], dtype=np.float64))
+            if "e3w_1d" in nc.variables:
+                # NEMO domzgr: gdept_1d(1) = 0.5 * e3w_1d(1), gdept_1d(k) = gdept_1d(k-1) + e3w_1d(k)
+                e3w = np.squeeze(np.asarray(nc.variables["e3w_1d"][:], dtype=np.float64))
+                e3w[0] *= 0.5
+                return np.cumsum(e3w)
+        finally:
+            nc.close()
+        print(f"WARNING: No gdept_1d/e3w_1d in {path}, using EST05 default levels")
+    else:
+        print(f"WARNING: domain_cfg not found: {path}, using EST05 default levels")
+    return EST05_LEVELS
+
+
+def interp_weights(src_depth, dst_depth):
+    """
+    Bracketing source levels (k0, k1) and blend weight w of every target level.
+    Target levels above/below the source range take the first/last source level.
+    """
+    src_depth = np.asarray(src_depth, dtype=np.float64)
+    pos = np.interp(dst_depth, src_depth, np.arange(src_depth.size))
+    k0 = np.floor(pos).astype(np.intp)
+    k1 = np.minimum(k0 + 1, src_depth.size - 1)
+    return k0, k1, (pos - k0).astype(np.float32)
+
+
+def fill_below_bottom(data, axis=0):
+    """Carry the deepest valid value of every column downwards over NaN levels."""
+    valid = ~np.isnan(data)
+    shape = [1] * data.ndim
+    shape[axis] = data.shape[axis]
+    index = np.where(valid, np.arange(data.shape[axis]).reshape(shape), 0)
+    np.maximum.accumulate(index, axis=axis, out=index)
+    return np.take_along_axis(data, index, axis=axis)
+
+
+def to_model_levels(data, src_depth, dst_depth=None, axis=0, weights=None):
+    """
+    Interpolate `data` along its depth `axis` from src_depth to the model
+    levels, e.g. a (time, depth, y, x) array with axis=1.
+    """
+    if dst_depth is None:
+        dst_depth = model_levels()
+    k0, k1, w = weights if weights is not None else interp_weights(src_depth, dst_depth)
+    data = fill_below_bottom(np.asarray(data, dtype=np.float32), axis=axis)
+    shape = [1] * data.ndim
+    shape[axis] = w.size
+    w = w.reshape(shape)
+    return np.take(data, k0, axis=axis) * (1 - w) + np.take(data, k1, axis=axis) * w
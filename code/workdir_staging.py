@@ -0,0 +1,132 @@
+import os
+import glob
+import time
+import shutil
+import hashlib
+
+from scratch import tmp_path, remove_stale_tmp
+
+# Linux ioctl to share extents between two files (btrfs, xfs, ...).
+FICLONE = 0x40049409
+
+
+def file_checksum(path, blocksize=4 * 1024 * 1024):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def same_content(src, dst):
+    """True if dst already holds the content of src (same inode or same checksum)."""
+    if not os.path.exists(dst) or os.path.islink(dst):
+        return False
+    if os.path.samefile(src, dst):
+        return True
+    if os.path.getsize(src) != os.path.getsize(dst):
+        return False
+    return file_checksum(src) == file_checksum(dst)
+
+
+def reflink(src, dst):
+    import fcntl
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    shutil.copystat(src, dst)
+
+
+def reflink_or_copy(src, dst):
+    """Copy-on-write clone when the filesystem supports it, plain copy otherwise."""
+    try:
+        reflink(src, dst)
+        return "reflink"
+    except (OSError, ImportError):
+        if os.path.lexists(dst):
+            os.remove(dst)
+        shutil.copy2(src, dst)
+        return "copy"
+
+
+def force_symlink(src, dst):
+    if os.path.islink(dst) and os.readlink(dst) == src:
+        return False
+    if os.path.lexists(dst):
+        os.remove(dst)
+    os.symlink(src, dst)
+    return True
+
+
+def remove_matching(*patterns):
+    """rm -f for glob patterns; returns the number of entries removed."""
+    removed = 0
+    for pattern in patterns:
+        for path in glob.glob(pattern):
+            if os.path.islink(path) or not os.path.isdir(path):
+                os.remove(path)
+                removed += 1
+    return removed
+
+
+def stage_file(src, dst, mode):
+    """
+    Place src at dst using one of the staging modes:
+      symlink : symbolic link (large shared inputs, executables)
+      link    : hard link, falling back to reflink/copy across filesystems
+                (setup files that are replaced, never edited in place: the
+                workdir shares the inode with the setup tree)
+      copy    : private reflink/copy (templates that are rewritten in the workdir)
+    Temporaries left next to dst by an interrupted staging are removed first.
+    Returns the action taken, or "unchanged".
+    """
+    remove_stale_tmp(dst)
+    legacy_tmp = f"{dst}.stage.tmp"
+    if os.path.lexists(legacy_tmp):
+        os.remove(legacy_tmp)
+
+    if mode == "symlink":
+        return "symlink" if force_symlink(src, dst) else "unchanged"
+
+    if same_content(src, dst) and (mode == "link" or not os.path.samefile(src, dst)):
+        return "unchanged"
+
+    tmp = tmp_path(dst)
+    if mode == "link":
+        try:
+            os.link(src, tmp)
+            action = "hardlink"
+        except OSError:
+            action = reflink_or_copy(src, tmp)
+    elif mode == "copy":
+        action = reflink_or_copy(src, tmp)
+    else:
+        raise ValueError(f"Unknown staging mode: {mode}")
+    os.replace(tmp, dst)
+    return action
+
+
+def stage_workdir(srcdir, workdir, manifest, private=()):
+    """
+    Build workdir from a manifest of (pattern, target_name, mode) entries.
+    pattern is a glob relative to srcdir; target_name=None keeps the basename.
+    Targets listed in `private` are always staged as copies, since they are
+    modified in place and must never share an inode with the setup tree.
+    """
+    t0 = time.perf_counter()
+    plan = {}
+    for pattern, target, mode in manifest:
+        matches = sorted(glob.glob(os.path.join(srcdir, pattern)))
+        if not matches:
+            print(f"WARNING: No setup files match {os.path.join(srcdir, pattern)}")
+        for src in matches:
+            name = target or os.path.basename(src)
+            plan[os.path.join(workdir, name)] = (src, "copy" if name in private else mode)
+
+    counts = {}
+    for dst, (src, mode) in plan.items():
+        action = stage_file(src, dst, mode)
+        counts[action] = counts.get(action, 0) + 1
+
+    summary = ", ".join(f"{n} {a}" for a, n in sorted(counts.items()))
+    print(f"[OK] Staged {len(plan)} setup files into {workdir} ({summary}) in {(time.perf_counter() - t0) * 1000:.1f} ms")
+    return counts